@@ -0,0 +1,68 @@
+#! /usr/bin/env python
+# =COPYRIGHT=======================================================
+# Licensed Materials - Property of IBM
+#
+# (c) Copyright IBM Corp. 2017, 2018 All Rights Reserved
+#
+# US Government Users Restricted Rights - Use, duplication or
+# disclosure restricted by GSA ADP Schedule Contract with IBM Corp.
+# =================================================================
+
+"""Stress report comparison -- see 'compare_stress_reports -h' for usage"""
+
+import sys
+import argparse
+
+import lib.stats as stats
+from lib.report import ComparisonReport
+
+
+def _format(row, value):
+    if value is None:
+        return 'N/A'
+    if row['metric'] == 'throughput':
+        return '%.2f/h' % value
+    return '%.1fs' % value
+
+
+def main():
+    '''
+    Compare the percentiles and throughput of two stress test runs
+    '''
+    parser = argparse.ArgumentParser(
+        description='Compares the percentiles and throughput of two stress test reports and '
+                    'flags regressions. Exits with 1 when a regression was found.')
+    parser.add_argument(
+        'baseline', type=str,
+        help='Report (or its %s) of the baseline run' % stats.SUMMARY_SUFFIX)
+    parser.add_argument(
+        'current', type=str,
+        help='Report (or its %s) of the run to check' % stats.SUMMARY_SUFFIX)
+    parser.add_argument(
+        '-t', '--threshold', type=float, default=stats.REGRESSION_THRESHOLD * 100,
+        help='Percent a percentile may grow or the throughput may drop before it is reported '
+             'as a regression (default: %s)' % (stats.REGRESSION_THRESHOLD * 100))
+    parser.add_argument(
+        '--html', type=str, required=False,
+        help='Also write the comparison to this HTML file')
+    args = parser.parse_args()
+
+    rows = stats.compare(stats.load_summary(args.baseline), stats.load_summary(args.current),
+                         threshold=args.threshold / 100.0)
+    for row in rows:
+        change = 'N/A' if row['change'] is None else '%+.1f%%' % (row['change'] * 100)
+        print '%-40s %-10s %-8s %-10s %12s %12s %8s%s' % (
+            row['template'], row['cloud'], row['operation'], row['metric'],
+            _format(row, row['baseline']), _format(row, row['current']), change,
+            '  REGRESSION' if row['regression'] else '')
+
+    if args.html:
+        ComparisonReport('Stress test comparison: %s vs %s' % (args.baseline, args.current),
+                         rows, args.html).generate()
+
+    if any(row['regression'] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
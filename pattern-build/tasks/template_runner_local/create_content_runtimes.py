@@ -20,6 +20,7 @@ import zipfile
 import lib.local.env as env
 from lib.logger import TestLogger
 import lib.worker as worker
+from lib.template import load_template
 import gnupg
 import gnupg._parsers
 gnupg._parsers.Verify.TRUST_LEVELS["DECRYPTION_COMPLIANCE_MODE"] = 23
@@ -50,8 +51,7 @@ def get_local_template(tf_template_file, tf_variable_files):
     # parse the files -- hcl.load() dually supports both JSON and HCL formats
     # If HCL contains heredoc notation, and file has CRLF encodings, it will
     # fail. See: https://github.com/virtuald/pyhcl/issues/25
-    template_str = tf_template_file.read()  # load the entire file into String
-    hcl.loads(template_str)  # test parse / raise error on parse failure
+    template = load_template(tf_template_file)  # raise error on parse failure
 
     # read the variable file(s), updating/overwriting variables_dict as we go
     variables_dict = {}
@@ -59,7 +59,7 @@ def get_local_template(tf_template_file, tf_variable_files):
         for variable_file in tf_variable_files:
             variables_dict.update(hcl.load(variable_file)['variable'])
 
-    return [template_str, {'variable': variables_dict}]
+    return [template, {'variable': variables_dict}]
 
 
 def download_file(url, user, password):
@@ -232,11 +232,11 @@ def main():
 
     # Merge the secrets into the cam variables
     cam_variables_merged = merge_secrets(args.cam_variable_file, provider, args.cam_url)
-    [template_str, variables_dict] = get_local_template(args.tf_template_file, args.tf_variable_files)
+    [template, variables_dict] = get_local_template(args.tf_template_file, args.tf_variable_files)
 
     # Deploy the content runtime using worker.life_cycle_stack
     result = worker.life_cycle_stack(
-        "local", args.stack_name, None, None, template_str, variables_dict, cam_variables_merged,
+        "local", args.stack_name, None, None, template, variables_dict, cam_variables_merged,
         args.delete_failed_deployments, delete=args.autodestroy, template_id=template_id)
 
     if 'deploy_error' in result:
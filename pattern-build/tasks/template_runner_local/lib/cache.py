@@ -0,0 +1,77 @@
+# =COPYRIGHT=======================================================
+# Licensed Materials - Property of IBM
+#
+# (c) Copyright IBM Corp. 2017, 2018 All Rights Reserved
+#
+# US Government Users Restricted Rights - Use, duplication or
+# disclosure restricted by GSA ADP Schedule Contract with IBM Corp.
+# =================================================================
+
+import os
+import time
+import threading
+
+# Seconds CAM reference data (providers, cloud connections, template details) is reused,
+# override with CAM_CACHE_TTL, 0 disables the cache
+CACHE_TTL = int(os.getenv('CAM_CACHE_TTL', '300'))
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class TTLCache(object):
+    '''
+    Thread safe cache of values that expire ttl seconds after they were loaded
+    '''
+
+    def __init__(self, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self.entries = {}
+        self._reset()
+
+    def _reset(self):
+        # A lock held by another thread at fork time would never be released in the child
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._reset()
+
+    def get(self, key, load):
+        '''
+        Return the cached value of key, calling load() if it is missing or expired.
+        A None value from load() is returned but not cached.
+        '''
+        self._check_fork()
+        with self._lock:
+            entry = self.entries.get(key)
+        if entry and entry[0] > time.time():
+            return entry[1]
+
+        value = load()
+        if value is not None and self.ttl > 0:
+            with self._lock:
+                self.entries[key] = (time.time() + self.ttl, value)
+        return value
+
+    def invalidate(self, key=None):
+        '''
+        Drop the cached value of key, or every cached value without a key
+        '''
+        self._check_fork()
+        with self._lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+
+def get_reference_cache(key):
+    '''
+    Return the reference data cache of the CAM instance identified by key, usually its URL
+    '''
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = TTLCache()
+        return _caches[key]
@@ -0,0 +1,103 @@
+# =COPYRIGHT=======================================================
+# Licensed Materials - Property of IBM
+#
+# (c) Copyright IBM Corp. 2017, 2018 All Rights Reserved
+#
+# US Government Users Restricted Rights - Use, duplication or
+# disclosure restricted by GSA ADP Schedule Contract with IBM Corp.
+# =================================================================
+
+import os
+import json
+import threading
+
+_loaded = {}
+_lock = threading.Lock()
+
+
+class Translation(dict):
+    '''
+    The translation file (testing_variables.json) with its node, global and virtual_machines
+    sections indexed, so resolving a variable is a dictionary lookup. Shared by every deploy of
+    the process, it must not be modified.
+    '''
+
+    def __init__(self, variables):
+        super(Translation, self).__init__(variables)
+        self.node_variables = self.get('node') or {}
+        self.global_variables = self.get('global') or {}
+        self.ip_fields = self.get('ip_fields') or []
+        # variable name to type, a node variable wins over a global one of the same name
+        self.types = dict((name, variable['type']) for name, variable in self.global_variables.items())
+        self.types.update((name, variable['type']) for name, variable in self.node_variables.items())
+        self._vm_variables = {}
+        self._classifier = None
+
+    @property
+    def classifier(self):
+        '''
+        The lib.translate.VariableClassifier of the suffix rules, compiled on first use
+        '''
+        if self._classifier is None:
+            from lib.translate import VariableClassifier
+            self._classifier = VariableClassifier(self)
+        return self._classifier
+
+    def vm_variables(self, image_type, use_case='default'):
+        '''
+        Return the variables of the image for the use case, None if the image or the use case
+        is not defined
+        '''
+        key = (image_type, use_case)
+        if key not in self._vm_variables:
+            from lib.translate import _resolve_usecase_variables
+            virtual_machines = self.get('virtual_machines') or {}
+            vm_variables = None
+            if image_type in virtual_machines:
+                vm_variables = _resolve_usecase_variables(virtual_machines[image_type], use_case)
+            self._vm_variables[key] = vm_variables
+        return self._vm_variables[key]
+
+
+def _load(path, parse):
+    key = (os.path.abspath(path), parse)
+    mtime = os.path.getmtime(path)
+    entry = _loaded.get(key)
+    if entry and entry[0] == mtime:
+        return entry[1]
+
+    with _lock:
+        entry = _loaded.get(key)
+        if entry and entry[0] == mtime:
+            return entry[1]
+        with open(path) as config_file:
+            value = parse(json.load(config_file))
+        _loaded[key] = (mtime, value)
+        return value
+
+
+def _identity(value):
+    return value
+
+
+def load_json(path):
+    '''
+    Return the content of a JSON file, read again only after the file changed
+    '''
+    return _load(path, _identity)
+
+
+def load_translation(path):
+    '''
+    Return the Translation of the translation file, read again only after the file changed
+    '''
+    return _load(path, Translation)
+
+
+def load_overrides(path):
+    '''
+    Return the override variables, or an empty dictionary if there is no override file
+    '''
+    if path and os.path.isfile(path):
+        return load_json(path)
+    return {}
@@ -0,0 +1,118 @@
+# =COPYRIGHT=======================================================
+# Licensed Materials - Property of IBM
+#
+# (c) Copyright IBM Corp. 2017, 2018 All Rights Reserved
+#
+# US Government Users Restricted Rights - Use, duplication or
+# disclosure restricted by GSA ADP Schedule Contract with IBM Corp.
+# =================================================================
+
+import os
+import time
+import threading
+
+from lib.logger import TestLogger
+
+# Seconds before the bearer token expires at which it is refreshed in the background
+REFRESH_MARGIN = 300
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class Credentials(object):
+    '''
+    Result of one authentication: bearer token, org, space and tenant
+    '''
+
+    def __init__(self, bearer_token, org_guid, space_guid, tenant_id):
+        self.bearer_token = bearer_token
+        self.org_guid = org_guid
+        self.space_guid = space_guid
+        self.tenant_id = tenant_id
+        self.expires_at = None
+        if bearer_token and bearer_token.get('expires_in'):
+            self.expires_at = time.time() + float(bearer_token['expires_in'])
+
+    def expiring(self, margin=0):
+        return self.expires_at is not None and time.time() >= self.expires_at - margin
+
+
+class TokenCache(object):
+    '''
+    Process wide cache of the credentials for one CAM instance, shared by every IaaS and
+    Catalog client.
+
+    The token is refreshed in the background REFRESH_MARGIN seconds before it expires. When
+    several clients get a 401 with the same token, only the first one re-authenticates and
+    the others pick up its result.
+    '''
+
+    def __init__(self, auth, tenant):
+        self.auth = auth
+        self.tenant = tenant
+        self.credentials = None
+        self.logger = TestLogger(__name__)
+        self._reset()
+
+    def _reset(self):
+        # Locks and timers do not survive a fork, start over in a new process
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._reset()
+
+    def get(self):
+        '''
+        Return valid credentials, authenticating if there are none or they expired
+        '''
+        self._check_fork()
+        credentials = self.credentials
+        if credentials is None or credentials.expiring():
+            return self.refresh(stale=credentials)
+        return credentials
+
+    def refresh(self, stale=None):
+        '''
+        Authenticate again unless another client already replaced the stale credentials
+        '''
+        self._check_fork()
+        with self._lock:
+            if self.credentials is not None and self.credentials is not stale and not self.credentials.expiring():
+                return self.credentials
+            self.logger.info('Authenticating against CAM')
+            bearer_token, org_guid, space_guid = self.auth.authenticate()
+            tenant_id = self.tenant.get_tenant_id([bearer_token, org_guid, space_guid])
+            self.credentials = Credentials(bearer_token, org_guid, space_guid, tenant_id)
+            self._schedule_refresh()
+            return self.credentials
+
+    def _schedule_refresh(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if self.credentials.expires_at is None:
+            return
+        delay = max(0, self.credentials.expires_at - REFRESH_MARGIN - time.time())
+        self._timer = threading.Timer(delay, self._background_refresh, args=(self.credentials,))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self, credentials):
+        try:
+            self.refresh(stale=credentials)
+        except Exception:
+            self.logger.exception('Background token refresh failed, clients will retry on demand')
+
+
+def get_token_cache(key, auth, tenant):
+    '''
+    Return the token cache of the CAM instance identified by key, usually its auth URL
+    '''
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = TokenCache(auth, tenant)
+        return _caches[key]
@@ -8,6 +8,7 @@
 # =================================================================
 
 import os
+import sys
 from datetime import datetime
 import time
 import json
@@ -16,12 +17,21 @@ import urllib
 from lib.logger import TestLogger
 import local.env as env
 
-import hcl
-import random, string
+import random
 from retrying import retry
 
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 from lib.translate import resolve_parameters
+from lib.template import parse_template
+from lib.config import load_overrides, load_translation
+import lib.ippool as ippool
+import lib.keypool as keypool
+from lib.minipam import MinipamClient
+from lib.session import get_session
+from lib.credentials import get_token_cache
+from lib.cache import get_reference_cache
+from lib.metrics import metrics, PHASE_RESOLVE, PHASE_CREATE
+from lib.watcher import FutureTimeout, poll_intervals
 
 if env.ENV == 'local':
     import local.env as env
@@ -34,9 +44,6 @@ else:
 
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
-POLL_INTERVAL = 120  # poll the job status every time 2 minutes
-
-
 class IaaS(object):
     '''
     IaaS APIs
@@ -44,10 +51,12 @@ class IaaS(object):
 
     def __init__(self):
         self.verify = os.environ['ENV'] != 'local'
-        self._authenticate()
-
-        auth = [self.bearer_token, self.org_guid, self.space_guid]
-        self.tenant_id = tenant.get_tenant_id(auth)
+        self.token_cache = get_token_cache(env.AUTH_HOST, auth, tenant)
+        self.credentials = self.token_cache.get()
+        self.bearer_token = self.credentials.bearer_token
+        self.org_guid = self.credentials.org_guid
+        self.space_guid = self.credentials.space_guid
+        self.tenant_id = self.credentials.tenant_id
 
         self.request_params = {
             'ace_orgGuid': self.org_guid,
@@ -55,15 +64,37 @@ class IaaS(object):
             'tenantId': self.tenant_id
             }
         self._remove_none(self.request_params)
+        # Identifies the CAM instance and tenant, CAM objects such as templates belong to it
+        self.cam_key = '%s/%s' % (env.IAAS_HOST, self.tenant_id)
+        # Providers, cloud connections and template data objects shared by the clients of a tenant
+        self.reference_data = get_reference_cache(self.cam_key)
         self.logger = TestLogger(__name__)
+        # Optional lib.watcher.StackWatcher shared with other clients, see waitForSuccess
+        self.watcher = None
+        # IP addresses reserved by the last deployment and by stack id, freed on destroy
+        self.iplist = []
+        self.iplists = {}
+
+    @property
+    def session(self):
+        '''
+        The pooled session of the current process, a client created before a fork does not
+        share the parent's connections
+        '''
+        return get_session()
 
     def _authenticate(self):
-        auth_response = auth.authenticate()
-        self.bearer_token = auth_response[0]
-        self.org_guid = auth_response[1]
-        self.space_guid = auth_response[2]
+        '''
+        Re-authenticate after a 401. Clients sharing the token cache that hit the 401 with the
+        same token wait for a single re-authentication.
+        '''
+        self.credentials = self.token_cache.refresh(stale=self.credentials)
+        self.bearer_token = self.credentials.bearer_token
 
     def _get_request_header(self):
+        # Pick up tokens refreshed in the background or by another client
+        self.credentials = self.token_cache.get()
+        self.bearer_token = self.credentials.bearer_token
         return {'Authorization': self.bearer_token['token_type'] + ' ' + self.bearer_token['access_token'], 'Accept': 'application/json'}
 
     def _get_request_params(self):
@@ -134,30 +165,30 @@ class IaaS(object):
 
     def deploy(self, stack_name, template_id, template, parameters, camVariables, retry=True, use_case='default'):
         '''
-        Deploys the template
+        Deploys the template, either a lib.template.ParsedTemplate or the template source.
+        The IP addresses reserved for the stack are released again when the deploy fails.
         '''
+        allocated = []
+        try:
+            return self._deploy(stack_name, template_id, template, parameters, camVariables, allocated,
+                                retry=retry, use_case=use_case)
+        except:
+            exc_info = sys.exc_info()
+            try:
+                self._release_ips(stack_name, allocated)
+            except Exception:
+                self.logger.exception('Failed to release the IP addresses of %s' % stack_name)
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    def _deploy(self, stack_name, template_id, template, parameters, camVariables, allocated, retry=True, use_case='default'):
+        # the addresses reserved for the stack are added to allocated
         self.logger.info('Deploying %s' % stack_name)
         self.logger.info('Deploygin template_id %s' % template_id)
 
-        template_format = "JSON" if template.strip().startswith("{") else "HCL"
-
-        # parse the template and find the provider
-        template_parsed = hcl.loads(template) # parse the JSON/HCL template into dict
-        #self.logger.info('template_parsed %s' % template_parsed)
-        template_provider=""
-        while (template_provider == ""):
-            for provider in template_parsed['provider'].keys():
-                self.logger.info('template_provider_parsed %s' % provider)
-                if provider.lower() == 'amazon ec2' or  provider.lower() == 'amazonec2' or  provider.lower() == 'aws':
-                    template_provider = provider
-                    break
-                elif provider.lower == 'vmware vsphere' or provider.lower() == 'vsphere' or  provider.lower() == 'vmware':
-                    template_provider = provider
-                    break
-                elif provider.lower() == 'ibm cloud' or provider.lower() == 'ibmcloud' or provider.lower() == 'ibm':
-                    template_provider = provider
-                    break
-
+        # parse the template and find the provider, unless the caller already did
+        template = parse_template(template)
+        template_format = template.format
+        template_provider = template.provider
 
         # template_provider = template_parsed['provider'].keys()[0]
         self.logger.info('template_provider %s' % template_provider)
@@ -177,36 +208,30 @@ class IaaS(object):
         # Ticket 1855 - Add a translation and override file environment
         # TEMPLATE_TRANSLATION set by Travis indicates the Translation type
         if os.getenv('TEMPLATE_TRANSLATION', None) and os.getenv('TEMPLATE_TRANSLATION').upper() == 'TRUE':
-            if os.path.isfile(os.getenv('OVERRIDE_FILE', None)):
-                override_file = open(os.getenv('OVERRIDE_FILE', None))
-                override_variables = json.load(override_file)
-                override_file.close()
-            else:
-                override_variables = {}
-
-            translation_file = open(os.getenv('TRANSLATION_FILE', None))
-            translation_variables = json.load(translation_file)
-            translation_file.close()
-        """
-        Get the data types for template
-        """
-        template_details=self.get_template_details(template_id)
+            # parsed once per process, again only after the files change
+            override_variables = load_overrides(os.getenv('OVERRIDE_FILE', None))
+            translation_variables = load_translation(os.getenv('TRANSLATION_FILE', None))
         """
         Get the advanced_content_runtime_chef data objects.
         Used downstream to find the instance id for content runtime
         created using rake task.
         """        
-        acrdataobjects=self.getDataObjects(template_details,"advanced_content_runtime_chef")
+        acrdataobjects=self.getTemplateDataObjects(template_id,"advanced_content_runtime_chef")
 
+        iplist = []
         # 1891, if using translations, pass them to update_cam_variables
-        if os.getenv('TEMPLATE_TRANSLATION', None).upper()=='TRUE':
-            updatedCamVariables = self.update_cam_variables(cloud_connection, camVariables, translation_variables=translation_variables,acrdataObjects=acrdataobjects)
-            updatedCamVariables, iplist = resolve_parameters(override_variables, translation_variables, updatedCamVariables, template_provider)
-            self.iplist = iplist
-            parameters = self._build_request_parameters(parameters, _decode_dict(updatedCamVariables))
-        else:
-            updatedCamVariables = self.update_cam_variables(cloud_connection, camVariables,acrdataObjects=acrdataobjects)
-            parameters = self._build_request_parameters(parameters, updatedCamVariables)
+        with metrics.timer(PHASE_RESOLVE, stack=stack_name):
+            if os.getenv('TEMPLATE_TRANSLATION', None).upper()=='TRUE':
+                updatedCamVariables = self.update_cam_variables(cloud_connection, camVariables, translation_variables=translation_variables,acrdataObjects=acrdataobjects)
+                # local pool addresses are reserved under the stack name, any client can release them
+                updatedCamVariables, iplist = resolve_parameters(override_variables, translation_variables, updatedCamVariables, template_provider,
+                                                                 owner=stack_name)
+                allocated.extend(iplist)
+                self.iplist = iplist
+                parameters = self._build_request_parameters(parameters, _decode_dict(updatedCamVariables))
+            else:
+                updatedCamVariables = self.update_cam_variables(cloud_connection, camVariables,acrdataObjects=acrdataobjects)
+                parameters = self._build_request_parameters(parameters, updatedCamVariables)
 
         request_data = {
             "cloud_connection_ids": [
@@ -228,10 +253,9 @@ class IaaS(object):
             inputDataObj=[]
             camInputDatatypes = camVariables['input_datatypes']
             if camInputDatatypes:
-                template_details=self.get_template_details(template_id)
                 for camInputDatatype in camInputDatatypes:
                     if camInputDatatype['name'] and camInputDatatype['name'] == "bastionhost":
-                        dataobjects=self.getDataObjects(template_details,"bastionhost")
+                        dataobjects=self.getTemplateDataObjects(template_id,"bastionhost")
                         bastionhostvalue=None
                         if 'bastionhostobj' in override_variables:
                             bastionhostvalue=override_variables['bastionhostobj']                        
@@ -243,7 +267,7 @@ class IaaS(object):
                         dataObject=self.getDataObject(dataobjects,bastionhostvalue)
                         inputDataObj.append(dataObject)
                     if camInputDatatype['name'] and camInputDatatype['name'] == "httpproxy":
-                        dataobjects=self.getDataObjects(template_details,"httpproxy")
+                        dataobjects=self.getTemplateDataObjects(template_id,"httpproxy")
                         httpproxyvalue=None
                         if 'httpproxy' in override_variables:
                             httpproxyvalue=override_variables['httpproxy']                        
@@ -260,7 +284,7 @@ class IaaS(object):
                     If not found use harcoded instanceid values.
                     """
                     if camInputDatatype['name'] and camInputDatatype['name'] == "advanced_content_runtime_chef":
-                        dataobjects=self.getDataObjects(template_details,"advanced_content_runtime_chef")
+                        dataobjects=self.getTemplateDataObjects(template_id,"advanced_content_runtime_chef")
                         (instance_id,advcr)=self.get_default_instance_ids(cloud_connection, dataobjects)
                         if instance_id and advcr:
                             inputDataObj.append(advcr)
@@ -286,20 +310,26 @@ class IaaS(object):
         _request_data = json.dumps(request_data)
         # print "$$$$$$$$"
         # print _request_data
-        response = requests.post(env.IAAS_HOST + '/stacks',
-                                 data=_request_data,
-                                 headers=request_header,
-                                 params=self._get_request_params(),
-                                 verify=self.verify,
-                                 timeout=60)
+        with metrics.timer(PHASE_CREATE, stack=stack_name):
+            response = self.session.post(env.IAAS_HOST + '/stacks',
+                                         data=_request_data,
+                                         headers=request_header,
+                                         params=self._get_request_params(),
+                                         verify=self.verify,
+                                         timeout=60)
         if response.status_code == 401:
             self.handleAuthError(response, retry)
-            return self.deploy(stack_name, template, parameters, retry=False)
+            # the retry resolves the parameters again, with new addresses
+            self._release_ips(stack_name, allocated)
+            del allocated[:]
+            return self._deploy(stack_name, template_id, template, parameters, camVariables, allocated,
+                                retry=False, use_case=use_case)
         if response.status_code != 200:
             raise Exception("Failed to create stack %s, status code is %s\nresponse headers:\n%s\nresponse:\n%s\n\nrequest url:\n%s\nrequest headers:\n%s\nrequest body:\n%s" % (
                 request_data['name'], response.status_code, response.headers, response.content, response.request.url, response.request.headers, response.request.body))
 
         stack = response.json()
+        self.iplists[stack['id']] = iplist
         return stack
 
     def handleAuthError(self, response, retry):
@@ -316,31 +346,31 @@ class IaaS(object):
         Retrieves all cloud connections
         '''
         request_header = self._get_request_header()
-        return requests.get(env.IAAS_HOST + '/cloudconnections',
-                             headers=request_header,
-                             params=self._get_request_params(),
-                             verify=self.verify,
-                             timeout=60)
+        return self.session.get(env.IAAS_HOST + '/cloudconnections',
+                                 headers=request_header,
+                                 params=self._get_request_params(),
+                                 verify=self.verify,
+                                 timeout=60)
 
     def get_templates(self):
         request_header = self._get_request_header()
-        return requests.get(env.IAAS_HOST + '/templates',
-                             headers=request_header,
-                             params=self._get_request_params(),
-                             verify=self.verify,
-                             timeout=60)
+        return self.session.get(env.IAAS_HOST + '/templates',
+                                 headers=request_header,
+                                 params=self._get_request_params(),
+                                 verify=self.verify,
+                                 timeout=60)
 
     def get_template_details(self, id):
         self.logger.info('Enter get_template_details %s' % (id))
         request_headers = self._get_request_header()
         details = '/templates/getTemplateDetails?includeDataObjects=true&includeConnections=true'
         data={"id":id}
-        result= requests.post(env.IAAS_HOST + details,
-                                data,
-                                headers=request_headers,
-                                params=self._get_request_params(),
-                                verify=self.verify,
-                                timeout=60)       
+        result= self.session.post(env.IAAS_HOST + details,
+                                    data,
+                                    headers=request_headers,
+                                    params=self._get_request_params(),
+                                    verify=self.verify,
+                                    timeout=60)       
         self.logger.info('Exit get_template_details %s' % (result)) 
         return result
 
@@ -362,6 +392,28 @@ class IaaS(object):
         self.logger.info('Exit get_template_details %s' % (dataObjs)) 
         return dataObjs
 
+    def getTemplateDataObjects(self, template_id, datatypename):
+        '''
+        Return the data objects of a data type of the template. The details of each template
+        are downloaded once per CACHE_TTL seconds.
+        '''
+        datatypes = self.reference_data.get(('template', template_id),
+                                            lambda: self._load_template_datatypes(template_id))
+        if datatypes:
+            return datatypes.get(datatypename)
+        return None
+
+    def _load_template_datatypes(self, template_id):
+        template_details = self.get_template_details(template_id)
+        if template_details.status_code != 200:
+            # not cached, the next deployment asks again
+            return None
+        template_details_json = template_details.json()
+        if not template_details_json:
+            return None
+        return dict((datatype['name'], datatype['dataobjects'])
+                    for datatype in template_details_json.get('datatypes') or [])
+
     def getDataObject(self, dataobjects, dataobjname):
         self.logger.info('Enter getDataObject %s,%s' % (dataobjects, dataobjname))
         dataobjectval=None
@@ -395,12 +447,12 @@ class IaaS(object):
         request_headers = self._get_request_header()
         request_headers['Content-Type'] = 'application/json'
 
-        response = requests.post(env.IAAS_HOST + '/templates/createFromSource',
-                                 data=json.dumps(request_data),
-                                 headers=request_headers,
-                                 params=self._get_request_params(),
-                                 verify=self.verify,
-                                 timeout=60)
+        response = self.session.post(env.IAAS_HOST + '/templates/createFromSource',
+                                     data=json.dumps(request_data),
+                                     headers=request_headers,
+                                     params=self._get_request_params(),
+                                     verify=self.verify,
+                                     timeout=60)
 
         if response.status_code == 401:
             self.handleAuthError(response, retry)
@@ -413,15 +465,16 @@ class IaaS(object):
 
     def delete_template(self, template_id):
         request_header = self._get_request_header()
-        response = requests.delete(env.IAAS_HOST + '/templates/%s' % template_id,
-                                   headers=request_header,
-                                   params=self._get_request_params(),
-                                   verify=self.verify,
-                                   timeout=60)
+        response = self.session.delete(env.IAAS_HOST + '/templates/%s' % template_id,
+                                       headers=request_header,
+                                       params=self._get_request_params(),
+                                       verify=self.verify,
+                                       timeout=60)
 
         if response.status_code == 401:
             self.handleAuthError(response, retry)
             return self.delete_template(template_id)
+        self.reference_data.invalidate(('template', template_id))
         if response.status_code != 200:
             raise Exception("Failed to delete template %s, status code is %s\nresponse headers:\n%s\nresponse:\n%s\n\nrequest url:\n%s\nrequest headers:\n%s\nrequest body:\n%s" % (
                 template_id, response.status_code, response.headers, response.content, response.request.url, response.request.headers, response.request.body))
@@ -432,11 +485,11 @@ class IaaS(object):
         '''
         self.logger.info('Deleting %s' % stack['name'])
         request_header = self._get_request_header()
-        response = requests.delete(env.IAAS_HOST + '/stacks/' + stack['id'],
-                                   headers=request_header,
-                                   params=self._get_request_params(),
-                                   verify=self.verify,
-                                   timeout=60)
+        response = self.session.delete(env.IAAS_HOST + '/stacks/' + stack['id'],
+                                       headers=request_header,
+                                       params=self._get_request_params(),
+                                       verify=self.verify,
+                                       timeout=60)
         if response.status_code == 401:
             self.handleAuthError(response, retry)
             return self.delete(stack, retry=False)
@@ -447,18 +500,25 @@ class IaaS(object):
     # Ticket 1855 - Add a translation and override file environment
     # TEMPLATE_TRANSLATION set by Travis indicates the Transaltion type
 
-    def _refresh_ip_pool(self):
+    def _release_ips(self, stack_name, iplist):
         '''
-        Refresh the IP Pool if TEMPLATE_TRANSLATION is set to true
+        Release the IP addresses of a stack if TEMPLATE_TRANSLATION is set to true. Local pool
+        addresses are released by stack name, whichever process reserved them. MiniPAM
+        addresses are only known to the client that deployed the stack, through iplist.
         '''
-        if os.getenv('TEMPLATE_TRANSLATION', None).upper()=='TRUE':
-            translation_file = open(os.getenv('TRANSLATION_FILE', None))
-            translation_variables = json.load(translation_file)
-            translation_file.close()
+        if (os.getenv('TEMPLATE_TRANSLATION') or '').upper()=='TRUE':
+            translation_variables = load_translation(os.getenv('TRANSLATION_FILE', None))
 
             if translation_variables['test_data']['provider'] == "minipam":
-                for ip in self.iplist:
-                    response = requests.get(translation_variables['test_data']['minipam_url'] + "/free?ip_address="+ ip)
+                MinipamClient(translation_variables['test_data']['minipam_url']).free_many(iplist)
+            elif translation_variables['test_data']['provider'] == "local":
+                ippool.release_owner(stack_name)
+
+    def _refresh_ip_pool(self, stack):
+        '''
+        Refresh the IP Pool, releasing the IP addresses reserved when the stack was deployed
+        '''
+        self._release_ips(stack['name'], self.iplists.pop(stack['id'], []))
         return True
 
     def destroy(self, stack, retry=True):
@@ -467,13 +527,13 @@ class IaaS(object):
         '''
         self.logger.info('Destroying %s' % stack['name'])
         request_header = self._get_request_header()
-        response = requests.post(env.IAAS_HOST + '/stacks/' + stack['id'] + '/delete',
-                                 data=json.dumps(stack),
-                                 headers=request_header,
-                                 params=self._get_request_params(),
-                                 verify=self.verify,
-                                 timeout=60)
-        self._refresh_ip_pool()
+        response = self.session.post(env.IAAS_HOST + '/stacks/' + stack['id'] + '/delete',
+                                     data=json.dumps(stack),
+                                     headers=request_header,
+                                     params=self._get_request_params(),
+                                     verify=self.verify,
+                                     timeout=60)
+        self._refresh_ip_pool(stack)
         if response.status_code == 401:
             self.handleAuthError(response, retry)
             return self.destroy(stack, retry=False)
@@ -489,30 +549,42 @@ class IaaS(object):
         Retrieves the stack details
         '''
         request_header = self._get_request_header()
-        return requests.post(env.IAAS_HOST + '/stacks/' + stack['id'] + '/retrieve',
-                             headers=request_header,
-                             params=self._get_request_params(),
-                             verify=self.verify,
-                             timeout=60)
+        return self.session.post(env.IAAS_HOST + '/stacks/' + stack['id'] + '/retrieve',
+                                 headers=request_header,
+                                 params=self._get_request_params(),
+                                 verify=self.verify,
+                                 timeout=60)
 
     def retrieveAll(self):
         '''
         Retrieves all stacks
         '''
         request_header = self._get_request_header()
-        return requests.get(env.IAAS_HOST + '/stacks',
-                             headers=request_header,
-                             params=self._get_request_params(),
-                             verify=self.verify,
-                             timeout=60)
+        return self.session.get(env.IAAS_HOST + '/stacks',
+                                 headers=request_header,
+                                 params=self._get_request_params(),
+                                 verify=self.verify,
+                                 timeout=60)
 
-    def waitForSuccess(self, stack, timeoutInSeconds):
+    def waitForSuccess(self, stack, timeoutInSeconds, expected_duration=None):
         '''
-        Wait until the stack job (deploy or destroy) finishes successfully
+        Wait until the stack job (deploy or destroy) finishes successfully.
+        Polls follow poll_intervals(), expected_duration is the job duration in seconds
+        seen in earlier runs, if known.
+        With a running StackWatcher attached the job is tracked by the watcher instead of
+        polling here.
         '''
 
-        sleep_time = POLL_INTERVAL
-        count = 0
+        if self.watcher and self.watcher.is_alive():
+            # the watcher fails the job at the deadline, waiting longer covers its poll interval
+            try:
+                return self.watcher.watch(stack, timeoutInSeconds, expected_duration).wait(timeoutInSeconds + self.watcher.poll_interval * 2)
+            except FutureTimeout:
+                self.watcher.unwatch(stack)
+                raise Exception("The job for stack %s did not complete in %s." % (stack['id'], timeoutInSeconds))
+
+        deadline = time.time() + timeoutInSeconds
+        intervals = poll_intervals(expected_duration)
 
         while True:
             self.logger.info("Waiting for job of stack id %s" % stack['id'])
@@ -525,24 +597,21 @@ class IaaS(object):
             if response.status_code != 200:
                 self.logger.error("Invalid response status code %s\nresponse headers:\n%s\nresponse:\n%s\n\nrequest url:\n%s\nrequest headers:\n%s\nrequest body:\n%s" %
                                      (response.status_code, response.headers, response.content, response.request.url, response.request.headers, response.request.body))
-                continue
-
-            if response.json()['status'] == "SUCCESS":
+            elif response.json()['status'] == "SUCCESS":
                 self.logger.info("Job for stack id %s finished successfully." % stack['id'])
                 return response.json()
             elif response.json()['status'] != "IN_PROGRESS":
                 self.logger.info(json.dumps(response.json(), indent=4, separators=(',',': ')))
                 raise Exception("Job for stack id %s failed with status %s" % (stack['id'], response.json()['status']))
 
-            count += 1
-            if count > (timeoutInSeconds / sleep_time):
+            if time.time() > deadline:
                 raise Exception("The job for stack %s did not complete in %s." % (
                                 stack['id'], timeoutInSeconds))
 
             #
             # sleep before polling the job result
             #
-            time.sleep(sleep_time)
+            time.sleep(next(intervals))
 
     def create_cloud_connection(self, template_provider, data, retry=True):
         self.logger.info("Template Provider %s ." % template_provider)
@@ -552,16 +621,17 @@ class IaaS(object):
         request_headers['Content-Type'] = 'application/json'
         request_data = data.copy()
         request_data['providerId'] = self.get_provider_id(template_provider)
-        response = requests.post(env.IAAS_HOST + '/cloudconnections',
-                                 data=json.dumps(request_data),
-                                 headers=request_headers,
-                                 params=self._get_request_params(),
-                                 verify=self.verify,
-                                 timeout=60)
+        response = self.session.post(env.IAAS_HOST + '/cloudconnections',
+                                     data=json.dumps(request_data),
+                                     headers=request_headers,
+                                     params=self._get_request_params(),
+                                     verify=self.verify,
+                                     timeout=60)
 
         if response.status_code == 401:
             self.handleAuthError(response, retry)
             return self.create_cloud_connection(type, data, retry=False)
+        self.reference_data.invalidate('cloudconnections')
         if response.status_code != 200:
             raise Exception("Failed to create the cloud connections, status code %s\nresponse headers:\n%s\nresponse:\n%s\n\nrequest url:\n%s\nrequest headers:\n%s\nrequest body:\n%s"
                             % (response.status_code, response.headers, response.content, response.request.url, response.request.headers, response.request.body))
@@ -585,15 +655,25 @@ class IaaS(object):
         else:
             raise Exception('Invalid template provider %s' % template_provider)
 
+        cloud_connections = self.reference_data.get('cloudconnections', lambda: self._load_cloud_connections(retry))
+        for cloud_connection in cloud_connections:
+
+            if cloud_connection['name'] == cloud_connection_name:
+                return cloud_connection
+
+        raise Exception('Cloud connection %s does not exist' %
+                        cloud_connection_name)
+
+    def _load_cloud_connections(self, retry=True):
         request_header = self._get_request_header()
-        response = requests.get(env.IAAS_HOST + '/cloudconnections',
-                                headers=request_header,
-                                params=self._get_request_params(),
-                                verify=self.verify,
-                                timeout=60)
+        response = self.session.get(env.IAAS_HOST + '/cloudconnections',
+                                    headers=request_header,
+                                    params=self._get_request_params(),
+                                    verify=self.verify,
+                                    timeout=60)
         if response.status_code == 401:
             self.handleAuthError(response, retry)
-            return self.get_cloud_connection(template_provider, retry=False)
+            return self._load_cloud_connections(retry=False)
         if response.status_code != 200:
             raise Exception("Failed to retrieve the cloud connections, status code %s\nresponse headers:\n%s\nresponse:\n%s\n\nrequest url:\n%s\nrequest headers:\n%s\nrequest body:\n%s"
                     % (response.status_code, response.headers, response.content, response.request.url, response.request.headers, response.request.body))
@@ -604,34 +684,31 @@ class IaaS(object):
         except:
             raise Exception("Failed to parse JSON\nstatus code%s\nresponse headers:\n%s\nresponse\n%s\n\nrequest url:\n%s\nrequest headers:\n%s\nrequest body:\n%s" %
                     (response.status_code, response.headers, response.content, response.request.url, response.request.headers, response.request.body))
-        for cloud_connection in cloud_connections:
+        return cloud_connections
 
-            if cloud_connection['name'] == cloud_connection_name:
-                return cloud_connection
+    def get_provider_id(self, template_provider, retry=True):
+        providers = self.reference_data.get('providers', lambda: self._load_providers(retry))
+        for provider in providers:
+            if template_provider.lower() == provider['name'].lower():
+                return provider['id']
 
-        raise Exception('Cloud connection %s does not exist' %
-                        cloud_connection_name)
+        return None
 
-    def get_provider_id(self, template_provider, retry=True):
+    def _load_providers(self, retry=True):
         request_header = self._get_request_header()
-        response = requests.get(env.IAAS_HOST + '/providers',
-                                headers=request_header,
-                                params=self._get_request_params(),
-                                verify=self.verify,
-                                timeout=60)
+        response = self.session.get(env.IAAS_HOST + '/providers',
+                                    headers=request_header,
+                                    params=self._get_request_params(),
+                                    verify=self.verify,
+                                    timeout=60)
         if response.status_code == 401:
             self.handleAuthError(response, retry)
-            return self.get_provider_id(template_provider, retry=False)
+            return self._load_providers(retry=False)
         if response.status_code != 200:
             raise Exception("Failed to retrieve the cloud connections, status code %s\nresponse headers:\n%s\nresponse:\n%s\n\nrequest url:\n%s\nrequest headers:\n%s\nrequest body:\n%s"
                     % (response.status_code, response.headers, response.content, response.request.url, response.request.headers, response.request.body))
 
-        providers = response.json()
-        for provider in providers:
-            if template_provider.lower() == provider['name'].lower():
-                return provider['id']
-
-        return None
+        return response.json()
 
     def get_instance_ids(self, cloud_connection, translation_variables=None, dataObjects=None):
         # 1891 - Get connection varibales from the translation fileNone
@@ -701,12 +778,12 @@ class IaaS(object):
             request_header = self._get_request_header()
             request_header['Content-Type'] = 'application/json'
 
-            response = requests.post(env.IAAS_HOST + 'namespaces/resolve',
-                                     data=json.dumps(data),
-                                     headers=request_header,
-                                     verify=False,
-                                     params=self._get_request_params(),
-                                     timeout=60)
+            response = self.session.post(env.IAAS_HOST + 'namespaces/resolve',
+                                         data=json.dumps(data),
+                                         headers=request_header,
+                                         verify=False,
+                                         params=self._get_request_params(),
+                                         timeout=60)
 
             if response.status_code == 401:
                 self.handleAuthError(response, retry)
@@ -750,25 +827,11 @@ def _decode_dict(data):
     return rv
 
 def _generate_password():
-    rnd = random.SystemRandom()
-    #special_chars = '!()-._~@#'
-    special_chars = '!().~@#'
-    all_chars = string.ascii_letters + string.digits + special_chars
-    password = ''
-
-    # loop until we generate a password that is complex enough
-    #   has at least one lower-case letter, one upper-case, one digit, one special
-    while (not (any((c in string.ascii_lowercase) for c in password)) or
-           not (any((c in string.ascii_uppercase) for c in password)) or
-           not (any((c in string.digits) for c in password)) or
-           not (any((c in special_chars) for c in password))):
-        password = ''.join(rnd.choice(all_chars) for i in range(10)) # length 10
-    return password
+    return keypool.generate_password()
 
 def _generate_value(type):
     if type == 'sshkey':
-        from Crypto.PublicKey import RSA
-        return RSA.generate(2048).publickey().exportKey('OpenSSH')
+        return keypool.get_public_key()
     elif type == 'hostname':
         timestamp = datetime.now()
         return 'camcontent-%s' % datetime.strftime(timestamp, '%H%M%S%f')
@@ -0,0 +1,257 @@
+# =COPYRIGHT=======================================================
+# Licensed Materials - Property of IBM
+#
+# (c) Copyright IBM Corp. 2017, 2018 All Rights Reserved
+#
+# US Government Users Restricted Rights - Use, duplication or
+# disclosure restricted by GSA ADP Schedule Contract with IBM Corp.
+# =================================================================
+
+import os
+import time
+import sqlite3
+import tempfile
+import threading
+import urlparse
+
+import requests
+
+from lib.logger import TestLogger
+
+# Templates imported into CAM by any run on this machine, override with TEMPLATE_IMPORTS_FILE
+TEMPLATE_IMPORTS_FILE = os.getenv('TEMPLATE_IMPORTS_FILE',
+                                  os.path.join(tempfile.gettempdir(), 'template_runner_imports.db'))
+# Set to false to delete an imported template once its last test case finished, as before
+KEEP_IMPORTED_TEMPLATES = os.getenv('KEEP_IMPORTED_TEMPLATES', 'true').lower() == 'true'
+# Set by the test case runner to the test case timeout in seconds. References to a template
+# not touched for longer belong to test cases that were stopped before releasing them.
+REFERENCE_TIMEOUT = 'TEMPLATE_REFERENCE_TIMEOUT'
+# Without a test case timeout, the longest a test case can hold a reference: its deploy and
+# destroy waits (lib.worker passes their limits) and an hour for the import and API calls
+REFERENCE_SLACK = 60 * 60
+DEFAULT_REFERENCE_TIMEOUT = 8 * 60 * 60 + REFERENCE_SLACK
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+def _get_session():
+    # GitHub calls do not go through the CAM session, they are not CAM load
+    pid = os.getpid()
+    with _lock:
+        if pid not in _sessions:
+            _sessions.clear()
+            _sessions[pid] = requests.Session()
+        return _sessions[pid]
+
+
+def resolve_commit(repo_url, branch, token, session=None):
+    '''
+    Return the SHA of the commit branch points to in a GitHub or GitHub Enterprise
+    repository, or None if it cannot be resolved
+    '''
+    url = urlparse.urlparse(repo_url)
+    repo = url.path.strip('/')
+    if repo.endswith('.git'):
+        repo = repo[:-4]
+    if url.netloc == 'github.com':
+        api = 'https://api.github.com'
+    else:
+        api = '%s://%s/api/v3' % (url.scheme, url.netloc)
+
+    try:
+        response = (session or _get_session()).get('%s/repos/%s/commits/%s' % (api, repo, branch),
+                                                  headers={'Authorization': 'token %s' % token,
+                                                           'Accept': 'application/vnd.github.VERSION.sha'},
+                                                  timeout=30)
+    except Exception:
+        return None
+    if response.status_code != 200:
+        return None
+    return response.content.strip() or None
+
+
+class TemplateImports(object):
+    '''
+    Reference counted templates imported into CAM, keyed by CAM instance, repository,
+    path, branch and commit SHA, kept in a SQLite file shared by all test cases and runs.
+
+    Test cases deploying the same template at the same commit share one CAM template. When the
+    last of them finished, the template is kept for later runs (KEEP_IMPORTED_TEMPLATES) until
+    a new commit of the branch is imported, or deleted right away. References of test cases
+    that never released them are dropped once the template was not used for longer than the
+    test case timeout.
+
+    A reference can be taken for a holder, the stack name, so another process can release it
+    with release_holder when the test case holding it was stopped.
+    '''
+
+    def __init__(self, path=TEMPLATE_IMPORTS_FILE, keep=KEEP_IMPORTED_TEMPLATES,
+                 reference_timeout=DEFAULT_REFERENCE_TIMEOUT):
+        self.path = path
+        self.keep = keep
+        self.reference_timeout = reference_timeout
+        self.logger = TestLogger(__name__)
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS imports ('
+                               'cam TEXT NOT NULL, '
+                               'repo TEXT NOT NULL, '
+                               'path TEXT NOT NULL, '
+                               'branch TEXT NOT NULL, '
+                               'commit_sha TEXT NOT NULL, '
+                               'template_id TEXT NOT NULL, '
+                               'refcount INTEGER NOT NULL, '
+                               'updated REAL NOT NULL, '
+                               'PRIMARY KEY (cam, repo, path, branch, commit_sha))')
+            connection.execute('CREATE TABLE IF NOT EXISTS holders ('
+                               'cam TEXT NOT NULL, '
+                               'template_id TEXT NOT NULL, '
+                               'holder TEXT NOT NULL, '
+                               'PRIMARY KEY (cam, template_id, holder))')
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def acquire(self, iaas, repo_url, repo_path, branch, token, holder=None):
+        '''
+        Return the id of a CAM template for the repository path at the current commit of the
+        branch, importing it unless a test case or an earlier run already did. The reference
+        is recorded for holder when one is given.
+        '''
+        template_id = self._acquire(iaas, repo_url, repo_path, branch, token)
+        if holder:
+            connection = self._connect()
+            with connection:
+                connection.execute('BEGIN IMMEDIATE')
+                connection.execute('INSERT OR IGNORE INTO holders (cam, template_id, holder) VALUES (?, ?, ?)',
+                                   (iaas.cam_key, template_id, holder))
+        return template_id
+
+    def _acquire(self, iaas, repo_url, repo_path, branch, token):
+        commit = resolve_commit(repo_url, branch, token)
+        if commit is None:
+            self.logger.warning('Could not resolve %s %s, importing without cache' % (repo_url, branch))
+            return iaas.import_template('github', repo_url, repo_path, branch, token)
+
+        key = (iaas.cam_key, repo_url, repo_path, branch, commit)
+        self._reclaim(key)
+        row = self._connect().execute('SELECT template_id, refcount FROM imports WHERE cam = ? AND repo = ? '
+                                      'AND path = ? AND branch = ? AND commit_sha = ?', key).fetchone()
+        if row and row[1] == 0:
+            response = iaas.get_template_details(row[0])
+            if response.status_code == 401:
+                iaas._authenticate()
+                response = iaas.get_template_details(row[0])
+            if response.status_code == 404:
+                # kept from an earlier run but deleted from CAM since
+                self._forget(key, row[0])
+                row = None
+            elif response.status_code != 200:
+                self.logger.warning('Could not check template %s, status code %s, importing without cache' %
+                                    (row[0], response.status_code))
+                return iaas.import_template('github', repo_url, repo_path, branch, token)
+        if row and self._reference(key, row[0]):
+            self.logger.info('Reusing template %s imported from %s %s at %s' % (row[0], repo_url, repo_path, commit))
+            return row[0]
+
+        template_id = iaas.import_template('github', repo_url, repo_path, branch, token)
+        connection = self._connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute('SELECT template_id FROM imports WHERE cam = ? AND repo = ? '
+                                     'AND path = ? AND branch = ? AND commit_sha = ?', key).fetchone()
+            if row:
+                # another test case imported the same template meanwhile, use theirs
+                connection.execute('UPDATE imports SET refcount = refcount + 1, updated = ? WHERE cam = ? '
+                                   'AND repo = ? AND path = ? AND branch = ? AND commit_sha = ?',
+                                   (time.time(),) + key)
+            else:
+                connection.execute('INSERT INTO imports (cam, repo, path, branch, commit_sha, template_id, refcount, updated) '
+                                   'VALUES (?, ?, ?, ?, ?, ?, 1, ?)', key + (template_id, time.time()))
+                superseded = connection.execute('SELECT template_id FROM imports WHERE cam = ? AND repo = ? '
+                                                'AND path = ? AND branch = ? AND commit_sha != ? AND refcount = 0',
+                                                key).fetchall()
+                connection.execute('DELETE FROM imports WHERE cam = ? AND repo = ? AND path = ? AND branch = ? '
+                                   'AND commit_sha != ? AND refcount = 0', key)
+        if row:
+            self._delete(iaas, template_id)
+            return row[0]
+        for old_template in superseded:
+            self._delete(iaas, old_template[0])
+        return template_id
+
+    def _reference(self, key, template_id):
+        connection = self._connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            return connection.execute('UPDATE imports SET refcount = refcount + 1, updated = ? WHERE cam = ? '
+                                      'AND repo = ? AND path = ? AND branch = ? AND commit_sha = ? AND template_id = ?',
+                                      (time.time(),) + key + (template_id,)).rowcount == 1
+
+    def _reference_timeout(self):
+        return float(os.getenv(REFERENCE_TIMEOUT, self.reference_timeout))
+
+    def _reclaim(self, key):
+        '''
+        Drop the references to the templates of the repository path and branch that were not
+        used for longer than the test case timeout, their test cases no longer run
+        '''
+        connection = self._connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            reclaimed = connection.execute('UPDATE imports SET refcount = 0 WHERE cam = ? AND repo = ? AND path = ? '
+                                           'AND branch = ? AND refcount > 0 AND updated < ?',
+                                           key[:4] + (time.time() - self._reference_timeout(),)).rowcount
+        if reclaimed:
+            self.logger.warning('Dropped stale references to %s templates of %s %s' % (reclaimed, key[1], key[2]))
+
+    def _forget(self, key, template_id):
+        connection = self._connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('DELETE FROM imports WHERE cam = ? AND repo = ? AND path = ? AND branch = ? '
+                               'AND commit_sha = ? AND template_id = ? AND refcount = 0', key + (template_id,))
+
+    def _delete(self, iaas, template_id):
+        try:
+            iaas.delete_template(template_id)
+        except Exception:
+            self.logger.exception('Failed to delete the template %s' % template_id)
+
+    def release(self, iaas, template_id, holder=None):
+        '''
+        Drop a reference to a template returned by acquire, deleting it after its last user
+        unless templates are kept. Templates imported without cache are deleted right away.
+        '''
+        connection = self._connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            if holder:
+                connection.execute('DELETE FROM holders WHERE cam = ? AND template_id = ? AND holder = ?',
+                                   (iaas.cam_key, template_id, holder))
+            row = connection.execute('SELECT refcount FROM imports WHERE cam = ? AND template_id = ?',
+                                     (iaas.cam_key, template_id)).fetchone()
+            if row:
+                connection.execute('UPDATE imports SET refcount = MAX(refcount - 1, 0), updated = ? '
+                                   'WHERE cam = ? AND template_id = ?', (time.time(), iaas.cam_key, template_id))
+                if row[0] > 1 or self.keep:
+                    return
+                connection.execute('DELETE FROM imports WHERE cam = ? AND template_id = ?',
+                                   (iaas.cam_key, template_id))
+        iaas.delete_template(template_id)
+
+    def release_holder(self, iaas, holder):
+        '''
+        Release the references still recorded for holder, return the template ids
+        '''
+        rows = self._connect().execute('SELECT template_id FROM holders WHERE cam = ? AND holder = ?',
+                                       (iaas.cam_key, holder)).fetchall()
+        for row in rows:
+            self.release(iaas, row[0], holder)
+        return [row[0] for row in rows]
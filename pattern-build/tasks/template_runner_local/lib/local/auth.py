@@ -3,6 +3,7 @@ import requests
 import env
 
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
+from lib.session import get_session
 
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
@@ -27,7 +28,7 @@ def _get_bearer_token():
         "username": "admin",
         "scope": "openid"
     }
-    response = requests.post(env.AUTH_HOST, json=body, verify=False)
+    response = get_session().post(env.AUTH_HOST, json=body, verify=False)
     return response.json()
 
 
@@ -45,8 +46,8 @@ def _get_space_guid(bearer_token):
     # the method uses the getTenantOnPrem REST API and it picks up the 'default' namespace uid
     #
     headers = {'Authorization': bearer_token['token_type'] + ' ' + bearer_token['access_token']}
-    response = requests.get(env.TENANT_HOST + '/tenants/getTenantOnPrem',
-                            headers=headers, verify=False).json()
+    response = get_session().get(env.TENANT_HOST + '/tenants/getTenantOnPrem',
+                                 headers=headers, verify=False).json()
     namespaces = response['namespaces']
     for namespace in namespaces:
         if namespace['name'] == 'default':
@@ -1,6 +1,7 @@
 import requests
 import env
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
+from lib.session import get_session
 
 
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
@@ -10,4 +11,4 @@ def get_tenant_id(auth):
   bearerToken = auth[0]
 
   headers = {'Authorization': bearerToken['token_type'] + ' ' + bearerToken['access_token']}
-  return requests.get(env.TENANT_HOST + '/tenants/getTenantOnPrem', headers=headers, verify=False).json()['id']
+  return get_session().get(env.TENANT_HOST + '/tenants/getTenantOnPrem', headers=headers, verify=False).json()['id']
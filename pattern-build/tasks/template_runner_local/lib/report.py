@@ -1,5 +1,6 @@
 import os
 from lib.logger import TestLogger
+from lib.stats import PERCENTILES
 
 class HtmlReport(object):
 
@@ -18,6 +19,19 @@ class HtmlReport(object):
         report_content += "<h1>" + self.title + "</h1>"
         report_content += "<table>\n"
         report_content += self._get_table_header()
+        report_content += self._get_rows()
+        report_content += "\n</table>\n</body>"
+
+        with open(self.output_file, 'w') as out:
+            out.write(report_content)
+
+        self.logger.info("Report %s generated." % os.path.abspath(self.output_file))
+
+    def _get_rows(self):
+        '''
+        Returns a table row per life cycle result
+        '''
+        report_content = ""
         for result in self.results:
             report_content += "<tr>\n"
             #
@@ -64,12 +78,7 @@ class HtmlReport(object):
                 duration = "%s" % result['destroy_duration']
             report_content += "<td>" + duration + "</td>\n"
             report_content += "</tr>\n"
-        report_content += "\n</table>\n</body>"
-
-        with open(self.output_file, 'w') as out:
-            out.write(report_content)
-
-        self.logger.info("Report %s generated." % os.path.abspath(self.output_file))
+        return report_content
 
     def _get_header(self):
         header_file = os.path.join(os.path.dirname(__file__), 'report/header.html')
@@ -80,3 +89,75 @@ class HtmlReport(object):
         table_file = os.path.join(os.path.dirname(__file__), 'report/table.html')
         with open(table_file, 'r') as header:
             return header.read()
+
+
+def _seconds(value):
+    if value is None:
+        return ""
+    return "%.1f [s]" % value
+
+
+class StressReport(HtmlReport):
+    '''
+    Deploy and destroy percentiles per template and cloud, results is the summary of a
+    lib.stats.StatsAggregator
+    '''
+
+    def _get_table_header(self):
+        columns = ['Template', 'Cloud', 'Operation', 'Passed', 'Failed', 'Average']
+        columns += ['p%s' % percent for percent in PERCENTILES]
+        return "<tr>\n" + "".join("    <th>%s</th>\n" % column for column in columns) + "</tr>\n"
+
+    def _get_rows(self):
+        report_content = ""
+        throughput = self.results['throughput']
+        report_content += "<p>Throughput: %s</p>\n" % (
+            "%.2f deployments per hour" % throughput if throughput is not None else "N/A")
+        groups = [dict(self.results, template='all', cloud='all')] + self.results['groups']
+        for group in groups:
+            for operation in ('deploy', 'destroy'):
+                summary = group[operation]
+                report_content += "<tr>\n"
+                report_content += "<td>%s</td>\n<td>%s</td>\n<td>%s</td>\n" % (group['template'], group['cloud'], operation)
+                report_content += "<td>%s</td>\n" % summary['passed']
+                if summary['failed']:
+                    report_content += "<td bgcolor=\"#FF0000\">%s</td>\n" % summary['failed']
+                else:
+                    report_content += "<td>%s</td>\n" % summary['failed']
+                report_content += "<td>%s</td>\n" % _seconds(summary['average'])
+                for percent in PERCENTILES:
+                    report_content += "<td>%s</td>\n" % _seconds(summary['p%s' % percent])
+                report_content += "</tr>\n"
+        return report_content
+
+
+class ComparisonReport(HtmlReport):
+    '''
+    Two stress runs side by side, results are the rows of lib.stats.compare. Regressions are
+    shown in red.
+    '''
+
+    def _get_table_header(self):
+        columns = ['Template', 'Cloud', 'Operation', 'Metric', 'Baseline', 'Current', 'Change']
+        return "<tr>\n" + "".join("    <th>%s</th>\n" % column for column in columns) + "</tr>\n"
+
+    def _get_rows(self):
+        report_content = ""
+        for row in self.results:
+            if row['metric'] == 'throughput':
+                baseline = "" if row['baseline'] is None else "%.2f / h" % row['baseline']
+                current = "" if row['current'] is None else "%.2f / h" % row['current']
+            else:
+                baseline = _seconds(row['baseline'])
+                current = _seconds(row['current'])
+            change = "" if row['change'] is None else "%+.1f%%" % (row['change'] * 100)
+            report_content += "<tr>\n"
+            report_content += "<td>%s</td>\n<td>%s</td>\n<td>%s</td>\n<td>%s</td>\n" % (
+                row['template'], row['cloud'], row['operation'], row['metric'])
+            report_content += "<td>%s</td>\n<td>%s</td>\n" % (baseline, current)
+            if row['regression']:
+                report_content += "<td bgcolor=\"#FF0000\">%s</td>\n" % change
+            else:
+                report_content += "<td>%s</td>\n" % change
+            report_content += "</tr>\n"
+        return report_content
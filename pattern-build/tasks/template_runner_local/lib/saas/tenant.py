@@ -1,5 +1,5 @@
-import requests
 import env
+from lib.session import get_session
 
 def get_tenant_id(auth):
     '''
@@ -13,7 +13,7 @@ def get_tenant_id(auth):
     request_header = {'Authorization': bearer_token['token_type'] + ' ' + bearer_token['access_token'], 'Accept': 'application/json'}
     params = {'organizationId': org_guid, 'spaceId': space_guid, 'serviceId': _get_service_id(bearer_token, space_guid)}
 
-    return requests.get(env.TENANT_HOST + '/tenants/findTenantByOrgSpaceServiceId', headers=request_header, params=params).json()['id']
+    return get_session().get(env.TENANT_HOST + '/tenants/findTenantByOrgSpaceServiceId', headers=request_header, params=params).json()['id']
 
 
 def _get_service_id(bearer_token, space_guid):
@@ -22,7 +22,7 @@ def _get_service_id(bearer_token, space_guid):
     '''
     request_header = {'Authorization': bearer_token['token_type'] + ' ' + bearer_token['access_token'], 'Accept': 'application/json'}
 
-    response = requests.get(env.AUTH_HOST + '/v2/service_instances', headers=request_header).json()['resources']
+    response = get_session().get(env.AUTH_HOST + '/v2/service_instances', headers=request_header).json()['resources']
 
     for i in response:
         if i['entity']['dashboard_url'] == env.DASHBOARD and i['entity']['space_guid'] == space_guid:
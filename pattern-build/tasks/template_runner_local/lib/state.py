@@ -0,0 +1,198 @@
+# =COPYRIGHT=======================================================
+# Licensed Materials - Property of IBM
+#
+# (c) Copyright IBM Corp. 2017, 2018 All Rights Reserved
+#
+# US Government Users Restricted Rights - Use, duplication or
+# disclosure restricted by GSA ADP Schedule Contract with IBM Corp.
+# =================================================================
+
+import os
+import json
+import time
+import errno
+import socket
+import sqlite3
+
+# Name of the state store inside a suite directory
+STATE_FILE = 'test_cases.db'
+
+
+def test_case_name(test_case):
+    '''
+    Unique name of a test case within a suite
+    '''
+    return test_case['template_name'] + '_' + test_case['cloud'] + '_' + test_case['test_case']
+
+
+def _file_mtime(test_case):
+    # modification time of the test case file the row was read from, 0 if there is none
+    try:
+        return os.path.getmtime(test_case['test_case_file'])
+    except (KeyError, OSError):
+        return 0
+
+
+def _owner():
+    return '%s:%s' % (socket.gethostname(), os.getpid())
+
+
+def _owner_alive(owner):
+    '''
+    Return False if owner is a process of this host that no longer exists. Processes of other
+    hosts cannot be checked and count as alive.
+    '''
+    if not owner:
+        return False
+    host, pid = owner.rsplit(':', 1)
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except OSError as ex:
+        return ex.errno != errno.ESRCH
+    return True
+
+
+class StateStore(object):
+    '''
+    Crash safe store of the test cases of a suite and their status, backed by a single
+    SQLite file. Status changes are atomic transactions, so readers never see a half
+    written record and two runners can never claim the same test case.
+
+    A connection is opened lazily per process, the store can be shared with forked children.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS test_cases ('
+                               'name TEXT PRIMARY KEY, '
+                               'status TEXT NOT NULL, '
+                               'definition TEXT NOT NULL, '
+                               'updated REAL NOT NULL, '
+                               'file_mtime REAL NOT NULL DEFAULT 0, '
+                               'owner TEXT)')
+            columns = set(row[1] for row in connection.execute('PRAGMA table_info(test_cases)'))
+            # stores written before test case files were reconciled
+            if 'file_mtime' not in columns:
+                connection.execute('ALTER TABLE test_cases ADD COLUMN file_mtime REAL NOT NULL DEFAULT 0')
+            if 'owner' not in columns:
+                connection.execute('ALTER TABLE test_cases ADD COLUMN owner TEXT')
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def names(self):
+        '''
+        Return the set of test case names held by the store
+        '''
+        rows = self._connect().execute('SELECT name FROM test_cases').fetchall()
+        return set(row[0] for row in rows)
+
+    def file_mtimes(self):
+        '''
+        Return a dictionary of test case name to the modification time of the test case file
+        when it was stored, a file modified since has been edited
+        '''
+        return dict(self._connect().execute('SELECT name, file_mtime FROM test_cases').fetchall())
+
+    def add(self, test_cases):
+        '''
+        Add test cases that are not yet in the store, keeping the status of known ones
+        '''
+        rows = [(test_case_name(test_case), test_case['status'], json.dumps(test_case), time.time(),
+                 _file_mtime(test_case)) for test_case in test_cases]
+        connection = self._connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany('INSERT OR IGNORE INTO test_cases (name, status, definition, updated, file_mtime) '
+                                   'VALUES (?, ?, ?, ?, ?)', rows)
+
+    def put(self, test_case):
+        '''
+        Insert or replace a test case, including its status
+        '''
+        connection = self._connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('INSERT OR REPLACE INTO test_cases (name, status, definition, updated, file_mtime) '
+                               'VALUES (?, ?, ?, ?, ?)',
+                               (test_case_name(test_case), test_case['status'], json.dumps(test_case), time.time(),
+                                _file_mtime(test_case)))
+
+    def replace_all(self, test_cases):
+        '''
+        Make test_cases, including their status, the only test cases of the store
+        '''
+        rows = [(test_case_name(test_case), test_case['status'], json.dumps(test_case), time.time(),
+                 _file_mtime(test_case)) for test_case in test_cases]
+        connection = self._connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('DELETE FROM test_cases')
+            connection.executemany('INSERT INTO test_cases (name, status, definition, updated, file_mtime) '
+                                   'VALUES (?, ?, ?, ?, ?)', rows)
+
+    def test_cases(self, statuses=None):
+        '''
+        Return the test cases, optionally only those in one of statuses, with their current status
+        '''
+        query = 'SELECT status, definition FROM test_cases'
+        params = ()
+        if statuses:
+            query += ' WHERE status IN (%s)' % ','.join('?' * len(statuses))
+            params = tuple(statuses)
+        test_cases = []
+        for status, definition in self._connect().execute(query + ' ORDER BY name', params):
+            test_case = json.loads(definition)
+            test_case['status'] = status
+            test_cases.append(test_case)
+        return test_cases
+
+    def statuses(self):
+        '''
+        Return a dictionary of test case name to status
+        '''
+        return dict(self._connect().execute('SELECT name, status FROM test_cases').fetchall())
+
+    def get_status(self, name):
+        row = self._connect().execute('SELECT status FROM test_cases WHERE name = ?', (name,)).fetchone()
+        if row:
+            return row[0]
+        return None
+
+    def transition(self, name, status, from_statuses=None):
+        '''
+        Atomically move a test case to status. When from_statuses is given the transition only
+        happens if the current status is one of them. Return True if the status was changed.
+        '''
+        query = 'UPDATE test_cases SET status = ?, updated = ?, owner = ? WHERE name = ?'
+        params = [status, time.time(), _owner(), name]
+        if from_statuses:
+            query += ' AND status IN (%s)' % ','.join('?' * len(from_statuses))
+            params += list(from_statuses)
+        connection = self._connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            return connection.execute(query, params).rowcount == 1
+
+    def reset_orphaned(self, status, to_status):
+        '''
+        Move the test cases left in status by a process that no longer runs, such as a crashed
+        runner, to to_status. Return their names.
+        '''
+        connection = self._connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            rows = connection.execute('SELECT name, owner FROM test_cases WHERE status = ?', (status,)).fetchall()
+            orphaned = [name for name, owner in rows if not _owner_alive(owner)]
+            connection.executemany('UPDATE test_cases SET status = ?, updated = ?, owner = NULL WHERE name = ?',
+                                   [(to_status, time.time(), name) for name in orphaned])
+        return orphaned
@@ -0,0 +1,115 @@
+# =COPYRIGHT=======================================================
+# Licensed Materials - Property of IBM
+#
+# (c) Copyright IBM Corp. 2017, 2018 All Rights Reserved
+#
+# US Government Users Restricted Rights - Use, duplication or
+# disclosure restricted by GSA ADP Schedule Contract with IBM Corp.
+# =================================================================
+
+import os
+import json
+import hashlib
+import tempfile
+
+import hcl
+
+from lib.logger import TestLogger
+
+# Parsed templates by SHA-256 of their source, override with TEMPLATE_CACHE_DIR, empty disables it
+TEMPLATE_CACHE_DIR = os.getenv('TEMPLATE_CACHE_DIR',
+                               os.path.join(os.path.expanduser('~'), '.cache', 'template_runner', 'templates'))
+
+# Provider names accepted in templates, by cloud
+_PROVIDERS = {
+    'aws': ('amazon ec2', 'amazonec2', 'aws'),
+    'vsphere': ('vmware vsphere', 'vsphere', 'vmware'),
+    'ibm': ('ibm cloud', 'ibmcloud', 'ibm'),
+}
+
+logger = TestLogger(__name__)
+
+
+class ParsedTemplate(object):
+    '''
+    A Terraform template parsed once: its source text, the parsed dictionary, the format
+    (JSON or HCL) and the provider the stack is deployed with
+    '''
+
+    def __init__(self, source, parsed, format, provider):
+        self.source = source
+        self.parsed = parsed
+        self.format = format
+        self.provider = provider
+
+    def __str__(self):
+        return self.source
+
+
+def detect_format(source):
+    return "JSON" if source.strip().startswith("{") else "HCL"
+
+
+def detect_provider(parsed):
+    '''
+    Return the first supported provider declared in the parsed template, or '' if none is
+    '''
+    for provider in (parsed.get('provider') or {}).keys():
+        for names in _PROVIDERS.values():
+            if provider.lower() in names:
+                return provider
+    return ''
+
+
+def _cache_file(digest, cache_dir):
+    return os.path.join(cache_dir, '%s.json' % digest)
+
+
+def _read_cache(digest, cache_dir):
+    try:
+        with open(_cache_file(digest, cache_dir)) as cache_file:
+            return json.load(cache_file)
+    except (IOError, ValueError):
+        return None
+
+
+def _write_cache(digest, cache_dir, entry):
+    # Several runners may parse the same template at once, write then rename
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as temp_file:
+            json.dump(entry, temp_file)
+        os.rename(temp_path, _cache_file(digest, cache_dir))
+    except (IOError, OSError):
+        logger.warning('Failed to cache the parsed template in %s' % cache_dir)
+
+
+def parse_template(source, cache_dir=TEMPLATE_CACHE_DIR):
+    '''
+    Parse a JSON or HCL template, raising an error on parse failure. The parsed form is
+    cached on disk by the content hash of the source, so an unchanged template is not parsed
+    by pyhcl again.
+    '''
+    if isinstance(source, ParsedTemplate):
+        return source
+
+    digest = hashlib.sha256(source if isinstance(source, str) else source.encode('utf-8')).hexdigest()
+    entry = _read_cache(digest, cache_dir) if cache_dir else None
+    if entry is None:
+        parsed = hcl.loads(source)
+        entry = {'format': detect_format(source), 'provider': detect_provider(parsed), 'parsed': parsed}
+        if cache_dir:
+            _write_cache(digest, cache_dir, entry)
+    return ParsedTemplate(source, entry['parsed'], entry['format'], entry['provider'])
+
+
+def load_template(template_file, cache_dir=TEMPLATE_CACHE_DIR):
+    '''
+    Read and parse a template file
+    '''
+    if isinstance(template_file, basestring):
+        with open(template_file) as opened_file:
+            return parse_template(opened_file.read(), cache_dir)
+    return parse_template(template_file.read(), cache_dir)
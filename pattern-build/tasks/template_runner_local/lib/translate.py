@@ -11,43 +11,16 @@ import os
 from datetime import datetime
 import time
 import json
-import re
 import random
-import string
-import requests
-import ast
 
-from platform import system as system_name # Returns the system/OS name
-from os import system as system_call       # Execute a shell command
 from lib.logger import TestLogger
+from lib.config import Translation
+import lib.ippool as ippool
+import lib.keypool as keypool
+from lib.minipam import MinipamClient
 
 def _generate_password():
-    rnd = random.SystemRandom()
-    #special_chars = '!()-._~@#'
-    special_chars = '!().~@#'
-    all_chars = string.ascii_letters + string.digits + special_chars
-    password = ''
-
-    # loop until we generate a password that is complex enough
-    #   has at least one lower-case letter, one upper-case, one digit, one special
-    while (not (any((c in string.ascii_lowercase) for c in password)) or
-           not (any((c in string.ascii_uppercase) for c in password)) or
-           not (any((c in string.digits) for c in password)) or
-           not (any((c in special_chars) for c in password))):
-        password = ''.join(rnd.choice(all_chars) for i in range(10)) # length 10
-    return password
-
-def _ping(host):
-    """
-    Returns True if host (str) responds to a ping request.
-    Remember that some hosts may not respond to a ping request even if the host name is valid.
-    """
-
-    # Ping parameters as function of OS
-    parameters = "-n 1 -w 2" if system_name().lower()=="windows" else "-c 1"
-
-    # Pinging
-    return system_call("ping " + parameters + " " + host) == 0
+    return keypool.generate_password()
 
 def print_dictionary(in_dict, spaces=0):
 
@@ -67,6 +40,51 @@ def print_dictionary(in_dict, spaces=0):
             item = str(print_dict[key])
             print(spaces*' ' + key + ' : ' + item)
 
+class VariableClassifier(object):
+
+    '''
+    Classify CAM variable names against the suffix rules of a translation file, compiled once.
+    A rule matches every variable name ending with it, for example the node lookup flavor
+    matches MQV9Node01-flavor. Rules are indexed by length, so classifying a name takes one
+    set lookup per distinct rule length, and results are memoised per name.
+    '''
+
+    def __init__(self, variables):
+        node_variables = variables.get('node') or {}
+        global_variables = variables.get('global') or {}
+        self._node_lookups = self._index(node_variables, 'lookup')
+        self._global_lookups = self._index(global_variables, 'lookup')
+        self._ip_hostnames = self._index(node_variables, 'ip_hostname')
+        self._lookups = {}
+
+    def _index(self, section, variable_type):
+        index = {}
+        for name in section:
+            if section[name]['type'] == variable_type:
+                index.setdefault(len(name), set()).add(name)
+        # longest rules first, the most specific rule wins
+        return sorted(index.items(), reverse=True)
+
+    def _matches(self, index, variable):
+        return [variable[-length:] for length, names in index
+                if length <= len(variable) and variable[-length:] in names]
+
+    def lookup(self, variable):
+        '''
+        Return the lookup rule of the variable, node rules before global ones, or None
+        '''
+        if variable not in self._lookups:
+            matches = self._matches(self._node_lookups, variable) or self._matches(self._global_lookups, variable)
+            self._lookups[variable] = matches[0] if matches else None
+        return self._lookups[variable]
+
+    def ip_hostnames(self, variable):
+        '''
+        Return the ip_hostname rules the variable ends with
+        '''
+        return self._matches(self._ip_hostnames, variable)
+
+
 def _get_node_list(cam_variables, variables):
 
     '''
@@ -77,33 +95,21 @@ def _get_node_list(cam_variables, variables):
     '''
 
     node_list = list()
-    ip_dict = {}
-
-    if 'node' in variables:
-        node_variables = variables['node']
 
     # Build field name list from cam variables
-    cam_fields = list()
-    for cam_variable in cam_variables:
-        cam_fields.append(cam_variable['name'])
+    cam_fields = set(cam_variable['name'] for cam_variable in cam_variables)
 
     #parse for unqiue nodes
 
     for cam_variable in cam_variables:
-        for variable in node_variables:
-            found = False
-            if node_variables[variable]['type'] == "ip_hostname":
-                regex = variable + '$'
-                if re.search(regex, cam_variable['name']):
-                    regex = variable + '$'
-                    node_name = re.sub(regex, '', cam_variable['name'])
-                    for field in variables['ip_fields']:
-                        resolved_field = node_name[:-1] + field
-                        if resolved_field in cam_fields:
-                            found = True
-                    if found:
-                        if node_name[:-1] not in node_list:
-                            node_list.append(node_name[:-1])
+        for variable in variables.classifier.ip_hostnames(cam_variable['name']):
+            node_name = cam_variable['name'][:-len(variable)][:-1]
+            if node_name in node_list:
+                continue
+            for field in variables.ip_fields:
+                if node_name + field in cam_fields:
+                    node_list.append(node_name)
+                    break
     return node_list
 
 def _is_override(variable, override_variables):
@@ -126,49 +132,23 @@ def _is_lookup(variable, variables):
     return flavor.
     '''
 
-    if 'node' in variables:
-        node_variables = variables['node']
-
-    if 'global' in variables:
-        global_variables = variables['global']
-
-    # If a variable is a NODE variable then return the resolved variable name
-    for current_variable in node_variables:
-        if node_variables[current_variable]['type'] == 'lookup':
-            regex = current_variable + '$'
-            if re.search(regex, variable):
-                return (True, current_variable)
-
-    # If a variable is a GLOBAL variable then return the resolved variable name
-    for current_variable in global_variables:
-        if global_variables[current_variable]['type'] == 'lookup':
-            regex = current_variable + '$'
-            if re.search(regex, variable):
-                return (True, current_variable)
-
+    lookup = variables.classifier.lookup(variable)
+    if lookup is not None:
+        return (True, lookup)
     return (False, 0)
 
-def _get_ip_pool(ip_pool_provider, ip_pool, used_ip, node, minipam_url):
+def _get_ip_pool(ip_pool_provider, ip_pool, nodes, minipam_url, owner=None):
 
     '''
-    Interrogate the IP Pool for a free entry and return the ip, domain, hostname
+    Interrogate the IP Pool for a free entry per node and return a list of ip, domain, hostname.
+    Local pool entries are reserved for owner, the stack name.
     '''
 
     if ip_pool_provider == "local":
-        for ip_entry in ip_pool:
-            if ip_entry['ip_ipaddress'] not in used_ip:
-                if not _ping(ip_entry['ip_ipaddress']):
-                    return (ip_entry['ip_ipaddress'], ip_entry['ip_domain'], ip_entry['ip_hostname'])
-        raise Exception("IP Pool Exhausted")
+        return [(ip_entry['ip_ipaddress'], ip_entry['ip_domain'], ip_entry['ip_hostname'])
+                for ip_entry in ippool.allocate(ip_pool, len(nodes), owner=owner)]
     elif ip_pool_provider == "minipam":
-        response = requests.get(minipam_url + "/get")
-        if response.status_code == 200:
-            ip_entry = ast.literal_eval(response.content)
-            return (ip_entry['ipaddress'], ip_entry['domain'], ip_entry['hostname'])
-        elif response.status_code == 400:
-            raise Exception("IP Pool Exhausted")
-        else:
-            return None
+        return MinipamClient(minipam_url).get_many(len(nodes))
     else:
         raise Exception("Not valid IP Provider for %s" % ip_pool_provider)
 
@@ -178,21 +158,10 @@ def _is_random(variable, variables):
     Type Random variables need to be generated
     '''
 
-    if 'node' in variables:
-        node_variables = variables['node']
-
-    if 'global' in variables:
-        global_variables = variables['global']
-
-    timestamp = datetime.now()
-    value = 'camcontent-%s' % datetime.strftime(timestamp, '%H%M%S%f')
-
-    if variable in node_variables:
-        if node_variables[variable]['type'] == "random":
-            return (True, value)
-    elif variable in global_variables:
-        if global_variables[variable]['type'] == "random":
-            return (True, value)
+    if variables.types.get(variable) == "random":
+        timestamp = datetime.now()
+        value = 'camcontent-%s' % datetime.strftime(timestamp, '%H%M%S%f')
+        return (True, value)
     return (False, 0)
 
 def _gen_hostname():
@@ -215,19 +184,7 @@ def _is_reserved(variable, variables):
 
     reserved_types = ['connection', 'content_runtime']
 
-    if 'node' in variables:
-        node_variables = variables['node']
-
-    if 'global' in variables:
-        global_variables = variables['global']
-
-    if variable in node_variables:
-        if node_variables[variable]['type'] in reserved_types:
-            return True
-    elif variable in global_variables:
-        if global_variables[variable]['type'] in reserved_types:
-            return True
-    return False
+    return variables.types.get(variable) in reserved_types
 
 def _is_public_key(variable, variables):
 
@@ -238,8 +195,7 @@ def _is_public_key(variable, variables):
     ssh_keys = ['public_ssh_key']
 
     if variable in ssh_keys:
-        from Crypto.PublicKey import RSA
-        return RSA.generate(2048).publickey().exportKey('OpenSSH')
+        return keypool.get_public_key()
     else:
         return None
 
@@ -289,17 +245,21 @@ def _resolve_usecase_variables(variables, use_case="default"):
     return temp_variables
 
 
-def resolve_parameters(override_variables, variables, camVariables, image_type="vmware", use_case="default"):
+def resolve_parameters(override_variables, variables, camVariables, image_type="vmware", use_case="default", owner=None):
 
     '''
     Return the translated list of CAM Variables parsed from the variables structure.
+    Addresses of the local IP pool are reserved for owner, the name of the stack to deploy.
     '''
 
+    # index the translation once, deploys loading it through lib.config already have it
+    if not isinstance(variables, Translation):
+        variables = Translation(variables)
+
     variable_map = {}
 
     # Instanciate IP Pool Variables
 
-    used_ip = list()
     ip_pool = {}
     ip_overrides = {}
     ip_pool_provider = variables['test_data']['provider']
@@ -314,10 +274,14 @@ def resolve_parameters(override_variables, variables, camVariables, image_type="
 
     node_list = _get_node_list(camVariables['template_input_params'], variables)
 
-    for node in node_list:
+    # all nodes of the template get their addresses in one step
+    ip_entries = []
+    if node_list and (image_type == "vmware" or image_type == "vsphere"):
+        ip_entries = _get_ip_pool(ip_pool_provider, ip_pool, node_list, minipam_url, owner)
+
+    for node_index, node in enumerate(node_list):
         if image_type == "vmware" or image_type == "vsphere":
-            ip, domain, hostname = _get_ip_pool(ip_pool_provider, ip_pool, used_ip, node, minipam_url)
-            used_ip.append(ip)
+            ip, domain, hostname = ip_entries[node_index]
         else:
             ip = "dummy"
             domain = "dummy"
@@ -333,8 +297,7 @@ def resolve_parameters(override_variables, variables, camVariables, image_type="
         virtual_machines = variables['virtual_machines']
 
         if image_type in virtual_machines:
-            vm_variables = virtual_machines[image_type]
-            vm_variables = _resolve_usecase_variables(vm_variables, use_case)
+            vm_variables = variables.vm_variables(image_type, use_case)
             if not vm_variables:
                 raise Exception("The specified Use Case %s does not exist." % use_case)
         else:
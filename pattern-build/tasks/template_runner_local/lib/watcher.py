@@ -0,0 +1,278 @@
+# =COPYRIGHT=======================================================
+# Licensed Materials - Property of IBM
+#
+# (c) Copyright IBM Corp. 2017, 2018 All Rights Reserved
+#
+# US Government Users Restricted Rights - Use, duplication or
+# disclosure restricted by GSA ADP Schedule Contract with IBM Corp.
+# =================================================================
+
+import os
+import json
+import time
+import threading
+from threading import Thread
+from multiprocessing.pool import ThreadPool
+
+from lib.logger import TestLogger
+
+# Longest wait between two polls of all watched stacks, one call covers every stack
+WATCH_INTERVAL = 30
+# Concurrent /retrieve calls for stacks read individually
+FAN_OUT = 8
+# Due stacks from which one GET /stacks listing of the whole tenant is cheaper than a
+# /retrieve per stack, override with WATCH_LIST_THRESHOLD
+LIST_THRESHOLD = int(os.getenv('WATCH_LIST_THRESHOLD', '5'))
+
+POLL_INTERVAL = 120  # poll the job status at least every 2 minutes
+FIRST_POLL_INTERVAL = 5  # first polls of a job are this far apart
+POLL_BACKOFF = 1.5  # growth of the poll interval between two polls
+
+
+def poll_intervals(expected_duration=None):
+    '''
+    Yield the seconds to sleep between two polls of a stack job. Polls start every
+    FIRST_POLL_INTERVAL seconds and back off up to POLL_INTERVAL. With an expected duration
+    (from earlier runs of the template) polling speeds up again once 80% of it has elapsed,
+    so a job is detected shortly after it finishes.
+    '''
+    interval = FIRST_POLL_INTERVAL
+    elapsed = 0
+    speed_up_at = expected_duration * 0.8 if expected_duration else None
+    while True:
+        if speed_up_at is not None and elapsed < speed_up_at <= elapsed + interval:
+            interval = max(FIRST_POLL_INTERVAL, speed_up_at - elapsed)
+            yield interval
+            elapsed += interval
+            interval = FIRST_POLL_INTERVAL
+            continue
+        yield interval
+        elapsed += interval
+        interval = min(POLL_INTERVAL, interval * POLL_BACKOFF)
+
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+class FutureTimeout(Exception):
+    '''
+    Raised by Future.wait when the operation did not finish in time
+    '''
+
+
+class Future(object):
+    '''
+    Outcome of an operation running in the background
+    '''
+
+    def __init__(self):
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._done.is_set()
+
+    def add_done_callback(self, callback):
+        '''
+        Call callback(future) once the operation finished, immediately if it already has
+        '''
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def wait(self, timeout=None):
+        '''
+        Block until the operation finished, return its result or raise its error. Raise
+        FutureTimeout if it did not finish within timeout seconds.
+        '''
+        if not self._done.wait(timeout):
+            raise FutureTimeout('The operation did not finish in %s seconds' % timeout)
+        if self.error:
+            raise self.error
+        return self.result
+
+    def complete(self, result=None, error=None):
+        with self._lock:
+            if self._done.is_set():
+                return
+            self.result = result
+            self.error = error
+            self._done.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+        for callback in callbacks:
+            callback(self)
+
+
+class StackFuture(Future):
+    '''
+    Outcome of a stack job (deploy or destroy) tracked by the StackWatcher
+    '''
+
+    def __init__(self, stack, timeout, expected_duration=None):
+        super(StackFuture, self).__init__()
+        self.stack = stack
+        self.deadline = time.time() + timeout
+        self.timeout = timeout
+        self.intervals = poll_intervals(expected_duration)
+        self.next_poll = time.time() + next(self.intervals)
+
+    def polled(self, max_interval):
+        '''
+        Schedule the next poll of the job, at most max_interval seconds away
+        '''
+        self.next_poll = time.time() + min(max_interval, next(self.intervals))
+
+
+class StackWatcher(Thread):
+    '''
+    Tracks the jobs of all in flight stacks with a single poller. Each job is polled on its
+    own poll_intervals() schedule, capped at WATCH_INTERVAL. Due stacks are retrieved
+    individually with at most FAN_OUT calls at a time. Only from list_threshold due stacks on
+    are the statuses of all watched stacks read from one GET /stacks listing instead, and due
+    stacks missing from it retrieved individually. Each waiting deployment is notified through
+    its StackFuture.
+    '''
+
+    def __init__(self, iaas, poll_interval=WATCH_INTERVAL, fan_out=FAN_OUT, list_threshold=LIST_THRESHOLD):
+        super(StackWatcher, self).__init__()
+        self.daemon = True
+        self.iaas = iaas
+        self.poll_interval = poll_interval
+        self.list_threshold = list_threshold
+        self.pool = ThreadPool(fan_out)
+        self.futures = {}
+        self.die = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self.logger = TestLogger(__name__)
+
+    def watch(self, stack, timeout, expected_duration=None):
+        '''
+        Start tracking the current job of the stack, return its StackFuture. expected_duration
+        is the job duration in seconds seen in earlier runs, if known.
+        '''
+        future = StackFuture(stack, timeout, expected_duration)
+        with self._lock:
+            self.futures[stack['id']] = future
+        # the new job may be due before the current wait ends
+        self._wake.set()
+        return future
+
+    def unwatch(self, stack):
+        '''
+        Stop tracking the stack, its future is left as it is
+        '''
+        with self._lock:
+            self.futures.pop(stack['id'], None)
+
+    def kill(self):
+        self.die = True
+        self._wake.set()
+
+    def _next_wait(self):
+        with self._lock:
+            next_polls = [future.next_poll for future in self.futures.values()]
+        if not next_polls:
+            return self.poll_interval
+        return max(0, min(self.poll_interval, min(next_polls) - time.time()))
+
+    def run(self):
+        while not self.die:
+            self._wake.wait(self._next_wait())
+            self._wake.clear()
+            try:
+                self.poll()
+            except Exception:
+                self.logger.exception('Failed to poll the watched stacks')
+
+    def _list_stacks(self):
+        response = self.iaas.retrieveAll()
+        if response.status_code == 401:
+            self.iaas._authenticate()
+            response = self.iaas.retrieveAll()
+        if response.status_code != 200:
+            self.logger.warning('Listing stacks failed with status %s, retrieving individually' % response.status_code)
+            return {}
+        return dict((stack['id'], stack) for stack in response.json() if 'id' in stack)
+
+    def _retrieve(self, stack):
+        try:
+            response = self.iaas.retrieve(stack)
+            if response.status_code == 401:
+                self.iaas._authenticate()
+                response = self.iaas.retrieve(stack)
+            if response.status_code == 200:
+                return response.json()
+            self.logger.error('Invalid response status code %s retrieving stack %s' % (response.status_code, stack['id']))
+        except Exception:
+            self.logger.exception('Failed to retrieve stack %s' % stack['id'])
+        return None
+
+    def poll(self):
+        '''
+        Read the status of every watched stack and complete the finished ones. Nothing is
+        read until a job is due.
+        '''
+        with self._lock:
+            futures = dict(self.futures)
+        now = time.time()
+        due = set(stack_id for stack_id, future in futures.items() if future.next_poll <= now)
+        if not due:
+            return
+
+        # the listing covers the whole tenant, it only pays off for many due stacks
+        listed = self._list_stacks() if len(due) >= self.list_threshold else {}
+        details = {}
+        missing = []
+        for stack_id, future in futures.items():
+            if stack_id in listed and 'status' in listed[stack_id]:
+                details[stack_id] = listed[stack_id]
+            elif stack_id in due:
+                missing.append(future.stack)
+        for stack, stack_details in zip(missing, self.pool.map(self._retrieve, missing)):
+            if stack_details:
+                details[stack['id']] = stack_details
+
+        for stack_id, future in futures.items():
+            stack_details = details.get(stack_id)
+            if stack_details and stack_details['status'] == 'SUCCESS':
+                self.logger.info("Job for stack id %s finished successfully." % stack_id)
+                self._complete(stack_id, result=stack_details)
+            elif stack_details and stack_details['status'] != 'IN_PROGRESS':
+                self.logger.info(json.dumps(stack_details, indent=4, separators=(',', ': ')))
+                self._complete(stack_id, error=Exception("Job for stack id %s failed with status %s" %
+                                                         (stack_id, stack_details['status'])))
+            elif time.time() > future.deadline:
+                self._complete(stack_id, error=Exception("The job for stack %s did not complete in %s." %
+                                                         (stack_id, future.timeout)))
+            elif stack_id in due:
+                future.polled(self.poll_interval)
+
+    def _complete(self, stack_id, result=None, error=None):
+        with self._lock:
+            future = self.futures.pop(stack_id, None)
+        if future:
+            future.complete(result=result, error=error)
+
+
+def shared_watcher(iaas):
+    '''
+    Return the started StackWatcher of this process, starting one on first use. Threads do not
+    survive a fork, a forked child starts its own watcher.
+    '''
+    pid = os.getpid()
+    with _watchers_lock:
+        watcher = _watchers.get(pid)
+        if watcher is None or not watcher.is_alive():
+            _watchers.clear()
+            watcher = StackWatcher(iaas)
+            watcher.start()
+            _watchers[pid] = watcher
+        return watcher
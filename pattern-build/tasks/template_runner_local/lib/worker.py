@@ -11,26 +11,46 @@ import json
 import time
 import os
 import sys
-from threading import Thread
+from threading import Thread, Timer, Condition
+from Queue import Queue, Empty
 from datetime import datetime, timedelta
 from random import randrange
 
-#import lib.catalog as catalog
+import lib.catalog as catalog
 from lib.iaas import IaaS
 import lib.stats as stats
 from lib.logger import TestLogger, ResultLogger
 from lib.iaas import AuthException
+from lib.async_iaas import AsyncIaaS
+from lib.watcher import Future
+from lib.imports import TemplateImports, REFERENCE_SLACK
+from lib.template import parse_template
+from lib.report import StressReport
+from lib.metrics import metrics, PHASE_IMPORT, PHASE_IN_PROGRESS, PHASE_DESTROY, PHASE_DELETE
 
 #TIMEOUT FOR Template 240 Mins
 _10_MINUTES = 14400
 
+# Seconds to wait between a finished deployment and its destroy, override with PRE_DESTROY_WAIT
+PRE_DESTROY_WAIT = int(os.getenv('PRE_DESTROY_WAIT', '0'))
+
+# Templates imported into CAM, shared by the test cases of all runs. A life cycle holds its
+# reference through the deploy and the destroy wait.
+template_imports = TemplateImports(reference_timeout=2 * _10_MINUTES + PRE_DESTROY_WAIT + REFERENCE_SLACK)
+
+# Safety limit of stacks in flight for an open loop StressWorker, override with STRESS_MAX_OUTSTANDING
+MAX_OUTSTANDING = int(os.getenv('STRESS_MAX_OUTSTANDING', '50'))
+
+# Appended to the report file name for the log of every stress test result
+RESULTS_LOG_SUFFIX = '.results.jsonl'
+
 
 class MonitorWorker(Thread):
     '''
     Monitor thread that collects the statistics from all the deployment workers and generates a file
     '''
 
-    def __init__(self, workers, report_file):
+    def __init__(self, workers, report_file, results_log=None, html_report=None):
         super(MonitorWorker, self).__init__()
         timestamp = datetime.now()
         self.start_time =  datetime.strftime(timestamp, '%H-%M-%S')
@@ -41,6 +61,9 @@ class MonitorWorker(Thread):
         else:
             self.workers = [workers]
         self.report_file = report_file
+        self.html_report = html_report
+        # every result is appended to the results log, the report is built from running totals
+        self.aggregator = stats.StatsAggregator(results_log or report_file + RESULTS_LOG_SUFFIX)
         self.collection_interval = float(os.environ['STAT_COLLECTION_INTERVAL'])
         self.logger = TestLogger(__name__)
 
@@ -65,6 +88,10 @@ class MonitorWorker(Thread):
         self.end_time =  datetime.strftime(timestamp, '%H-%M-%S')
 
         self.monitor()
+        self.aggregator.close()
+        if self.html_report:
+            StressReport('Stress test %s - %s' % (self.start_time, self.end_time),
+                         self.aggregator.summary(), self.html_report).generate()
 
     def check_active(self, workers):
         for worker in workers:
@@ -73,21 +100,22 @@ class MonitorWorker(Thread):
         return False
 
     def monitor(self):
-        worker_results = []
         for worker in self.workers:
-            worker_results += worker.getStats()
-        stats.dump(worker_results, self.report_file, start_time=self.start_time, end_time=self.end_time)
+            for result in worker.getStats():
+                self.aggregator.add(result)
+        self.aggregator.dump(self.report_file, start_time=self.start_time, end_time=self.end_time)
 
 class CleanWorker(Thread):
     '''
     Cleaning thread that loops through all the instances given to it and deletes them.
     '''
 
-    def __init__(self, thread_number, instances, prefix='StressTest'):
+    def __init__(self, thread_number, instances, prefix='StressTest', watcher=None):
         super(CleanWorker, self).__init__()
         self.thread_number = thread_number
         self.instances = instances
         self.iaas = IaaS()
+        self.iaas.watcher = watcher
         self.logger = TestLogger(__name__)
         self.prefix = prefix
 
@@ -110,25 +138,39 @@ class StressWorker(Thread):
     '''
     Deployment thread that loops through all the templates from the local catalog and
     runs the life cycle tests for each template found.
+
+    By default each life cycle starts when the previous one finished (closed loop). Given a
+    lib.concurrency.ArrivalProfile, deployments start at the profile's rate instead (open
+    loop), tracked through the watcher and capped at max_outstanding stacks in flight.
     '''
 
-    def __init__(self, thread_number, duration=None, statsd=None, random_delete=False):
+    def __init__(self, thread_number, duration=None, statsd=None, random_delete=False, watcher=None,
+                 arrival=None, max_outstanding=MAX_OUTSTANDING):
         super(StressWorker, self).__init__()
         self.thread_number = thread_number
         self.thread_name = "StressWorker(%s)" % thread_number
         self.duration = duration
         self.statsd = statsd
         self.random_delete = random_delete
-        self.stats = []
+        self.arrival = arrival
+        self.max_outstanding = max_outstanding
+        self.stats = Queue()
+        self.watcher = watcher
         self.iaas = IaaS()
+        self.iaas.watcher = watcher
         self.die = False
         self.logger = ResultLogger(__name__)
 
     def getStats(self):
         '''
-        Retrieves the statistics
+        Retrieves the statistics collected since the last call
         '''
-        return self.stats
+        results = []
+        while True:
+            try:
+                results.append(self.stats.get_nowait())
+            except Empty:
+                return results
 
     def _push_stats(self, result):
         '''
@@ -157,7 +199,53 @@ class StressWorker(Thread):
 
     def run(self):
         self.start = datetime.now()
+        if self.arrival:
+            self._run_open_loop()
+        else:
+            self._run_closed_loop()
+
+    def _record(self, result, stack_name, template_name):
+        '''
+        Keep the result of a life cycle for the monitor, statsd and the result log
+        '''
+        result['stack_name'] = stack_name
+        result['template'] = template_name
+        stats.normalize(result)
+        self.stats.put(result)
+
+        if self.statsd:
+            self._push_stats(result)
+
+        if not result['deploy_error']:
+            self.logger.info('%s, Deploy, %s, %s, %s, N/A' %
+                (self.thread_number, result['deploy_start_time'], result['deploy_end_time'], result['deploy_duration']))
+        else:
+            self.logger.info('%s, Deploy, %s, N/A, N/A, %s' %
+                (self.thread_number, result['deploy_start_time'], result['deploy_error']))
+
+        if 'destroy_error' in result:
+            if not result['destroy_error']:
+                self.logger.info('%s, Destroy/Delete, %s, %s, %s, N/A' %
+                    (self.thread_number, result['destroy_start_time'], result['destroy_end_time'], result['destroy_duration']))
+            else:
+                self.logger.info('%s, Destroy/Delete, %s, N/A, N/A, %s' %
+                    (self.thread_number, result['destroy_start_time'], result['destroy_error']))
+
+    def _next_deployment(self, template_name):
+        '''
+        Return the template source, the variables, the CAM template id, the stack name and
+        whether to delete the stack for the next deployment of a local catalog template
+        '''
+        [template, variables] = catalog.get_local_template(template_name)
+        timestamp = time.time()
+        stack_name = "StressTest%s_%s_%s" % (self.thread_number, template['name'].replace(" ", "_"), timestamp)
         to_be_deleted = True
+        if self.random_delete:
+            to_be_deleted = bool(randrange(0,2))
+        # catalog templates are already in CAM, they are deployed without an import
+        return template['manifest']['template']['templateData'], variables, template['id'], stack_name, to_be_deleted
+
+    def _run_closed_loop(self):
         while not self._endLoop():
             # loop through all the templates from the local catalog
             template_names = catalog.get_local_templates()
@@ -165,47 +253,121 @@ class StressWorker(Thread):
                 if self._endLoop():
                     break
 
-                [template, variables] = catalog.get_local_template(template_name)
+                template, variables, template_id, stack_name, to_be_deleted = self._next_deployment(template_name)
                 #
                 # test the template life cycle: deploy, retrieve the details and destroy.
                 #
-                timestamp = time.time()
-                stack_name = "StressTest%s_%s_%s" % (self.thread_number, template['name'].replace(" ", "_"), timestamp)
-                if self.random_delete:
-                    to_be_deleted = bool(randrange(0,2))
                 try:
-                    result = life_cycle_stack(self.iaas, stack_name, 'development', template_name, template, variables, False, delete=to_be_deleted)
-                    result['stack_name'] = stack_name
-                    self.stats.append(result)
-
-                    if self.statsd:
-                        self._push_stats(result)
-
-                    if not result['deploy_error']:
-                        self.logger.info('%s, Deploy, %s, %s, %s, N/A' %
-                            (self.thread_number, result['deploy_start_time'], result['deploy_end_time'], result['deploy_duration']))
-                    else:
-                        self.logger.info('%s, Deploy, %s, N/A, N/A, %s' %
-                            (self.thread_number, result['deploy_start_time'], result['deploy_error']))
-
-                    if 'destroy_error' in result:
-                        if not result['destroy_error']:
-                            self.logger.info('%s, Destroy/Delete, %s, %s, %s, N/A' %
-                                (self.thread_number, result['destroy_start_time'], result['destroy_end_time'], result['destroy_duration']))
-                        else:
-                            self.logger.info('%s, Destroy/Delete, %s, N/A, N/A, %s' %
-                                (self.thread_number, result['destroy_start_time'], result['destroy_error']))
-
+                    # the variables of a catalog template carry their values, keep failed
+                    # deployments for debugging
+                    result = life_cycle_stack(self.iaas, stack_name, 'development', template_name, template, {}, variables,
+                                              False, delete=to_be_deleted, template_id=template_id)
+                    self._record(result, stack_name, template_name)
                 except AuthException:
                     self.iaas = IaaS()
+                    self.iaas.watcher = self.watcher
+
+    def _run_open_loop(self):
+        '''
+        Start deployments at the times of the arrival profile, however many are still running,
+        so the offered load does not drop when CAM slows down. An arrival finding
+        max_outstanding stacks in flight is skipped and counted rather than queued.
+        '''
+        async_iaas = AsyncIaaS(self.iaas, watcher=self.watcher)
+        outstanding = Condition()
+        state = {'outstanding': 0, 'submitted': 0, 'skipped': 0}
+        started = next_arrival = time.time()
+        templates = []
+
+        def finished(future, stack_name, template_name):
+            with outstanding:
+                state['outstanding'] -= 1
+                outstanding.notify_all()
+            result = future.result
+            if future.error is not None:
+                result = {'deploy_start_time': None, 'deploy_error': future.error.__class__}
+            self._record(result, stack_name, template_name)
+
+        try:
+            while not self._endLoop():
+                next_arrival += self.arrival.interval(next_arrival - started)
+                # sleep in short steps so kill() is not held up by a slow arrival rate
+                while time.time() < next_arrival and not self._endLoop():
+                    time.sleep(min(1.0, next_arrival - time.time()))
+                if self._endLoop():
+                    break
+
+                # only this thread submits, the count can only drop until the slot is taken
+                with outstanding:
+                    if state['outstanding'] >= self.max_outstanding:
+                        state['skipped'] += 1
+                        self.logger.info('%s, Skipped, %s stacks outstanding' % (self.thread_number, state['outstanding']))
+                        continue
+
+                if not templates:
+                    templates = catalog.get_local_templates()
+                template_name = templates.pop(0)
+                template, variables, template_id, stack_name, to_be_deleted = self._next_deployment(template_name)
+                life_cycle = life_cycle_stack_async(async_iaas, stack_name, 'development', template_name, template, {},
+                                                    variables, False, delete=to_be_deleted, template_id=template_id)
+                # the slot is taken once the life cycle was submitted, before it can finish
+                with outstanding:
+                    state['outstanding'] += 1
+                    state['submitted'] += 1
+                life_cycle.add_done_callback(
+                    lambda future, stack_name=stack_name, template_name=template_name:
+                        finished(future, stack_name, template_name))
+
+            # let the stacks in flight finish their life cycle
+            with outstanding:
+                while state['outstanding']:
+                    outstanding.wait(1.0)
+        finally:
+            async_iaas.close()
+            self.logger.info('%s, Open loop, %s submitted, %s skipped at the limit of %s outstanding' %
+                             (self.thread_number, state['submitted'], state['skipped'], self.max_outstanding))
+
+def _template_source(template_path):
+
+    '''
+    Return the GitHub repository URL and directory a local template file was checked out from
+    '''
+    if 'starterlibrary' in template_path:
+        return ('https://github.ibm.com/Orpheus/starterlibrary',
+                '/'.join(template_path.split('/')[3:-1]))
+
+    template_name = 'template_%s' % template_path.split('/')[-1][0:-3]
+    return ('https://github.ibm.com/OpenContent/%s' % template_name,
+            '/%s' % '/'.join(template_path.split('/')[-3:-1]))
 
-def life_cycle_stack(iaas, stack_name, git_branch, template_path, template, parameters, camVariables, delete_failed_deployment, delete=True, template_id=None, use_case='default'):
+def _import_template(iaas, template_path, git_branch, stack_name=None):
+
+    '''
+    Import the template of a local template file into CAM from GitHub, return its id.
+    A template already imported at the same commit is reused, see lib.imports. The reference
+    is held by stack_name, so it can be released for a test case that was stopped.
+    '''
+    repo_url, repo_path = _template_source(template_path)
+    return template_imports.acquire(iaas, repo_url, repo_path, git_branch, os.environ['GIT_TOKEN'], holder=stack_name)
+
+def _release_template(iaas, template_id, stack_name=None):
+
+    '''
+    Release a template returned by _import_template, deleting it after its last user
+    '''
+    template_imports.release(iaas, template_id, holder=stack_name)
+
+def life_cycle_stack(iaas, stack_name, git_branch, template_path, template, parameters, camVariables, delete_failed_deployment, delete=True, template_id=None, use_case='default', expected_duration=None):
 
     '''
     Deploy the template and wait until it finishes successfully.
     Destroy the stack after the deployment finished.
+    A new IaaS client is created unless an existing one is passed in. expected_duration is
+    the deploy duration in seconds seen in earlier runs, used to time the status polls.
+    template is a lib.template.ParsedTemplate, or the template source which is then parsed.
     '''
-    iaas = IaaS()
+    if not isinstance(iaas, IaaS):
+        iaas = IaaS()
     result = {}
     result['name'] = stack_name
     stack = None
@@ -230,28 +392,17 @@ def life_cycle_stack(iaas, stack_name, git_branch, template_path, template, para
         #logger.info('parameters: %s' %parameters)
         #logger.info('camVariables: %s' %camVariables)
 
-        if not template_id:
-            if 'starterlibrary' in template_path:
-                template_path = '/'.join(template_path.split('/')[3:-1])
-                template_id = iaas.import_template(
-                    'github',
-                    'https://github.ibm.com/Orpheus/starterlibrary',
-                    template_path,
-                    git_branch,
-                    os.environ['GIT_TOKEN'])
-            else:
-                template_name = 'template_%s' % template_path.split('/')[-1][0:-3]
-                template_path = '/%s' % '/'.join(template_path.split('/')[-3:-1])
+        # parsed once here, deploy reuses it
+        template = parse_template(template)
+        result['cloud'] = template.provider
 
-                template_id = iaas.import_template(
-                    'github',
-                    'https://github.ibm.com/OpenContent/%s' % template_name,
-                    template_path,
-                    git_branch,
-                    os.environ['GIT_TOKEN'])
+        if not template_id:
+            with metrics.timer(PHASE_IMPORT, stack=stack_name):
+                template_id = _import_template(iaas, template_path, git_branch, stack_name)
 
         stack = iaas.deploy(stack_name, template_id, template, parameters, camVariables, use_case=use_case)
-        iaas.waitForSuccess(stack, _10_MINUTES)
+        with metrics.timer(PHASE_IN_PROGRESS, stack=stack_name):
+            iaas.waitForSuccess(stack, _10_MINUTES, expected_duration=expected_duration)
 
         # Will no longer delete the template after a successful deployment. CAM changed code to not
         # allow instances to be deleted if the template was destroyed.  CAM 2.1.0.2
@@ -277,15 +428,18 @@ def life_cycle_stack(iaas, stack_name, git_branch, template_path, template, para
     finally:
         if (stack is not None) and delete_deployment:
             try:
-                time.sleep(60)
+                if PRE_DESTROY_WAIT:
+                    time.sleep(PRE_DESTROY_WAIT)
                 start_time = datetime.now()
-                # result['destroy_start_time'] = datetime.strftime(start_time, '%Y-%m-%d %H:%M:%S')
-                iaas.destroy(stack)
-                iaas.waitForSuccess(stack, _10_MINUTES)  # wait for destroy to be completed
-                iaas.delete(stack)
-                # end_time = datetime.now()
-                # result['destroy_duration'] = (end_time - start_time)
-                # result['destroy_end_time'] = datetime.strftime(end_time, '%Y-%m-%d %H:%M:%S')
+                result['destroy_start_time'] = datetime.strftime(start_time, '%Y-%m-%d %H:%M:%S')
+                with metrics.timer(PHASE_DESTROY, stack=stack_name):
+                    iaas.destroy(stack)
+                    iaas.waitForSuccess(stack, _10_MINUTES)  # wait for destroy to be completed
+                with metrics.timer(PHASE_DELETE, stack=stack_name):
+                    iaas.delete(stack)
+                end_time = datetime.now()
+                result['destroy_duration'] = (end_time - start_time)
+                result['destroy_end_time'] = datetime.strftime(end_time, '%Y-%m-%d %H:%M:%S')
                 # result['destroy_error'] = None
             except AuthException, ex:
                 logger.warning('Authentication Error, re-authenticating\n%s' % ex)
@@ -296,7 +450,7 @@ def life_cycle_stack(iaas, stack_name, git_branch, template_path, template, para
                 result['destroy_error'] = ex
         if template_id and delete_template:
             try:
-                iaas.delete_template(template_id)
+                _release_template(iaas, template_id, stack_name)
             except AuthException, ex:
                 logger.warning('Authentication Error, re-authenticating\n%s' % ex)
                 raise ex
@@ -307,6 +461,138 @@ def life_cycle_stack(iaas, stack_name, git_branch, template_path, template, para
     return result
 
 
+def life_cycle_stack_async(async_iaas, stack_name, git_branch, template_path, template, parameters, camVariables, delete_failed_deployment, delete=True, template_id=None, use_case='default', expected_duration=None):
+
+    '''
+    Non blocking version of life_cycle_stack on a lib.async_iaas.AsyncIaaS client.
+    Each step is started from the completion of the previous one, no thread waits while the
+    stack deploys or destroys. Return a Future completed with the same result dictionary as
+    life_cycle_stack.
+    '''
+    logger = TestLogger(__name__)
+    outcome = Future()
+    result = {'name': stack_name}
+    state = {'stack': None, 'template_id': template_id, 'start_time': None, 'phase_start': None}
+    delete_deployment = delete
+    delete_template = not template_id
+
+    def failed(future, message):
+        if future.error is None:
+            return False
+        logger.error('%s: stack name: %s\n%s' % (message, stack_name, future.error))
+        return True
+
+    def timed(phase, future):
+        # record the step that just completed, the next step starts now
+        error = future.error.__class__ if future.error is not None else None
+        metrics.record_phase(phase, time.time() - state['phase_start'], stack=stack_name, error=error)
+        state['phase_start'] = time.time()
+
+    def finish(future=None):
+        if future is not None and failed(future, 'Failed to delete the template %s' % state['template_id']):
+            result['destroy_error'] = future.error.__class__
+        outcome.complete(result=result)
+
+    def cleanup_template():
+        if state['template_id'] and delete_template:
+            async_iaas.submit(_release_template, async_iaas.iaas, state['template_id'], stack_name).add_done_callback(finish)
+        else:
+            finish()
+
+    def destroyed(future):
+        if state['phase_start'] is not None:
+            timed(PHASE_DELETE, future)
+        if failed(future, 'Failed to delete/destroy the template'):
+            result['destroy_error'] = future.error.__class__
+        else:
+            end_time = datetime.now()
+            result['destroy_duration'] = (end_time - state['start_time'])
+            result['destroy_end_time'] = datetime.strftime(end_time, '%Y-%m-%d %H:%M:%S')
+        cleanup_template()
+
+    def destroy_finished(future):
+        timed(PHASE_DESTROY, future)
+        if future.error is not None:
+            state['phase_start'] = None
+            destroyed(future)
+        else:
+            async_iaas.delete(state['stack']).add_done_callback(destroyed)
+
+    def destroy_started(future):
+        if future.error is not None:
+            timed(PHASE_DESTROY, future)
+            state['phase_start'] = None
+            destroyed(future)
+        else:
+            async_iaas.waitForSuccess(state['stack'], _10_MINUTES).add_done_callback(destroy_finished)
+
+    def destroy_stack():
+        state['start_time'] = datetime.now()
+        result['destroy_start_time'] = datetime.strftime(state['start_time'], '%Y-%m-%d %H:%M:%S')
+        state['phase_start'] = time.time()
+        async_iaas.destroy(state['stack']).add_done_callback(destroy_started)
+
+    def deploy_finished(future):
+        if failed(future, 'Failed to deploy the template'):
+            result['deploy_error'] = future.error.__class__
+            if not delete_failed_deployment:
+                # keep the failed deployments for debugging
+                cleanup_template()
+                return
+        else:
+            end_time = datetime.now()
+            result['deploy_duration'] = (end_time - state['start_time'])
+            result['deploy_end_time'] = datetime.strftime(end_time, '%Y-%m-%d %H:%M:%S')
+
+        if state['stack'] is None or not delete_deployment:
+            cleanup_template()
+        elif PRE_DESTROY_WAIT:
+            timer = Timer(PRE_DESTROY_WAIT, destroy_stack)
+            timer.daemon = True
+            timer.start()
+        else:
+            destroy_stack()
+
+    def deploy_started(future):
+        if future.error is None:
+            state['stack'] = future.result
+            state['phase_start'] = time.time()
+            async_iaas.waitForSuccess(state['stack'], _10_MINUTES, expected_duration).add_done_callback(in_progress_finished)
+        else:
+            deploy_finished(future)
+
+    def in_progress_finished(future):
+        timed(PHASE_IN_PROGRESS, future)
+        deploy_finished(future)
+
+    def imported(future):
+        if state['phase_start'] is not None:
+            timed(PHASE_IMPORT, future)
+        if future.error is None:
+            state['template_id'] = future.result
+            async_iaas.deploy(stack_name, state['template_id'], template, parameters, camVariables,
+                              use_case=use_case).add_done_callback(deploy_started)
+        else:
+            deploy_finished(future)
+
+    state['start_time'] = datetime.now()
+    result['deploy_start_time'] = datetime.strftime(state['start_time'], '%Y-%m-%d %H:%M:%S')
+    logger.info('stack-name: %s' % stack_name)
+    try:
+        template = parse_template(template)
+        result['cloud'] = template.provider
+    except Exception:
+        pass  # the deploy step reports a template that does not parse
+    future = Future()
+    if state['template_id']:
+        future.complete(result=state['template_id'])
+    else:
+        state['phase_start'] = time.time()
+        future = async_iaas.submit(_import_template, async_iaas.iaas, template_path, git_branch, stack_name)
+    future.add_done_callback(imported)
+    return outcome
+
+
 def get_cr_templates(provider):
     """Returns list of content runtime templates"""
     iaas = IaaS()
@@ -0,0 +1,106 @@
+#! /usr/bin/env python
+# =COPYRIGHT=======================================================
+# Licensed Materials - Property of IBM
+#
+# (c) Copyright IBM Corp. 2017, 2018 All Rights Reserved
+#
+# US Government Users Restricted Rights - Use, duplication or
+# disclosure restricted by GSA ADP Schedule Contract with IBM Corp.
+# =================================================================
+
+"""Stand-in minipam server -- serves the ip_pool of a translation file, see 'minipam_server -h'"""
+
+import json
+import argparse
+import threading
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+
+class IPPool(object):
+    '''
+    The addresses handed out by the server and the ones currently in use
+    '''
+
+    def __init__(self, ip_pool):
+        self.free = list(ip_pool)
+        self.used = {}
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            if not self.free:
+                return None
+            ip_entry = self.free.pop(0)
+            self.used[ip_entry['ip_ipaddress']] = ip_entry
+            return ip_entry
+
+    def release(self, ip):
+        with self.lock:
+            if ip not in self.used:
+                return False
+            self.free.append(self.used.pop(ip))
+            return True
+
+
+class MinipamHandler(BaseHTTPRequestHandler):
+
+    def _reply(self, status, body):
+        content = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        if url.path == '/get':
+            ip_entry = self.server.pool.get()
+            if ip_entry is None:
+                self._reply(400, {'error': 'IP Pool Exhausted'})
+            else:
+                self._reply(200, {'ipaddress': ip_entry['ip_ipaddress'],
+                                  'domain': ip_entry['ip_domain'],
+                                  'hostname': ip_entry['ip_hostname']})
+        elif url.path == '/free':
+            ip = urlparse.parse_qs(url.query).get('ip_address', [''])[0]
+            if self.server.pool.release(ip):
+                self._reply(200, {'ipaddress': ip})
+            else:
+                self._reply(404, {'error': '%s is not in use' % ip})
+        else:
+            self._reply(404, {'error': 'Unknown path %s' % url.path})
+
+
+class MinipamServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, ip_pool):
+        HTTPServer.__init__(self, address, MinipamHandler)
+        self.pool = IPPool(ip_pool)
+
+
+def main():
+    '''
+    Serve the ip_pool section of a translation file with the minipam API
+    '''
+    parser = argparse.ArgumentParser(
+        description='Serves the ip_pool of a translation file with the minipam API (/get, /free).')
+    parser.add_argument(
+        '-t', '--translation_file', type=argparse.FileType('r'), required=True,
+        help='Translation file holding the ip_pool to serve')
+    parser.add_argument(
+        '-p', '--port', type=int, default=5200,
+        help='Port to listen on (default: 5200)')
+    args = parser.parse_args()
+
+    ip_pool = json.load(args.translation_file)['ip_pool']
+    server = MinipamServer(('', args.port), ip_pool)
+    print 'Serving %s addresses on port %s' % (len(ip_pool), args.port)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -19,10 +19,19 @@ import hcl
 import lib.local.env as env
 from lib.logger import TestLogger
 import lib.worker as worker
+from lib.iaas import IaaS
+from lib.watcher import shared_watcher
+from lib.template import load_template
+import lib.keypool as keypool
+from lib.metrics import metrics, METRICS_FILE
+from lib.history import PHASE_DEPLOY, PHASE_DESTROY
 
 
 LOGGER = TestLogger(__name__)
 
+# File the deploy and destroy durations of the run are written to as JSON, set by run_test_cases
+RESULT_FILE = 'TEMPLATE_RUNNER_RESULT_FILE'
+
 
 def get_local_template(tf_template_file, tf_variable_files, cam_variable_file):
     '''
@@ -31,8 +40,8 @@ def get_local_template(tf_template_file, tf_variable_files, cam_variable_file):
     # parse the files -- hcl.load() dually supports both JSON and HCL formats
     # If HCL contains heredoc notation, and file has CRLF encodings, it will
     # fail. See: https://github.com/virtuald/pyhcl/issues/25
-    template_str = tf_template_file.read()  # load the entire file into String
-    hcl.loads(template_str)  # test parse / raise error on parse failure
+    # load and parse the template once (raises on parse failure), deploy reuses the parsed form
+    template = load_template(tf_template_file)
 
     # read the variable file(s), updating/overwriting variables_dict as we go
     variables_dict = {}
@@ -44,7 +53,7 @@ def get_local_template(tf_template_file, tf_variable_files, cam_variable_file):
     if cam_variable_file:
         camvariables_dict = json.load(cam_variable_file)
 
-    return [template_str, {'variable': variables_dict}, camvariables_dict]
+    return [template, {'variable': variables_dict}, camvariables_dict]
 
 
 def env_or_cli(env_key, cli_arg):
@@ -65,9 +74,9 @@ def set_connection_env(env_key, cli_arg):
         os.environ[env_key] = os.getenv(env_key, cli_arg)
 
 
-def main():
+def build_parser():
     '''
-    Runs a TF template with CAM
+    Returns the command line parser of the template runner
     '''
     parser = argparse.ArgumentParser(
         description='Runs a terraform template against CAMaaS.',
@@ -109,6 +118,9 @@ def main():
     parser.add_argument(
         '-uc', '--use_case', type=str, required=False, default='default',
         help='Use case in the translation file to use as source data' )
+    parser.add_argument(
+        '-ed', '--expected_duration', type=float, required=False,
+        help='Deploy duration in seconds seen in earlier runs, used to time the status polls')
 
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument(
@@ -126,10 +138,44 @@ def main():
     parser.add_argument(
         '--autodestroy', default=False, action='store_true',
         help="Automatically destroy after deploying (default: False)")
+    parser.add_argument(
+        '--metrics_file', type=str, required=False,
+        help="Append the phase timings and CAM call statistics of the run to this JSON "
+             "lines file, unless METRICS_FILE is set (default: no metrics)")
+
+    return parser
+
+
+def _template_input_params(camvariables):
+    '''
+    Return the input parameters of a camvariables.json, which holds either the list of
+    parameters or a dictionary with them under template_input_params
+    '''
+    if isinstance(camvariables, list):
+        return camvariables
+    return camvariables.get('template_input_params', [])
+
 
+def _report_durations(result, durations):
+    '''
+    Fill durations with the deploy and destroy seconds of the result, and write them to the
+    RESULT_FILE if one is set
+    '''
+    if 'deploy_duration' in result:
+        durations[PHASE_DEPLOY] = result['deploy_duration'].total_seconds()
+    if 'destroy_duration' in result:
+        durations[PHASE_DESTROY] = result['destroy_duration'].total_seconds()
+    if os.getenv(RESULT_FILE):
+        with open(os.environ[RESULT_FILE], 'w') as result_file:
+            json.dump(durations, result_file)
 
-    args = parser.parse_args()
 
+def run(args, iaas=None, durations=None):
+    '''
+    Runs a TF template with CAM using the parsed command line arguments. An already
+    authenticated IaaS client can be passed in to be reused for the deployment. The deploy
+    and destroy durations in seconds are added to durations, also when the run fails.
+    '''
     # setup the environment variables needed for worker & iaas
     # os.environ['W3_USERNAME'] = os.getenv(
     #     'W3_USERNAME', args.w3_username)
@@ -153,16 +199,37 @@ def main():
     set_connection_env('IBMCLOUD_CLOUD_CONNECTION',
                        args.ibmcloud_cloud_connection)
     set_connection_env('VSPHERE_CLOUD_CONNECTION', args.vmware_cloud_connection)
+    set_connection_env(METRICS_FILE, args.metrics_file)
     env.set_env(args.cam_url, args.cam_port, "local")  # set environment
-    [template_str, variables_dict, camvariables_dict] = get_local_template(
+    [template, variables_dict, camvariables_dict] = get_local_template(
         args.tf_template_file, args.tf_variable_files, args.cam_variable_file)
     template_path = args.tf_template_file.name
 
+    # generate the SSH key translation needs while the template is imported and deployed,
+    # this process deploys once so a single key is enough
+    if any(variable.get('name') == 'public_ssh_key'
+           for variable in _template_input_params(camvariables_dict)):
+        keypool.start(size=1, refill=False)
+
     LOGGER.info('Deploying: %s' %args.stack_name)
 
-    result = worker.life_cycle_stack("local",
-       args.stack_name, args.git_branch, template_path, template_str, variables_dict, camvariables_dict,
-       args.delete_failed_deployments, delete=args.autodestroy, use_case=args.use_case)
+    # stack jobs are tracked by the watcher of this process, a fork of the suite runner
+    # starts its own
+    if not isinstance(iaas, IaaS):
+        iaas = IaaS()
+    if iaas.watcher is None or not iaas.watcher.is_alive():
+        iaas.watcher = shared_watcher(iaas)
+
+    try:
+        result = worker.life_cycle_stack(iaas,
+           args.stack_name, args.git_branch, template_path, template, variables_dict, camvariables_dict,
+           args.delete_failed_deployments, delete=args.autodestroy, use_case=args.use_case,
+           expected_duration=args.expected_duration)
+    finally:
+        # one snapshot per test case, also when test cases share a process
+        metrics.emit_snapshot(stack=args.stack_name)
+        metrics.clear()
+    _report_durations(result, durations if durations is not None else {})
 
     if 'deploy_error' in result:
         raise result['deploy_error']
@@ -170,5 +237,12 @@ def main():
         raise result['destroy_error']
     return result
 
+
+def main():
+    '''
+    Runs a TF template with CAM
+    '''
+    return run(build_parser().parse_args())
+
 if __name__ == "__main__":
     main()
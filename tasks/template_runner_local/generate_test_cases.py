@@ -16,10 +16,12 @@ import hcl
 import fnmatch
 import time
 import re
+import hashlib
 
 import lib.local.env as env
 from lib.logger import TestLogger
 import lib.worker as worker
+from lib.state import StateStore, STATE_FILE, test_case_name
 
 logger = TestLogger(__name__)
 
@@ -72,18 +74,37 @@ def _get_cloud_from_file(filename):
     else:
         return None
 
+def _compile_regexs(regexs):
+
+    '''
+    Compile a space separated list of regexs once for all the templates
+    '''
+
+    return [re.compile(regex) for regex in regexs.split(' ') if regex]
+
 def _string_in_regexs(in_string, regexs):
 
     '''
-    Determine if a string matches a list of regexs
+    Determine if a string matches a list of compiled regexs
     '''
 
-    for regex in regexs.split(' '):
-        if regex:
-            if re.search(regex, in_string):
-                return True
+    for regex in regexs:
+        if regex.search(in_string):
+            return True
     return False
 
+def _prune_directories(dirnames, clouds):
+
+    '''
+    Remove the directories that cannot hold a template to test from an os.walk() listing:
+    hidden directories such as .git, and the directories of clouds that are not tested.
+    Cloud directories are assumed not to be nested in each other.
+    '''
+
+    dirnames[:] = [dirname for dirname in dirnames
+                   if not dirname.startswith('.') and
+                   (dirname.lower() not in dir_to_cloud or dir_to_cloud[dirname.lower()] in clouds)]
+
 def _get_terraform_templates(template_directory, clouds, regexs, not_regexs):
 
     '''
@@ -91,8 +112,12 @@ def _get_terraform_templates(template_directory, clouds, regexs, not_regexs):
     type is matched by the clouds list.
     '''
 
+    regexs = _compile_regexs(regexs)
+    not_regexs = _compile_regexs(not_regexs)
+
     templates = []
     for root, dirnames, filenames in os.walk(template_directory):
+        _prune_directories(dirnames, clouds)
         for filename in fnmatch.filter(filenames, '*.tf'):
             cloud = _get_cloud_from_file(os.path.join(root, filename))
             if cloud in clouds:
@@ -105,17 +130,15 @@ def _get_terraform_templates(template_directory, clouds, regexs, not_regexs):
                         break
     return templates
 
-def _generate_test_case(template_file, test_suite, testing_variables_file, test_branch, cam_instance):
+def _generate_test_case(template_file, test_suite, testing_variables_file, testing_variables, test_branch, cam_instance):
 
     '''
     Create a specific test case for a specific cloud and template.
+    testing_variables is the content of testing_variables_file, loaded once for all templates.
     Return as an array of dictionaries.
     '''
 
     cloud_type = _get_cloud_from_file(template_file)
-    fp = open(testing_variables_file.name)
-    testing_variables = json.load(fp)
-    fp.close()
 
     test_cases = []
     test_case_list = []
@@ -170,6 +193,89 @@ def _generate_test_case(template_file, test_suite, testing_variables_file, test_
 
     return test_cases
 
+def _hash_directory(directory, hashes):
+
+    '''
+    Return the hash of the files of a template directory: the template, its variables,
+    camvariables.json and override_variables.json. Hashes are kept in hashes by directory.
+    '''
+
+    if directory not in hashes:
+        digest = hashlib.sha256()
+        for filename in sorted(os.listdir(directory)):
+            path = os.path.join(directory, filename)
+            if os.path.isfile(path):
+                digest.update(filename + '\0')
+                with open(path, 'rb') as fp:
+                    digest.update(hashlib.sha256(fp.read()).digest())
+        hashes[directory] = digest.hexdigest()
+    return hashes[directory]
+
+def _input_hash(test_case, testing_variables, template_directory, hashes):
+
+    '''
+    Return the hash of everything a test case deploys: its template directory, the sections of
+    the testing variables used to translate it, and the test case definition itself. Paths are
+    hashed relative to template_directory, so the hash survives a checkout in another place.
+    '''
+
+    translation = dict((section, testing_variables.get(section)) for section in ['test_data', 'node', 'global', 'ip_fields'])
+    translation['virtual_machines'] = (testing_variables.get('virtual_machines') or {}).get(test_case['cloud'])
+    # the testing variables are covered by their content in translation
+    definition = dict((key, value) for key, value in test_case.items() if key not in ['status', 'input_hash', 'testing_variables'])
+    definition['template_file'] = os.path.relpath(test_case['template_file'], template_directory)
+
+    digest = hashlib.sha256()
+    digest.update(_hash_directory(os.path.dirname(test_case['template_file']), hashes))
+    digest.update(json.dumps(translation, sort_keys=True))
+    digest.update(json.dumps(definition, sort_keys=True))
+    return digest.hexdigest()
+
+def _write_test_cases(test_cases, base_output_directory, incremental=False):
+
+    '''
+    Write the test case files, then add all the test cases to the state store of the suite in
+    a single transaction so the runner does not have to read the files back.
+
+    In incremental mode the suite already exists: test cases whose input hash did not change
+    keep their status if they succeeded, new and changed ones are to be tested, and the ones
+    no longer generated are removed.
+    '''
+
+    state_store = StateStore(os.path.join(base_output_directory, STATE_FILE))
+    previous = {}
+    if incremental:
+        previous = dict((test_case_name(test_case), test_case) for test_case in state_store.test_cases())
+
+    unchanged = 0
+    for test_case in test_cases:
+        name = test_case_name(test_case)
+        filename = os.path.join(base_output_directory, name + '.json')
+        test_case['test_case_file'] = filename
+        test_case['log_file'] = base_output_directory + os.sep + 'logs' + os.sep + name + '.log'
+        previous_test_case = previous.pop(name, None)
+        if previous_test_case and previous_test_case.get('input_hash') == test_case['input_hash']:
+            if previous_test_case['status'] == CASE_SUCCESS:
+                test_case['status'] = CASE_SUCCESS
+            unchanged = unchanged + 1
+            continue
+        fp = open(filename, 'w')
+        logger.info('Test Case Generated: %s ' % filename)
+        json.dump(test_case, fp)
+        fp.close()
+
+    if not incremental:
+        state_store.add(test_cases)
+        return
+
+    for name, test_case in previous.items():
+        logger.info('Test Case Removed: %s ' % test_case['test_case_file'])
+        if os.path.isfile(test_case['test_case_file']):
+            os.remove(test_case['test_case_file'])
+    state_store.replace_all(test_cases)
+    logger.info('Test Cases unchanged: %s, generated: %s, removed: %s' %
+                (unchanged, len(test_cases) - unchanged, len(previous)))
+
 def main():
     '''
     Generate a library of testcases based upon a test suite.
@@ -202,6 +308,10 @@ def main():
         '-b', '--branch',
         type=str, required=False, default='None',
         help='Name of the branch to test against, default stored in the suite.')
+    parser.add_argument(
+        '-i', '--incremental', default=False, action='store_true',
+        help='Update an existing suite, only test cases whose template, camvariables or '
+             'testing variables changed are tested again (default: False)')
     parser.add_argument(
         '-c', '--cam_instance',
         type=str, required=False, default='None',
@@ -241,6 +351,10 @@ def main():
     if not os.path.exists( base_output_directory):
         os.makedirs(base_output_directory)
         os.makedirs(base_output_directory + os.sep + 'logs')
+    elif args.incremental:
+        logger.info('Updating existing suite directory: %s ' % base_output_directory)
+        if not os.path.isdir(base_output_directory + os.sep + 'logs'):
+            os.makedirs(base_output_directory + os.sep + 'logs')
     else:
         logger.exception('Suite directory already exists: %s ' % base_output_directory)
         sys.exit(EXIT_DIRECTORY_EXISTS)
@@ -258,19 +372,16 @@ def main():
 
     test_cases = []
     for template in templates:
-        test_case = _generate_test_case(template, test_suite, args.testing_variables, args.branch, args.cam_instance)
+        test_case = _generate_test_case(template, test_suite, args.testing_variables, testing_variables, args.branch, args.cam_instance)
         test_cases = test_cases + test_case
 
+    hashes = {}
+    for test_case in test_cases:
+        test_case['input_hash'] = _input_hash(test_case, testing_variables, template_directory, hashes)
+
     # Save test case files
     logger.info('Creating Test Cases')
-    for test_case in test_cases:
-        filename = os.path.join(base_output_directory, test_case['template_name'] + '_' + test_case['cloud'] + '_' + test_case['test_case'] + '.json')
-        test_case['test_case_file'] = filename
-        test_case['log_file'] = base_output_directory + os.sep + 'logs' + os.sep + test_case['template_name'] + '_' + test_case['cloud'] + '_' + test_case['test_case'] + '.log'
-        fp = open(filename, 'w')
-        logger.info('Test Case Generated: %s ' % filename)
-        json.dump(test_case, fp)
-        fp.close()
+    _write_test_cases(test_cases, base_output_directory, incremental=args.incremental)
 
 if __name__ == "__main__":
     main()
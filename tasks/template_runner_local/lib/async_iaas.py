@@ -0,0 +1,90 @@
+# =COPYRIGHT=======================================================
+# Licensed Materials - Property of IBM
+#
+# (c) Copyright IBM Corp. 2017, 2018 All Rights Reserved
+#
+# US Government Users Restricted Rights - Use, duplication or
+# disclosure restricted by GSA ADP Schedule Contract with IBM Corp.
+# =================================================================
+
+from multiprocessing.pool import ThreadPool
+
+from lib.iaas import IaaS
+from lib.watcher import Future, StackWatcher
+
+# Threads making CAM calls, shared by every operation of the client
+ASYNC_WORKERS = 16
+
+
+class AsyncIaaS(object):
+    '''
+    Non blocking counterpart of IaaS. Every method returns a Future right away and the CAM
+    call runs on a small shared thread pool using the IaaS client's pooled session. Stack jobs
+    are awaited through a StackWatcher, so nothing holds a thread while a stack deploys and a
+    single process can drive hundreds of stacks at once.
+    '''
+
+    def __init__(self, iaas=None, workers=ASYNC_WORKERS, watcher=None):
+        self.iaas = iaas or IaaS()
+        self.pool = ThreadPool(workers)
+        self.watcher = watcher
+        # a watcher passed in is shared with other clients and outlives this one
+        self.own_watcher = watcher is None
+        if self.watcher is None:
+            self.watcher = StackWatcher(self.iaas)
+            self.watcher.start()
+
+    def submit(self, function, *args, **kwargs):
+        '''
+        Run function on the thread pool, return a Future of its result
+        '''
+        future = Future()
+
+        def call():
+            try:
+                future.complete(result=function(*args, **kwargs))
+            except Exception as ex:
+                future.complete(error=ex)
+
+        self.pool.apply_async(call)
+        return future
+
+    def deploy(self, stack_name, template_id, template, parameters, camVariables, use_case='default'):
+        return self.submit(self.iaas.deploy, stack_name, template_id, template, parameters, camVariables,
+                            use_case=use_case)
+
+    def retrieve(self, stack):
+        return self.submit(self.iaas.retrieve, stack)
+
+    def retrieveAll(self):
+        return self.submit(self.iaas.retrieveAll)
+
+    def destroy(self, stack):
+        return self.submit(self.iaas.destroy, stack)
+
+    def delete(self, stack):
+        return self.submit(self.iaas.delete, stack)
+
+    def import_template(self, github_hostname, github_repo_url, github_path, github_branch, github_token, type=None):
+        return self.submit(self.iaas.import_template, github_hostname, github_repo_url, github_path,
+                            github_branch, github_token, type)
+
+    def delete_template(self, template_id):
+        return self.submit(self.iaas.delete_template, template_id)
+
+    def get_cloud_connections(self):
+        return self.submit(self.iaas.get_cloud_connections)
+
+    def get_cloud_connection(self, template_provider):
+        return self.submit(self.iaas.get_cloud_connection, template_provider)
+
+    def waitForSuccess(self, stack, timeoutInSeconds, expected_duration=None):
+        '''
+        Return a future completed when the current job of the stack finishes
+        '''
+        return self.watcher.watch(stack, timeoutInSeconds, expected_duration)
+
+    def close(self):
+        if self.own_watcher:
+            self.watcher.kill()
+        self.pool.close()
@@ -3,6 +3,9 @@ import json
 from lib.logger import TestLogger
 import requests
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
+from lib.session import get_session
+from lib.credentials import get_token_cache
+import local.env as env
 
 if env.ENV == 'local':
     import local.env as env
@@ -19,12 +22,12 @@ class Catalog:
 
     def __init__(self):
         self.verify = os.environ['ENV'] != 'local'
-
-        auth_response = auth.authenticate()
-        self.bearer_token = auth_response[0]
-        self.org_guid = auth_response[1]
-        self.space_guid = auth_response[2]
-        self.tenant_id = tenant.get_tenant_id([self.bearer_token, self.org_guid, self.space_guid])
+        self.token_cache = get_token_cache(env.AUTH_HOST, auth, tenant)
+        self.credentials = self.token_cache.get()
+        self.bearer_token = self.credentials.bearer_token
+        self.org_guid = self.credentials.org_guid
+        self.space_guid = self.credentials.space_guid
+        self.tenant_id = self.credentials.tenant_id
 
         self.request_params = {
             'ace_orgGuid': self.org_guid,
@@ -36,6 +39,11 @@ class Catalog:
 
         self.logger = TestLogger(__name__)
 
+    @property
+    def session(self):
+        # resolved per call so a forked child uses its own pool
+        return get_session()
+
     def _remove_none(self, obj):
         rem = []
         for i in obj:
@@ -45,6 +53,8 @@ class Catalog:
             del obj[i]
 
     def _get_request_header(self):
+        self.credentials = self.token_cache.get()
+        self.bearer_token = self.credentials.bearer_token
         return {'Authorization': self.bearer_token['token_type'] + ' ' + self.bearer_token['access_token']}
 
     def _get_request_params(self):
@@ -54,10 +64,10 @@ class Catalog:
         """
         Retrieves all the templates from the catalog and saves them locally
         """
-        response = requests.get(env.CATALOG_HOST + '/catalogs',
-                                headers=self._get_request_header(),
-                                params=self._get_request_params(),
-                                verify=self.verify)
+        response = self.session.get(env.CATALOG_HOST + '/catalogs',
+                                    headers=self._get_request_header(),
+                                    params=self._get_request_params(),
+                                    verify=self.verify)
 
         templates = response.json()
         for template in templates:
@@ -71,10 +81,10 @@ class Catalog:
         """
         Retrieves the template from the catalog and saves the content locally
         """
-        response = requests.get(env.CATALOG_HOST + '/catalogs/' + template_id,
-                                headers=self._get_request_header(),
-                                params=self._get_request_params(),
-                                verify=self.verify)
+        response = self.session.get(env.CATALOG_HOST + '/catalogs/' + template_id,
+                                    headers=self._get_request_header(),
+                                    params=self._get_request_params(),
+                                    verify=self.verify)
         if response.status_code != 200:
             raise Exception("Failed to retrieve template %s from the catalog, status code is %s" % (
                 template_id, response.status_code))
@@ -122,11 +132,11 @@ class Catalog:
             'template_content': template['manifest']['template']['templateData']
 
         }
-        response = requests.post(env.IAAS_HOST + '/templates/parsevariables',
-                                 headers=self._get_request_header(),
-                                 data=request_body,
-                                 params=self._get_request_params(),
-                                 verify=self.verify)
+        response = self.session.post(env.IAAS_HOST + '/templates/parsevariables',
+                                     headers=self._get_request_header(),
+                                     data=request_body,
+                                     params=self._get_request_params(),
+                                     verify=self.verify)
 
         if response.status_code != 200:
             raise Exception("Failed to parse variables for %s, status code is %s\nRequest Headers:\n%s\nRequest URL:%s" % (
@@ -0,0 +1,176 @@
+# =COPYRIGHT=======================================================
+# Licensed Materials - Property of IBM
+#
+# (c) Copyright IBM Corp. 2017, 2018 All Rights Reserved
+#
+# US Government Users Restricted Rights - Use, duplication or
+# disclosure restricted by GSA ADP Schedule Contract with IBM Corp.
+# =================================================================
+
+import time
+import random
+import threading
+import requests
+
+from lib.logger import TestLogger
+
+# Seconds between two CAM health probes
+PROBE_INTERVAL = 30
+# A /stacks call slower than this counts as CAM being under pressure
+LATENCY_THRESHOLD = 10.0
+# Number of consecutive healthy probes before the limit is raised by one
+HEALTHY_PROBES = 2
+
+
+def parse_cloud_caps(cloud_caps):
+    '''
+    Parse a list of cloud=cap strings, for example ['vsphere=3', 'aws=10'], into a dictionary
+    '''
+    caps = {}
+    for cloud_cap in cloud_caps or []:
+        cloud, cap = cloud_cap.split('=', 1)
+        if int(cap) < 1:
+            raise ValueError('The cap for cloud %s must be at least 1' % cloud)
+        caps[cloud.strip()] = int(cap)
+    return caps
+
+
+class ArrivalProfile(object):
+    '''
+    Arrival times of an open loop load, rates are in deployments per hour.
+
+    constant submits every 1/rate hours, poisson draws exponential gaps of the same mean, ramp
+    moves the rate linearly from rate to end_rate over ramp_seconds and then holds end_rate.
+    '''
+
+    KINDS = ('constant', 'poisson', 'ramp')
+
+    def __init__(self, kind, rate, end_rate=None, ramp_seconds=None):
+        if kind not in self.KINDS:
+            raise ValueError('Unknown arrival profile %s, expected one of %s' % (kind, ', '.join(self.KINDS)))
+        if rate <= 0 or (end_rate is not None and end_rate <= 0):
+            raise ValueError('Arrival rates must be above 0')
+        if kind == 'ramp' and (end_rate is None or not ramp_seconds):
+            raise ValueError('A ramp needs an end rate and a duration')
+        self.kind = kind
+        self.rate = float(rate)
+        self.end_rate = float(end_rate) if end_rate is not None else self.rate
+        self.ramp_seconds = ramp_seconds
+
+    def rate_at(self, elapsed):
+        '''
+        Return the target rate elapsed seconds into the run
+        '''
+        if self.kind != 'ramp' or elapsed >= self.ramp_seconds:
+            return self.end_rate
+        return self.rate + (self.end_rate - self.rate) * elapsed / self.ramp_seconds
+
+    def interval(self, elapsed):
+        '''
+        Return the seconds from the arrival elapsed seconds into the run to the next one
+        '''
+        mean = 3600.0 / self.rate_at(elapsed)
+        if self.kind == 'poisson':
+            return random.expovariate(1.0 / mean)
+        return mean
+
+
+def parse_arrival(arrival):
+    '''
+    Parse an arrival profile, for example constant=60, poisson=60 or ramp=10:120:3600 (from 10
+    to 120 deployments per hour over 3600 seconds)
+    '''
+    kind, rates = arrival.split('=', 1)
+    kind = kind.strip()
+    if kind == 'ramp':
+        rate, end_rate, ramp_seconds = rates.split(':')
+        return ArrivalProfile(kind, float(rate), float(end_rate), float(ramp_seconds))
+    return ArrivalProfile(kind, float(rates))
+
+
+class AdaptiveLimit(object):
+    '''
+    Concurrency limit for in flight deployments, driven by the health of CAM.
+
+    The limit grows by one after HEALTHY_PROBES consecutive healthy probes of GET /stacks and
+    is halved as soon as a probe sees a 429, a 5xx, a timeout or a latency above
+    LATENCY_THRESHOLD (additive increase, multiplicative decrease).
+    '''
+
+    def __init__(self, iaas, initial, minimum=1, maximum=25, probe_interval=PROBE_INTERVAL):
+        self.iaas = iaas
+        self.limit = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.probe_interval = probe_interval
+        self.last_probe = 0
+        self.healthy = 0
+        self.probing = False
+        self.lock = threading.Lock()
+        self.logger = TestLogger(__name__)
+
+    def update(self):
+        '''
+        Start a probe of CAM in the background if the probe interval has elapsed, the limit is
+        adjusted when it returns. Return the current limit without waiting for the probe, so a
+        slow CAM does not hold up the caller.
+        '''
+        with self.lock:
+            if not self.probing and time.time() - self.last_probe >= self.probe_interval:
+                self.last_probe = time.time()
+                self.probing = True
+                thread = threading.Thread(target=self._run_probe)
+                thread.daemon = True
+                thread.start()
+            return self.limit
+
+    def _run_probe(self):
+        try:
+            latency, status_code = self._probe()
+            if status_code == 401:
+                # an expired token says nothing about the load of CAM, probe again with a new one
+                self.iaas._authenticate()
+                latency, status_code = self._probe()
+            self.record(latency, status_code)
+        except Exception:
+            self.logger.exception('CAM health probe failed')
+        finally:
+            with self.lock:
+                self.probing = False
+                # the next interval starts once the probe returned
+                self.last_probe = time.time()
+
+    def _probe(self):
+        start = time.time()
+        try:
+            response = self.iaas.retrieveAll()
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+            return (time.time() - start, None)
+        return (time.time() - start, response.status_code)
+
+    def record(self, latency, status_code):
+        '''
+        Record a probe result, a status_code of None means the request timed out or failed
+        to connect. Only a 2xx counts as healthy, other client errors are not a sample.
+        '''
+        with self.lock:
+            self._record(latency, status_code)
+
+    def _record(self, latency, status_code):
+        if status_code is None or status_code == 429 or status_code >= 500 or latency > LATENCY_THRESHOLD:
+            self.healthy = 0
+            limit = max(self.minimum, self.limit // 2)
+            if limit != self.limit:
+                self.logger.warning('CAM under pressure (status %s, %.1fs), lowering concurrency to %s' %
+                                    (status_code, latency, limit))
+            self.limit = limit
+            return
+        if not 200 <= status_code < 300:
+            self.logger.warning('CAM health probe returned status %s, ignoring the sample' % status_code)
+            return
+
+        self.healthy += 1
+        if self.healthy >= HEALTHY_PROBES and self.limit < self.maximum:
+            self.healthy = 0
+            self.limit += 1
+            self.logger.info('CAM healthy (%.1fs), raising concurrency to %s' % (latency, self.limit))
@@ -1,7 +1,7 @@
 import os
 from lib.logger import TestLogger
+from lib.template import load_template
 import urllib2
-import hcl
 import json
 
 
@@ -63,11 +63,9 @@ class CustomTemplate:
         Method to convert file HCL to JSON format.
         """
         try:
-            with open(file_name, 'rb') as outfile:
-                json_object = hcl.dumps(hcl.load(outfile))
-                outfile.close()
-                self._create_json_file(json_object, file_name)
-                os.remove(file_name)  # Remove .tf file
+            json_object = json.dumps(load_template(file_name).parsed)
+            self._create_json_file(json_object, file_name)
+            os.remove(file_name)  # Remove .tf file
         except:
             self.logger.exception("Failed to Convert file %s from HCL to JSON format." % file_name)
 
@@ -0,0 +1,127 @@
+# =COPYRIGHT=======================================================
+# Licensed Materials - Property of IBM
+#
+# (c) Copyright IBM Corp. 2017, 2018 All Rights Reserved
+#
+# US Government Users Restricted Rights - Use, duplication or
+# disclosure restricted by GSA ADP Schedule Contract with IBM Corp.
+# =================================================================
+
+import os
+import time
+import sqlite3
+
+# Name of the duration history, kept next to the suite directories so all suites share it
+HISTORY_FILE = 'history.db'
+# Number of most recent runs averaged for an expected duration
+HISTORY_RUNS = 5
+
+# Phases recorded for a test case
+PHASE_LIFECYCLE = 'lifecycle'
+PHASE_DEPLOY = 'deploy'
+PHASE_DESTROY = 'destroy'
+
+
+def history_key(test_case):
+    return (test_case['template_name'], test_case['cloud'], test_case['test_case'])
+
+
+class DurationHistory(object):
+    '''
+    Durations of past test case runs per template, cloud, use case and phase, kept across
+    runs in a SQLite file. Safe to share between the runner and its test case processes.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS durations ('
+                               'template TEXT NOT NULL, '
+                               'cloud TEXT NOT NULL, '
+                               'use_case TEXT NOT NULL, '
+                               'phase TEXT NOT NULL, '
+                               'seconds REAL NOT NULL, '
+                               'recorded REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS durations_key '
+                               'ON durations (template, cloud, use_case, phase, recorded)')
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def record(self, test_case, phase, seconds):
+        '''
+        Record the duration in seconds of a phase of a test case run
+        '''
+        template, cloud, use_case = history_key(test_case)
+        self._connect().execute('INSERT INTO durations (template, cloud, use_case, phase, seconds, recorded) '
+                                'VALUES (?, ?, ?, ?, ?, ?)',
+                                (template, cloud, use_case, phase, seconds, time.time()))
+
+    def expected(self, test_case, phase):
+        '''
+        Return the average duration of the last runs of the phase, or None if never recorded
+        '''
+        template, cloud, use_case = history_key(test_case)
+        rows = self._connect().execute('SELECT seconds FROM durations '
+                                       'WHERE template = ? AND cloud = ? AND use_case = ? AND phase = ? '
+                                       'ORDER BY recorded DESC LIMIT ?',
+                                       (template, cloud, use_case, phase, HISTORY_RUNS)).fetchall()
+        if not rows:
+            return None
+        return sum(row[0] for row in rows) / len(rows)
+
+    def expected_all(self, phase):
+        '''
+        Return a dictionary of (template, cloud, use_case) to the average duration of the last
+        runs of the phase
+        '''
+        durations = {}
+        for template, cloud, use_case, seconds in self._connect().execute(
+                'SELECT template, cloud, use_case, seconds FROM durations '
+                'WHERE phase = ? ORDER BY recorded DESC', (phase,)):
+            runs = durations.setdefault((template, cloud, use_case), [])
+            if len(runs) < HISTORY_RUNS:
+                runs.append(seconds)
+        return dict((key, sum(runs) / len(runs)) for key, runs in durations.items())
+
+
+def longest_first(test_cases, expected):
+    '''
+    Order test cases longest expected duration first (LPT) to shorten the total run time,
+    interleaving clouds so one provider does not get all the long deployments at once.
+
+    expected is a dictionary of history_key() to seconds. Test cases without history are
+    assumed to take as long as the longest known test case of their cloud, so they start early.
+    '''
+    longest = {}
+    for (template, cloud, use_case), seconds in expected.items():
+        longest[cloud] = max(longest.get(cloud, 0), seconds)
+    default = max(longest.values()) if longest else 0
+
+    by_cloud = {}
+    for test_case in test_cases:
+        seconds = expected.get(history_key(test_case), longest.get(test_case['cloud'], default))
+        by_cloud.setdefault(test_case['cloud'], []).append((seconds, test_case))
+    for cloud_cases in by_cloud.values():
+        cloud_cases.sort(key=lambda item: item[0], reverse=True)
+
+    ordered = []
+    last_cloud = None
+    while by_cloud:
+        # Longest head first, but avoid picking the same cloud twice in a row when possible
+        clouds = sorted(by_cloud.keys(), key=lambda cloud: by_cloud[cloud][0][0], reverse=True)
+        if len(clouds) > 1 and clouds[0] == last_cloud:
+            cloud = clouds[1]
+        else:
+            cloud = clouds[0]
+        ordered.append(by_cloud[cloud].pop(0)[1])
+        if not by_cloud[cloud]:
+            del by_cloud[cloud]
+        last_cloud = cloud
+    return ordered
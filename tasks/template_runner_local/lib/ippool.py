@@ -0,0 +1,156 @@
+# =COPYRIGHT=======================================================
+# Licensed Materials - Property of IBM
+#
+# (c) Copyright IBM Corp. 2017, 2018 All Rights Reserved
+#
+# US Government Users Restricted Rights - Use, duplication or
+# disclosure restricted by GSA ADP Schedule Contract with IBM Corp.
+# =================================================================
+
+import os
+import time
+import socket
+import sqlite3
+import tempfile
+import subprocess
+from platform import system as system_name # Returns the system/OS name
+from multiprocessing.pool import ThreadPool
+
+# Reservations of the local IP pool shared by all runs on this machine, override with IP_LEDGER_FILE
+IP_LEDGER_FILE = os.getenv('IP_LEDGER_FILE', os.path.join(tempfile.gettempdir(), 'template_runner_ip_ledger.db'))
+# Seconds after which a reservation never released (crashed run, failed deploy) expires
+RESERVATION_TTL = int(os.getenv('IP_RESERVATION_TTL', str(24 * 60 * 60)))
+# Concurrent pings while probing candidate addresses
+PROBE_WORKERS = 16
+
+
+def ping(host):
+    """
+    Returns True if host (str) responds to a ping request.
+    Remember that some hosts may not respond to a ping request even if the host name is valid.
+    """
+
+    # Ping parameters as function of OS
+    parameters = ['-n', '1', '-w', '2000'] if system_name().lower() == "windows" else ['-c', '1', '-W', '2']
+
+    with open(os.devnull, 'w') as devnull:
+        return subprocess.call(['ping'] + parameters + [host], stdout=devnull, stderr=devnull) == 0
+
+
+def _owner():
+    return '%s:%s' % (socket.gethostname(), os.getpid())
+
+
+class IPLedger(object):
+    '''
+    Reservations of the addresses of the local IP pool, kept in a SQLite file so parallel
+    runs never hand out the same address. Each reservation is owned by the stack name it was
+    made for, so any process destroying the stack can release it. An address stays reserved
+    until then, or until RESERVATION_TTL seconds have passed.
+    '''
+
+    def __init__(self, path=IP_LEDGER_FILE):
+        self.path = path
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS reservations ('
+                               'ip TEXT PRIMARY KEY, '
+                               'owner TEXT NOT NULL, '
+                               'reserved REAL NOT NULL)')
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def reserve(self, candidates, count, owner=None):
+        '''
+        Atomically reserve up to count of the candidate addresses that are not reserved yet,
+        in candidate order, for owner (this process by default). Return the reserved addresses.
+        '''
+        owner = owner or _owner()
+        now = time.time()
+        connection = self._connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('DELETE FROM reservations WHERE reserved < ?', (now - RESERVATION_TTL,))
+            reserved = set(row[0] for row in connection.execute('SELECT ip FROM reservations'))
+            free = [ip for ip in candidates if ip not in reserved][:count]
+            connection.executemany('INSERT INTO reservations (ip, owner, reserved) VALUES (?, ?, ?)',
+                                   [(ip, owner, now) for ip in free])
+        return free
+
+    def release(self, ips):
+        '''
+        Release reserved addresses, unknown ones are ignored
+        '''
+        if not ips:
+            return
+        connection = self._connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany('DELETE FROM reservations WHERE ip = ?', [(ip,) for ip in ips])
+
+    def release_owner(self, owner):
+        '''
+        Release every address reserved for owner, return them
+        '''
+        connection = self._connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            ips = [row[0] for row in connection.execute('SELECT ip FROM reservations WHERE owner = ?', (owner,))]
+            connection.execute('DELETE FROM reservations WHERE owner = ?', (owner,))
+        return ips
+
+
+def allocate(ip_pool, count, ledger=None, owner=None):
+    '''
+    Return count free entries of the local IP pool, reserved in the ledger for owner, the name
+    of the stack they are for.
+
+    Candidates are reserved in batches and pinged concurrently, so a multi node template
+    waits for about one ping timeout instead of one per address. Addresses that answer are in
+    use outside of the runner and are released again. Raise an exception if the pool cannot
+    provide count addresses.
+    '''
+    ledger = ledger or IPLedger()
+    entries = dict((entry['ip_ipaddress'], entry) for entry in ip_pool)
+    candidates = [entry['ip_ipaddress'] for entry in ip_pool]
+    allocated = []
+    while len(allocated) < count:
+        needed = count - len(allocated)
+        # reserve some spares, a few candidates usually turn out to be alive
+        batch = ledger.reserve(candidates, needed * 2, owner)
+        if not batch:
+            ledger.release(allocated)
+            raise Exception("IP Pool Exhausted")
+        # never reserve the same candidate twice within this allocation
+        candidates = [ip for ip in candidates if ip not in batch]
+
+        pool = ThreadPool(min(len(batch), PROBE_WORKERS))
+        try:
+            alive = pool.map(ping, batch)
+        finally:
+            pool.close()
+        free = [ip for ip, is_alive in zip(batch, alive) if not is_alive]
+        allocated.extend(free[:needed])
+        ledger.release([ip for ip, is_alive in zip(batch, alive) if is_alive] + free[needed:])
+
+    return [entries[ip] for ip in allocated]
+
+
+def release(ips, ledger=None):
+    '''
+    Release addresses allocated from the local IP pool
+    '''
+    (ledger or IPLedger()).release(ips)
+
+
+def release_owner(owner, ledger=None):
+    '''
+    Release the addresses allocated from the local IP pool for owner, a stack name
+    '''
+    return (ledger or IPLedger()).release_owner(owner)
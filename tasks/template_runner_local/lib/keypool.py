@@ -0,0 +1,106 @@
+# =COPYRIGHT=======================================================
+# Licensed Materials - Property of IBM
+#
+# (c) Copyright IBM Corp. 2017, 2018 All Rights Reserved
+#
+# US Government Users Restricted Rights - Use, duplication or
+# disclosure restricted by GSA ADP Schedule Contract with IBM Corp.
+# =================================================================
+
+import os
+import random
+import string
+import threading
+from Queue import Queue
+
+# Public SSH keys generated ahead of use, override with SSH_KEY_POOL_SIZE
+KEY_POOL_SIZE = int(os.getenv('SSH_KEY_POOL_SIZE', '2'))
+# Set by the test case runner to one public key shared by every test case of a suite run
+SUITE_SSH_KEY = 'SUITE_SSH_PUBLIC_KEY'
+
+PASSWORD_LENGTH = 10
+#SPECIAL_CHARS = '!()-._~@#'
+SPECIAL_CHARS = '!().~@#'
+
+_pool = None
+_lock = threading.Lock()
+
+
+def generate_password(length=PASSWORD_LENGTH):
+    '''
+    Return a random password with at least one lower-case letter, one upper-case letter, one
+    digit and one special character, built directly rather than drawn until one complies
+    '''
+    rnd = random.SystemRandom()
+    all_chars = string.ascii_letters + string.digits + SPECIAL_CHARS
+    password = [rnd.choice(string.ascii_lowercase), rnd.choice(string.ascii_uppercase),
+                rnd.choice(string.digits), rnd.choice(SPECIAL_CHARS)]
+    password.extend(rnd.choice(all_chars) for i in range(length - len(password)))
+    rnd.shuffle(password)
+    return ''.join(password)
+
+
+def generate_public_key():
+    '''
+    Return the public part of a new 2048 bit RSA key in OpenSSH format
+    '''
+    from Crypto.PublicKey import RSA
+    return RSA.generate(2048).publickey().exportKey('OpenSSH')
+
+
+class KeyPool(object):
+    '''
+    Public SSH keys generated by a background thread, so a deployment takes a ready key
+    instead of spending the RSA generation time inline. The thread keeps size keys ready.
+    Without refill the thread stops after size keys, later keys are generated inline.
+    '''
+
+    def __init__(self, size=KEY_POOL_SIZE, refill=True):
+        self.keys = Queue(maxsize=max(1, size))
+        self.refill = refill
+        # keys the thread still puts into the queue when it does not refill
+        self.remaining = max(1, size)
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(target=self._fill)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _fill(self):
+        for i in range(self.remaining):
+            self.keys.put(generate_public_key())
+        while self.refill:
+            self.keys.put(generate_public_key())
+
+    def get(self):
+        if not self.refill:
+            with self._lock:
+                if self.remaining == 0:
+                    return generate_public_key()
+                self.remaining -= 1
+        return self.keys.get()
+
+
+def start(size=KEY_POOL_SIZE, refill=True):
+    '''
+    Start generating keys in the background, ahead of the first deployment of this process.
+    A process deploying once passes size=1 and refill=False so no key is generated in vain.
+    A forked child starts its own pool, keys are never shared between processes. Nothing is
+    generated when the suite wide key is set.
+    '''
+    global _pool
+    if os.getenv(SUITE_SSH_KEY):
+        return None
+    with _lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = KeyPool(size, refill)
+        return _pool
+
+
+def get_public_key():
+    '''
+    Return the suite wide public key when one was set, otherwise a key from the pool
+    '''
+    if os.getenv(SUITE_SSH_KEY):
+        return os.environ[SUITE_SSH_KEY]
+    return start().get()
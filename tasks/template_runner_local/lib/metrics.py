@@ -0,0 +1,204 @@
+# =COPYRIGHT=======================================================
+# Licensed Materials - Property of IBM
+#
+# (c) Copyright IBM Corp. 2017, 2018 All Rights Reserved
+#
+# US Government Users Restricted Rights - Use, duplication or
+# disclosure restricted by GSA ADP Schedule Contract with IBM Corp.
+# =================================================================
+
+import os
+import re
+import json
+import time
+import atexit
+import urlparse
+import threading
+from contextlib import contextmanager
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+# JSON lines file every runner appends its phase events and HTTP statistics to, unset to disable
+METRICS_FILE = 'METRICS_FILE'
+
+# Phases of a stack life cycle
+PHASE_IMPORT = 'import'
+PHASE_RESOLVE = 'resolve'
+PHASE_CREATE = 'create'
+PHASE_IN_PROGRESS = 'in_progress'
+PHASE_DESTROY = 'destroy'
+PHASE_DELETE = 'delete'
+
+# Path segments that are object ids, replaced so calls are grouped per endpoint
+_ID_SEGMENT = re.compile(r'/(?:[0-9a-fA-F]{24}|[0-9a-fA-F-]{36}|\d+)(?=/|$)')
+
+
+def endpoint(method, url):
+    '''
+    Return the endpoint of a request, for example POST /cam/api/v1/stacks/:id/retrieve
+    '''
+    return '%s %s' % (method, _ID_SEGMENT.sub('/:id', urlparse.urlparse(url).path))
+
+
+class Metrics(object):
+    '''
+    Phase durations and CAM HTTP calls of this process. Phase events are streamed to the
+    METRICS_FILE as they happen, totals can be read as a snapshot or in the Prometheus text
+    format.
+    '''
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        # A forked child starts with empty metrics instead of counting its parent's again
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self.phases = {}
+        self.http = {}
+        self.emitted = False
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._reset()
+
+    def clear(self):
+        self._check_fork()
+        with self._lock:
+            self.phases = {}
+            self.http = {}
+
+    def _emit(self, event):
+        path = os.getenv(METRICS_FILE)
+        if not path:
+            return
+        event['time'] = time.time()
+        event['pid'] = os.getpid()
+        line = json.dumps(event) + '\n'
+        # one short write per line so lines of parallel processes do not interleave
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def record_phase(self, phase, seconds, stack=None, error=None):
+        self._check_fork()
+        with self._lock:
+            totals = self.phases.setdefault(phase, {'count': 0, 'errors': 0, 'seconds': 0.0, 'max': 0.0})
+            totals['count'] += 1
+            totals['seconds'] += seconds
+            totals['max'] = max(totals['max'], seconds)
+            if error:
+                totals['errors'] += 1
+        self._emit({'event': 'phase', 'phase': phase, 'stack': stack, 'seconds': seconds,
+                    'error': error.__name__ if error else None})
+
+    @contextmanager
+    def timer(self, phase, stack=None):
+        '''
+        Time the block as one run of phase, a block raising an error counts as a failed run
+        '''
+        start = time.time()
+        try:
+            yield
+        except Exception as ex:
+            self.record_phase(phase, time.time() - start, stack=stack, error=ex.__class__)
+            raise
+        self.record_phase(phase, time.time() - start, stack=stack)
+
+    def record_http(self, method, url, status_code, seconds):
+        self._check_fork()
+        with self._lock:
+            totals = self.http.setdefault(endpoint(method, url),
+                                          {'count': 0, 'errors': 0, 'seconds': 0.0, 'max': 0.0, 'status': {}})
+            totals['count'] += 1
+            totals['seconds'] += seconds
+            totals['max'] = max(totals['max'], seconds)
+            totals['status'][status_code] = totals['status'].get(status_code, 0) + 1
+            if status_code >= 400:
+                totals['errors'] += 1
+
+    def response_hook(self, response, *args, **kwargs):
+        '''
+        requests response hook recording every call of a session
+        '''
+        self.record_http(response.request.method, response.request.url, response.status_code,
+                         response.elapsed.total_seconds())
+
+    def snapshot(self):
+        self._check_fork()
+        with self._lock:
+            return json.loads(json.dumps({'phases': self.phases, 'http': self.http}))
+
+    def emit_snapshot(self, **fields):
+        '''
+        Append the totals of this process to the METRICS_FILE, tagged with fields
+        '''
+        snapshot = self.snapshot()
+        if snapshot['phases'] or snapshot['http']:
+            snapshot.update(fields)
+            snapshot['event'] = 'snapshot'
+            self._emit(snapshot)
+        self.emitted = True
+
+    def emit_final(self):
+        '''
+        Append the totals of this process at exit, unless it already wrote its snapshots
+        explicitly, such as one per test case
+        '''
+        self._check_fork()
+        if not self.emitted:
+            self.emit_snapshot()
+
+    def prometheus(self):
+        '''
+        Return the totals in the Prometheus text exposition format
+        '''
+        snapshot = self.snapshot()
+        lines = ['# TYPE cam_phase_seconds summary']
+        for phase, totals in sorted(snapshot['phases'].items()):
+            lines.append('cam_phase_seconds_count{phase="%s"} %s' % (phase, totals['count']))
+            lines.append('cam_phase_seconds_sum{phase="%s"} %s' % (phase, totals['seconds']))
+        lines.append('# TYPE cam_phase_errors_total counter')
+        for phase, totals in sorted(snapshot['phases'].items()):
+            lines.append('cam_phase_errors_total{phase="%s"} %s' % (phase, totals['errors']))
+        lines.append('# TYPE cam_http_request_seconds summary')
+        for name, totals in sorted(snapshot['http'].items()):
+            lines.append('cam_http_request_seconds_count{endpoint="%s"} %s' % (name, totals['count']))
+            lines.append('cam_http_request_seconds_sum{endpoint="%s"} %s' % (name, totals['seconds']))
+        lines.append('# TYPE cam_http_responses_total counter')
+        for name, totals in sorted(snapshot['http'].items()):
+            for status_code, count in sorted(totals['status'].items()):
+                lines.append('cam_http_responses_total{endpoint="%s",code="%s"} %s' % (name, status_code, count))
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+# every runner appends the totals of its process when it exits
+atexit.register(metrics.emit_final)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        content = metrics.prometheus()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port):
+    '''
+    Serve the metrics of this process for Prometheus on port, in a daemon thread
+    '''
+    server = HTTPServer(('', port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
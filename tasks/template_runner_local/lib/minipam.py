@@ -0,0 +1,132 @@
+# =COPYRIGHT=======================================================
+# Licensed Materials - Property of IBM
+#
+# (c) Copyright IBM Corp. 2017, 2018 All Rights Reserved
+#
+# US Government Users Restricted Rights - Use, duplication or
+# disclosure restricted by GSA ADP Schedule Contract with IBM Corp.
+# =================================================================
+
+import os
+import ast
+import json
+import threading
+from multiprocessing.pool import ThreadPool
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from lib.logger import TestLogger
+
+# Seconds to wait for minipam to answer a request
+MINIPAM_TIMEOUT = int(os.getenv('MINIPAM_TIMEOUT', '30'))
+# Concurrent requests when getting or freeing several addresses
+FAN_OUT = 8
+# Retries on connection errors, requests minipam received are never sent twice
+RETRIES = 3
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+def _get_session():
+    # Only connection errors are retried: a /get retried after a read timeout could reserve
+    # a second address that nobody frees
+    pid = os.getpid()
+    with _lock:
+        if pid not in _sessions:
+            _sessions.clear()
+            retry = Retry(total=RETRIES, connect=RETRIES, read=0, status=0, raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=FAN_OUT, pool_maxsize=FAN_OUT, max_retries=retry)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[pid] = session
+        return _sessions[pid]
+
+
+def _parse(content):
+    try:
+        return json.loads(content)
+    except ValueError:
+        # older minipam servers answer with the repr of a python dictionary
+        return ast.literal_eval(content)
+
+
+class MinipamClient(object):
+    '''
+    Client of a minipam IP address manager: GET /get reserves a free address, GET
+    /free?ip_address= releases it. Several addresses are reserved or released concurrently
+    over a keep-alive session.
+    '''
+
+    def __init__(self, url, timeout=MINIPAM_TIMEOUT):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = _get_session()
+        self.logger = TestLogger(__name__)
+
+    def get(self):
+        '''
+        Reserve a free address, return its ip, domain and hostname
+        '''
+        response = self.session.get(self.url + '/get', timeout=self.timeout)
+        if response.status_code == 400:
+            raise Exception("IP Pool Exhausted")
+        if response.status_code != 200:
+            raise Exception("Failed to get an IP address from minipam, status code %s\nresponse:\n%s" %
+                            (response.status_code, response.content))
+        ip_entry = _parse(response.content)
+        return (ip_entry['ipaddress'], ip_entry['domain'], ip_entry['hostname'])
+
+    def get_many(self, count):
+        '''
+        Reserve count addresses at once. If any of them cannot be reserved, the others are
+        freed again and the error is raised.
+        '''
+        if count <= 1:
+            return [self.get() for i in range(count)]
+
+        def get(index):
+            try:
+                return (self.get(), None)
+            except Exception as ex:
+                return (None, ex)
+
+        pool = ThreadPool(min(count, FAN_OUT))
+        try:
+            results = pool.map(get, range(count))
+        finally:
+            pool.close()
+        errors = [error for ip_entry, error in results if error]
+        if errors:
+            self.free_many([ip_entry[0] for ip_entry, error in results if ip_entry])
+            raise errors[0]
+        return [ip_entry for ip_entry, error in results]
+
+    def free(self, ip):
+        '''
+        Release an address, a failure is logged but does not fail the destroy
+        '''
+        try:
+            response = self.session.get(self.url + '/free', params={'ip_address': ip}, timeout=self.timeout)
+            if response.status_code != 200:
+                self.logger.warning('Failed to free %s in minipam, status code %s' % (ip, response.status_code))
+        except requests.exceptions.RequestException:
+            self.logger.exception('Failed to free %s in minipam' % ip)
+
+    def free_many(self, ips):
+        '''
+        Release several addresses concurrently
+        '''
+        if len(ips) <= 1:
+            for ip in ips:
+                self.free(ip)
+            return
+
+        pool = ThreadPool(min(len(ips), FAN_OUT))
+        try:
+            pool.map(self.free, ips)
+        finally:
+            pool.close()
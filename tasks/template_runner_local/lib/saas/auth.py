@@ -1,6 +1,6 @@
 import os
-import requests
 import env
+from lib.session import get_session
 
 AUTH_HOST = env.AUTH_HOST
 
@@ -13,7 +13,7 @@ def authenticate():
 
 
 def _get_bearer_token():
-    info = requests.get(AUTH_HOST + '/info')
+    info = get_session().get(AUTH_HOST + '/info')
     auth_endpoint = info.json()['authorization_endpoint'] + '/oauth/token'
     params = {
         "grant_type": "password",
@@ -21,7 +21,7 @@ def _get_bearer_token():
         "scope": "",
         "username": os.environ['BLUEMIX_USERNAME']
     }
-    response = requests.post(auth_endpoint, params=params, auth=('cf', ''))
+    response = get_session().post(auth_endpoint, params=params, auth=('cf', ''))
     return response.json()
 
 
@@ -32,7 +32,7 @@ def _get_org_guid(bearer_token):
         'token_type'] + ' ' + bearer_token['access_token']}
     url = AUTH_HOST + '/v2/organizations?region=' + \
         region + '&q=name%3A' + os.environ['BLUEMIX_ORG_NAME']
-    response = requests.get(url, headers=request_header).json()
+    response = get_session().get(url, headers=request_header).json()
     return _findKey(response, 'guid')[0]
 
 
@@ -41,7 +41,7 @@ def _get_space_guid(bearer_token, org_guid):
         'token_type'] + ' ' + bearer_token['access_token']}
     url = AUTH_HOST + '/v2/organizations/' + org_guid + \
         '/spaces?q=name%3A' + os.environ['BLUEMIX_SPACE_NAME']
-    response = requests.get(url, headers=request_header).json()
+    response = get_session().get(url, headers=request_header).json()
     return _findKey(response, 'guid')[0]
 
 
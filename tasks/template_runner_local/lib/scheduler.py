@@ -0,0 +1,173 @@
+# =COPYRIGHT=======================================================
+# Licensed Materials - Property of IBM
+#
+# (c) Copyright IBM Corp. 2017, 2018 All Rights Reserved
+#
+# US Government Users Restricted Rights - Use, duplication or
+# disclosure restricted by GSA ADP Schedule Contract with IBM Corp.
+# =================================================================
+
+import os
+import time
+import signal
+import Queue
+from multiprocessing import Process
+from multiprocessing import Queue as ProcessQueue
+
+from lib.logger import TestLogger
+from lib.state import test_case_name
+
+# Seconds to wait for a completion message before checking for children that died without one
+# or ran out of time
+REAP_INTERVAL = 5
+# Seconds a timed out child gets to exit after SIGTERM before it is killed
+KILL_GRACE = 10
+
+
+def _run_and_report(run_test_case, test_case, results):
+    '''
+    Child process entry point. Runs the test case and always reports back to the scheduler,
+    even when the test case raised. The child leads its own process group so the scheduler
+    can stop it together with any process it started.
+    '''
+    os.setsid()
+    status = None
+    try:
+        status = run_test_case(test_case)
+    finally:
+        results.put((test_case['test_case_file'], status))
+
+
+class TestScheduler(object):
+    '''
+    Event driven test scheduler. Keeps up to pool_size test cases running, each in its own
+    child process, and starts the next queued test case as soon as a child reports that it
+    has finished. Children that exit without reporting (killed, crashed) are detected from
+    their exit code and finished with failure_status.
+
+    on_finish, if given, is called in the scheduler process with the test case, its final
+    status and its wall clock duration in seconds whenever a test case finishes.
+
+    limiter, if given, replaces pool_size with a limit that changes during the run (see
+    lib.concurrency.AdaptiveLimit). cloud_caps limits the number of running test cases per
+    cloud, for example to the size of the vsphere IP pool.
+
+    timeout, if given, is the wall clock budget of a test case in seconds. A test case over
+    budget is terminated and finished with timeout_status.
+    '''
+
+    def __init__(self, test_cases, run_test_case, pool_size, failure_status=None, on_finish=None,
+                 limiter=None, cloud_caps=None, timeout=None, timeout_status=None):
+        self.pending = list(test_cases)
+        self.run_test_case = run_test_case
+        self.pool_size = pool_size
+        self.limiter = limiter
+        self.cloud_caps = cloud_caps or {}
+        self.timeout = timeout
+        self.timeout_status = timeout_status
+        self.failure_status = failure_status
+        self.on_finish = on_finish
+        self.running = {}
+        self.statuses = {}
+        self.results = ProcessQueue()
+        self.logger = TestLogger(__name__)
+
+    def _start(self, test_case):
+        process = Process(target=_run_and_report, args=(self.run_test_case, test_case, self.results))
+        process.start()
+        self.running[test_case['test_case_file']] = (process, test_case, time.time())
+        self.logger.info('Test Case Started : %s' % test_case_name(test_case))
+
+    def _finish(self, key, status):
+        if key not in self.running:
+            # Already reaped, a late message from a child that died after reporting
+            return
+        process, test_case, started = self.running.pop(key)
+        process.join()
+        if status is None:
+            status = self.failure_status
+        self.statuses[key] = status
+        if self.on_finish:
+            self.on_finish(test_case, status, time.time() - started)
+        self.logger.info('Test Case Complete : %s with Status of : %s (%s running, %s queued)' %
+                         (test_case_name(test_case), status, len(self.running), len(self.pending)))
+
+    def _capacity(self):
+        if self.limiter:
+            return self.limiter.update()
+        return self.pool_size
+
+    def _next_test_case(self):
+        '''
+        Remove and return the first queued test case whose cloud is below its cap, if any
+        '''
+        running_clouds = {}
+        for process, test_case, started in self.running.values():
+            running_clouds[test_case['cloud']] = running_clouds.get(test_case['cloud'], 0) + 1
+
+        for index, test_case in enumerate(self.pending):
+            cap = self.cloud_caps.get(test_case['cloud'])
+            if cap is None or running_clouds.get(test_case['cloud'], 0) < cap:
+                return self.pending.pop(index)
+        return None
+
+    def _reap(self):
+        '''
+        Finish children that exited abnormally without reporting a status.
+        '''
+        for key in list(self.running.keys()):
+            process, test_case, started = self.running[key]
+            if process.exitcode is not None and process.exitcode != 0:
+                self.logger.warning('Test Case %s exited with code %s without reporting a status' %
+                                    (test_case_name(test_case), process.exitcode))
+                self._finish(key, None)
+
+    def _kill(self, process):
+        '''
+        Stop a child and the processes it started
+        '''
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+            process.join(KILL_GRACE)
+            if process.is_alive():
+                os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            # Already gone
+            pass
+
+    def _expire(self):
+        '''
+        Terminate and finish test cases that ran longer than the timeout
+        '''
+        if not self.timeout:
+            return
+        for key in list(self.running.keys()):
+            process, test_case, started = self.running[key]
+            if time.time() - started > self.timeout:
+                self.logger.warning('Test Case %s exceeded its %s second budget, terminating' %
+                                    (test_case_name(test_case), self.timeout))
+                self._kill(process)
+                self._finish(key, self.timeout_status)
+
+    def run(self):
+        '''
+        Run every test case and return a dictionary of test_case_file to final status.
+        '''
+        while self.pending or self.running:
+            capacity = self._capacity()
+            while self.pending and len(self.running) < capacity:
+                test_case = self._next_test_case()
+                if test_case is None:
+                    break
+                self._start(test_case)
+            try:
+                key, status = self.results.get(timeout=REAP_INTERVAL)
+            except Queue.Empty:
+                self._reap()
+                self._expire()
+                continue
+            self._finish(key, status)
+            self._expire()
+
+        self.logger.info('Testing Complete')
+        return self.statuses
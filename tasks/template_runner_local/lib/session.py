@@ -0,0 +1,54 @@
+# =COPYRIGHT=======================================================
+# Licensed Materials - Property of IBM
+#
+# (c) Copyright IBM Corp. 2017, 2018 All Rights Reserved
+#
+# US Government Users Restricted Rights - Use, duplication or
+# disclosure restricted by GSA ADP Schedule Contract with IBM Corp.
+# =================================================================
+
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from lib.metrics import metrics
+
+# Connections kept open per host, override with CAM_POOL_SIZE
+POOL_SIZE = int(os.getenv('CAM_POOL_SIZE', '20'))
+# Retries on connection errors, and on 502/503/504 for idempotent requests
+RETRIES = int(os.getenv('CAM_RETRIES', '3'))
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+def _create_session():
+    retry = Retry(total=RETRIES, connect=RETRIES, read=RETRIES, backoff_factor=0.5,
+                  status_forcelist=(502, 503, 504), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    # count and time every CAM call per endpoint
+    session.hooks['response'].append(metrics.response_hook)
+    return session
+
+
+def get_session():
+    '''
+    Return the keep-alive session shared by every CAM call of this process. Sessions are not
+    shared across processes, a forked child gets its own pool on first use.
+    '''
+    pid = os.getpid()
+    session = _sessions.get(pid)
+    if session is None:
+        with _lock:
+            session = _sessions.get(pid)
+            if session is None:
+                _sessions.clear()
+                session = _create_session()
+                _sessions[pid] = session
+    return session
@@ -1,56 +1,254 @@
 import os
+import json
+import math
+from collections import deque
+from datetime import datetime, timedelta
 
-def _total(data):
-    total = None
+# Relative precision of the duration percentiles
+HISTOGRAM_PRECISION = 0.01
+# Durations below this many seconds share the lowest bucket
+HISTOGRAM_MIN = 0.001
+# Names of failed stacks kept for the report, every failure is in the results log
+FAILED_NAMES_KEPT = 100
+# Percentiles reported per operation, template and cloud
+PERCENTILES = (50, 90, 99, 99.9)
+# Appended to the report file name for the machine readable summary stress reports are compared on
+SUMMARY_SUFFIX = '.summary.json'
+# Default relative change of a percentile or the throughput reported as a regression
+REGRESSION_THRESHOLD = 0.10
 
-    for i in data:
-        if not total:
-            total = i
-        else:
-            total += i
-    return total
+_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
 
-def dump(stats, target_file='./stats.txt', start_time=None, end_time=None):
+
+class Histogram(object):
     '''
-    Generates a report based on the statistics
+    Durations counted in logarithmic buckets, each HISTOGRAM_PRECISION wider than the one
+    before. Percentiles are exact to that precision, memory depends only on the range of the
+    durations, not on how many were added.
     '''
 
-    dep_durations = []
-    del_durations = []
+    def __init__(self, precision=HISTOGRAM_PRECISION, minimum=HISTOGRAM_MIN):
+        self.minimum = minimum
+        self.log_base = math.log(1 + precision)
+        self.buckets = {}
+        self.count = 0
 
-    failed_deps = []
-    failed_dels = []
+    def _bucket(self, value):
+        if value <= self.minimum:
+            return 0
+        return int(math.log(value / self.minimum) / self.log_base) + 1
 
-    for i in stats:
-        if i['deploy_error']:
-            failed_deps.append(i['stack_name'])
+    def _value(self, bucket):
+        if bucket == 0:
+            return self.minimum
+        # middle of the bucket
+        return self.minimum * math.exp((bucket - 0.5) * self.log_base)
+
+    def add(self, value):
+        bucket = self._bucket(value)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+
+    def percentile(self, percent):
+        '''
+        Return the duration percent of the added durations do not exceed, None if empty
+        '''
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(percent / 100.0 * self.count)))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return self._value(bucket)
+
+
+class Summary(object):
+    '''
+    Running count, failures, total, minimum, maximum and histogram of one operation
+    '''
+
+    def __init__(self):
+        self.passed = 0
+        self.failed = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.histogram = Histogram()
+        self.failed_names = deque(maxlen=FAILED_NAMES_KEPT)
+
+    def add_success(self, seconds):
+        self.passed += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+        self.histogram.add(seconds)
+
+    def add_failure(self, name):
+        self.failed += 1
+        self.failed_names.append(name)
+
+    def average(self):
+        return _duration(self.total / self.passed if self.passed else None)
+
+    def percentile_seconds(self, percent):
+        value = self.histogram.percentile(percent)
+        if value is not None:
+            # the bucket middle may lie just outside the durations seen
+            value = min(max(value, self.min), self.max)
+        return value
+
+    def percentile(self, percent):
+        return _duration(self.percentile_seconds(percent))
+
+    def to_dict(self):
+        summary = {'passed': self.passed, 'failed': self.failed,
+                   'average': self.total / self.passed if self.passed else None,
+                   'min': self.min, 'max': self.max}
+        for percent in PERCENTILES:
+            summary['p%s' % percent] = self.percentile_seconds(percent)
+        return summary
+
+
+def _duration(seconds):
+    if seconds is None:
+        return 'N/A'
+    return timedelta(seconds=seconds)
+
+
+def normalize(result):
+    '''
+    Default the errors of a life cycle result, life_cycle_stack only sets the ones that
+    happened. A destroy was attempted when the result has its duration or its error.
+    '''
+    result.setdefault('deploy_error', None)
+    if 'destroy_duration' in result:
+        result.setdefault('destroy_error', None)
+    return result
+
+
+class StatsAggregator(object):
+    '''
+    Deploy and destroy statistics updated as each life cycle result arrives. Results are not
+    kept in memory, each one is appended to the results log when one is given, so writing the
+    report costs the same however long the run is.
+    '''
+
+    def __init__(self, results_log=None):
+        self.deploy = Summary()
+        self.destroy = Summary()
+        # deploy and destroy summaries per (template, cloud)
+        self.groups = {}
+        self.first_start = None
+        self.last_end = None
+        self.results_log = open(results_log, 'a') if results_log else None
+
+    def add(self, result):
+        normalize(result)
+        group = (result.get('template') or 'N/A', result.get('cloud') or 'N/A')
+        if group not in self.groups:
+            self.groups[group] = (Summary(), Summary())
+        group_deploy, group_destroy = self.groups[group]
+
+        if result['deploy_error']:
+            self.deploy.add_failure(result['stack_name'])
+            group_deploy.add_failure(result['stack_name'])
         else:
-            dep_durations.append(i['deploy_duration'])
+            self.deploy.add_success(result['deploy_duration'].total_seconds())
+            group_deploy.add_success(result['deploy_duration'].total_seconds())
 
-        if 'destroy_error' in i:
-            if i['destroy_error']:
-                failed_dels.append(i['stack_name'])
+        if 'destroy_error' in result:
+            if result['destroy_error']:
+                self.destroy.add_failure(result['stack_name'])
+                group_destroy.add_failure(result['stack_name'])
             else:
-                del_durations.append(i['destroy_duration'])
-    
-    average_dep = 'N/A'
-    average_del = 'N/A'
+                self.destroy.add_success(result['destroy_duration'].total_seconds())
+                group_destroy.add_success(result['destroy_duration'].total_seconds())
+
+        self._add_times(result)
+
+        if self.results_log:
+            self.results_log.write(json.dumps(_serializable(result)) + '\n')
+            self.results_log.flush()
+
+    def _add_times(self, result):
+        start = _parse_time(result.get('deploy_start_time'))
+        if start and (self.first_start is None or start < self.first_start):
+            self.first_start = start
+        for key in ('deploy_end_time', 'destroy_end_time'):
+            end = _parse_time(result.get(key))
+            if end and (self.last_end is None or end > self.last_end):
+                self.last_end = end
+
+    def throughput(self):
+        '''
+        Return the successful deployments per hour between the first deployment start and
+        the last end seen, None before one finished
+        '''
+        if self.first_start is None or self.last_end is None or self.last_end <= self.first_start:
+            return None
+        return self.deploy.passed / ((self.last_end - self.first_start).total_seconds() / 3600.0)
 
-    max_dep = 'N/A'
-    max_del = 'N/A'
+    def summary(self):
+        '''
+        Return the totals and percentiles in seconds, overall and per template and cloud
+        '''
+        return {'throughput': self.throughput(),
+                'deploy': self.deploy.to_dict(),
+                'destroy': self.destroy.to_dict(),
+                'groups': [{'template': template, 'cloud': cloud,
+                            'deploy': deploy.to_dict(), 'destroy': destroy.to_dict()}
+                           for (template, cloud), (deploy, destroy) in sorted(self.groups.items())]}
 
-    min_dep = 'N/A'
-    min_del = 'N/A'
+    def close(self):
+        if self.results_log:
+            self.results_log.close()
+            self.results_log = None
 
-    if len(del_durations) > 0:
-        average_del = _total(del_durations) / len(del_durations)
-        min_del = min(del_durations)
-        max_del = max(del_durations)
+    def dump(self, target_file='./stats.txt', start_time=None, end_time=None):
+        '''
+        Generates a report based on the statistics, and its summary next to it
+        '''
+        _write_report(self, target_file, start_time, end_time)
+        with open(target_file + SUMMARY_SUFFIX, 'w') as summary_file:
+            json.dump(self.summary(), summary_file, indent=2, sort_keys=True)
 
-    if len(dep_durations) > 0:
-        average_dep = _total(dep_durations) / len(dep_durations)
-        min_dep = min(dep_durations)
-        max_dep = max(dep_durations)
+
+def _parse_time(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, _TIME_FORMAT)
+    except ValueError:
+        return None
+
+
+def _serializable(result):
+    record = {}
+    for key, value in result.items():
+        if isinstance(value, timedelta):
+            value = value.total_seconds()
+        elif isinstance(value, type):
+            value = value.__name__
+        elif isinstance(value, BaseException):
+            value = repr(value)
+        record[key] = value
+    return record
+
+
+def dump(stats, target_file='./stats.txt', start_time=None, end_time=None):
+    '''
+    Generates a report based on the statistics
+    '''
+    aggregator = StatsAggregator()
+    for i in stats:
+        aggregator.add(i)
+    aggregator.dump(target_file, start_time=start_time, end_time=end_time)
+
+
+def _write_report(aggregator, target_file, start_time=None, end_time=None):
+    deploy = aggregator.deploy
+    destroy = aggregator.destroy
 
     report_file = open(target_file, 'w')
 
@@ -104,33 +302,99 @@ def dump(stats, target_file='./stats.txt', start_time=None, end_time=None):
         report_file.write('End time: %s\n' % end_time)
 
     # Deploy stats
-    report_file.write('\nNumber of attempted deployments: %s\n' %
-                      (len(dep_durations) + len(failed_deps)))
-    report_file.write('Number of failed: %s\nNumber of passed: %s' %
-                      (len(failed_deps), len(dep_durations)))
-    report_file.write('\nAverage duration for success: %s' %
-                      (average_dep))
-    report_file.write('\nMinimum time: %s' % min_dep)
-    report_file.write('\nMaximum time: %s' % max_dep)
+    _write_summary(report_file, deploy, 'deployments')
+
+    throughput = aggregator.throughput()
+    report_file.write('\nThroughput: %s' % ('%.2f deployments per hour' % throughput if throughput is not None else 'N/A'))
 
     # Delete stats
-    report_file.write('\n\nNumber of attempted deletes: %s\n' %
-                      (len(del_durations) + len(failed_dels)))
+    report_file.write('\n')
+    _write_summary(report_file, destroy, 'deletes')
+
+    # Per template and cloud
+    for (template, cloud), (group_deploy, group_destroy) in sorted(aggregator.groups.items()):
+        report_file.write('\n\nTemplate: %s, cloud: %s\n' % (template, cloud))
+        _write_summary(report_file, group_deploy, 'deployments')
+        report_file.write('\n')
+        _write_summary(report_file, group_destroy, 'deletes')
+
+    _write_failures(report_file, deploy, 'Failed deployments', aggregator)
+    _write_failures(report_file, destroy, 'Failed deletions', aggregator)
+
+    report_file.close()
+
+
+def _write_summary(report_file, summary, operation):
+    report_file.write('\nNumber of attempted %s: %s\n' %
+                      (operation, summary.passed + summary.failed))
     report_file.write('Number of failed: %s\nNumber of passed: %s' %
-                      (len(failed_dels), len(del_durations)))
+                      (summary.failed, summary.passed))
     report_file.write('\nAverage duration for success: %s' %
-                      (average_del))
-    report_file.write('\nMinimum time: %s' % min_del)
-    report_file.write('\nMaximum time: %s' % max_del)
+                      (summary.average()))
+    report_file.write('\nMinimum time: %s' % _duration(summary.min))
+    report_file.write('\nMaximum time: %s' % _duration(summary.max))
+    report_file.write('\nMedian time: %s' % summary.percentile(50))
+    report_file.write('\n90th percentile: %s' % summary.percentile(90))
+    report_file.write('\n99th percentile: %s' % summary.percentile(99))
+    report_file.write('\n99.9th percentile: %s' % summary.percentile(99.9))
 
-    if len(failed_deps) > 0:
-        report_file.write('\n\nFailed deployments:\n')
-        for i in failed_deps:
-            report_file.write(i + '\n')
 
-    if len(failed_dels) > 0:
-        report_file.write('\n\nFailed deletions:\n')
-        for i in failed_dels:
+def _write_failures(report_file, summary, title, aggregator):
+    if summary.failed > 0:
+        report_file.write('\n\n%s:\n' % title)
+        for i in summary.failed_names:
             report_file.write(i + '\n')
+        earlier = summary.failed - len(summary.failed_names)
+        if earlier and aggregator.results_log:
+            report_file.write('... and %s earlier, see %s\n' % (earlier, aggregator.results_log.name))
+        elif earlier:
+            report_file.write('... and %s earlier\n' % earlier)
 
-    report_file.close()
+
+def load_summary(report_file):
+    '''
+    Load the summary written next to a stress report, report_file may name either
+    '''
+    if not report_file.endswith(SUMMARY_SUFFIX):
+        report_file += SUMMARY_SUFFIX
+    with open(report_file) as summary_file:
+        return json.load(summary_file)
+
+
+def _change(baseline, current):
+    if baseline is None or current is None or baseline == 0:
+        return None
+    return (current - baseline) / float(baseline)
+
+
+def compare(baseline, current, threshold=REGRESSION_THRESHOLD):
+    '''
+    Compare two stress report summaries. Return one row per metric with the baseline value,
+    the current value, the relative change and whether it regressed by more than threshold:
+    a percentile that grew, or a throughput that dropped.
+    '''
+    rows = []
+
+    def add_row(template, cloud, operation, metric, baseline_value, current_value, higher_is_worse=True):
+        change = _change(baseline_value, current_value)
+        regression = change is not None and (change > threshold if higher_is_worse else -change > threshold)
+        rows.append({'template': template, 'cloud': cloud, 'operation': operation, 'metric': metric,
+                     'baseline': baseline_value, 'current': current_value, 'change': change,
+                     'regression': regression})
+
+    def add_rows(template, cloud, baseline_group, current_group):
+        for operation in ('deploy', 'destroy'):
+            for percent in PERCENTILES:
+                metric = 'p%s' % percent
+                add_row(template, cloud, operation, metric,
+                        baseline_group[operation].get(metric), current_group[operation].get(metric))
+
+    add_row('all', 'all', 'deploy', 'throughput', baseline.get('throughput'), current.get('throughput'),
+            higher_is_worse=False)
+    add_rows('all', 'all', baseline, current)
+    baseline_groups = dict(((group['template'], group['cloud']), group) for group in baseline.get('groups', []))
+    for group in current.get('groups', []):
+        key = (group['template'], group['cloud'])
+        if key in baseline_groups:
+            add_rows(key[0], key[1], baseline_groups[key], group)
+    return rows
@@ -34,13 +34,26 @@ import time
 import glob
 import datetime
 import math
+import shlex
+import pipes
 
 from threading import Thread
 from multiprocessing import Pool, TimeoutError, Process, Queue
+from Queue import Queue as ThreadQueue
 
 import lib.local.env as env
 from lib.logger import TestLogger
 import lib.worker as worker
+from lib.scheduler import TestScheduler
+from lib.state import StateStore, STATE_FILE, test_case_name
+from lib.iaas import IaaS
+from lib.concurrency import AdaptiveLimit, parse_cloud_caps
+from lib.history import DurationHistory, HISTORY_FILE, PHASE_LIFECYCLE, PHASE_DEPLOY, history_key, longest_first
+import lib.keypool as keypool
+import lib.ippool as ippool
+from lib.metrics import METRICS_FILE
+from lib.imports import REFERENCE_TIMEOUT
+import template_runner_local
 
 
 logger = TestLogger(__name__)
@@ -50,6 +63,20 @@ dir_to_cloud = {"vmware": "vsphere", "aws": "aws", "ibmcloud": "ibm"}
 test_pool = 7
 worker_pause = 60
 
+# Suite state store, opened in main() and shared with the test case processes
+state_store = None
+# Durations of past runs, shared by all suites
+duration_history = None
+# Test cases stopped by the scheduler whose stacks still need to be destroyed, consumed by
+# the cleanup thread of _run_test_events while the suite goes on
+timed_out_test_cases = None
+
+# Run test cases in a forked copy of this process rather than a new interpreter
+in_process = False
+# Authenticated IaaS clients by CAM instance, created before forking when running in process
+cam_clients = {}
+CAM_PORT = '30000'
+
 
 # Exit Codes
 EXIT_DIRECTORY_EXISTS = 2
@@ -59,36 +86,144 @@ CASE_UNTESTED = "case_untested"
 CASE_INPROGRESS = "case_inprogress"
 CASE_SUCCESS = "case_success"
 CASE_FAILURE = "case_failure"
+CASE_TIMEOUT = "case_timeout"
 
 def _run_test_case(test_cases, index):
 
     '''
-    Run a single test case, update the status once complete.
+    Run a single test case, update the status once complete and return it.
     '''
 
     test_case = test_cases[index]
+    test_name = test_case_name(test_case)
 
-    # Set status to in progress
-    fp = open(test_case['test_case_file'], 'w+')
-    test_case['status'] = CASE_INPROGRESS
-    json.dump(test_case, fp)
-    fp.close()
+    # Claim the test case, another runner may already have picked it up
+    if not state_store.transition(test_name, CASE_INPROGRESS, [CASE_UNTESTED, CASE_FAILURE, CASE_TIMEOUT]):
+        logger.warning('Test case %s is already claimed, skipping' % test_name)
+        return state_store.get_status(test_name)
 
     # Execute the test
-    result = os.system(test_case['command_line'] + '1>' + test_case['log_file'] + ' 2>&1')
+    started = time.time()
+    if in_process:
+        result, durations = _execute_in_process(test_case)
+    else:
+        result, durations = _execute_command(test_case)
 
     if result == 0:
-        fp = open(test_case['test_case_file'], 'w+')
         test_case['status'] = CASE_SUCCESS
-        json.dump(test_case, fp)
-        fp.close()
+        durations[PHASE_LIFECYCLE] = time.time() - started
     else:
-        fp = open(test_case['test_case_file'], 'w+')
         test_case['status'] = CASE_FAILURE
-        json.dump(test_case, fp)
-        fp.close()
+    _record_durations(test_case, durations)
+    state_store.transition(test_name, test_case['status'])
+
+    return test_case['status']
+
+def _record_durations(test_case, durations):
+
+    '''
+    Keep the durations of the test case for the ordering and poll timing of later runs
+    '''
+
+    for phase, seconds in durations.items():
+        try:
+            duration_history.record(test_case, phase, seconds)
+        except Exception:
+            logger.exception('Failed to record the %s duration of %s' % (phase, test_case_name(test_case)))
+
+def _execute_command(test_case):
+
+    '''
+    Run the test case with a new template_runner_local.py process. Return its exit code and
+    the deploy and destroy durations it reported.
+    '''
+
+    result_file = test_case['log_file'] + '.result.json'
+    if os.path.exists(result_file):
+        os.remove(result_file)
+    result = os.system('%s=%s ' % (template_runner_local.RESULT_FILE, pipes.quote(result_file)) +
+                       test_case['command_line'] + ' 1>' + test_case['log_file'] + ' 2>&1')
+    durations = {}
+    try:
+        with open(result_file) as fp:
+            durations = json.load(fp)
+    except (IOError, ValueError):
+        pass
+    return result, durations
+
+def _execute_in_process(test_case):
+
+    '''
+    Run the test case by calling the template runner in this process, which is a fork of the
+    suite runner, so imports and the authenticated CAM client are already in place. Every test
+    case runs in its own fork because the runner configures the cloud connection through
+    process wide environment variables. Output goes to the test case log file.
+    Return 0 on success like the command line would, and the deploy and destroy durations.
+    '''
+
+    log_file = open(test_case['log_file'], 'w')
+    os.dup2(log_file.fileno(), sys.stdout.fileno())
+    os.dup2(log_file.fileno(), sys.stderr.fileno())
+
+    durations = {}
+    try:
+        args = template_runner_local.build_parser().parse_args(shlex.split(test_case['command_line'])[2:])
+        result = template_runner_local.run(args, iaas=cam_clients.get(test_case['cam_instance']), durations=durations)
+    except BaseException:
+        logger.exception('Test case %s failed' % test_case_name(test_case))
+        return 1, durations
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    return 0, durations
+
+def _prepare_in_process(test_cases):
 
-def _generate_runnable_test_case(test_case):
+    '''
+    Load the modules the template runner imports lazily and authenticate once against every
+    CAM instance in the suite so forked test cases share them.
+    '''
+
+    try:
+        from Crypto.PublicKey import RSA
+    except ImportError:
+        pass
+
+    for cam_instance in set(test_case['cam_instance'] for test_case in test_cases):
+        try:
+            _get_cam_client(cam_instance)
+        except Exception:
+            logger.exception('Failed to authenticate against %s, test cases will authenticate on their own' % cam_instance)
+
+def _get_cam_client(cam_instance):
+
+    '''
+    Return an authenticated IaaS client for the CAM instance, creating it on first use.
+    '''
+
+    if cam_instance not in cam_clients:
+        os.environ['ENV'] = os.getenv('ENV', 'local')
+        env.set_env(cam_instance, CAM_PORT, 'local')
+        cam_clients[cam_instance] = IaaS()
+    return cam_clients[cam_instance]
+
+def _run_scheduled_test_case(test_case):
+
+    '''
+    Run a single test case on behalf of the TestScheduler and return its status.
+    '''
+
+    return _run_test_case([test_case], 0)
+
+def _stack_name(test_case):
+
+    '''
+    Name of the CAM stack deployed by the test case
+    '''
+
+    return 'camtest-' + test_case_name(test_case)
+
+def _generate_runnable_test_case(test_case, expected_duration=None):
 
     '''
     Create the run_command field for the test case in question. The values for this field
@@ -97,6 +232,7 @@ def _generate_runnable_test_case(test_case):
     - test case
     - testing variables
     - environment varibales where neccessary
+    - the deploy duration of earlier runs, if known
     '''
 
     # Determine connection type
@@ -117,7 +253,7 @@ def _generate_runnable_test_case(test_case):
 
     template_runner_command = 'template_runner_local.py'
     template_runner_template = ' -t ' + test_case['template_file']
-    template_runner_stack = ' -n ' + 'camtest-' + test_case['template_name'] + '_' + test_case['cloud'] + '_' + test_case['test_case']
+    template_runner_stack = ' -n ' + _stack_name(test_case)
     template_runner_instance = ' -c ' + test_case['cam_instance']
     template_runner_connection = connection
     template_runner_branch = ' -b ' + test_case['branch']
@@ -127,6 +263,9 @@ def _generate_runnable_test_case(test_case):
     template_runner_override = ' -o ' + os.path.split(test_case['template_file'])[0] + os.sep + 'override_variables.json'
     template_runner_testvars = ' -tf ' + test_case['testing_variables']
     template_runner_testcase = ' -uc ' + test_case['test_case']
+    template_runner_expected = ''
+    if expected_duration:
+        template_runner_expected = ' -ed %d' % expected_duration
 
     command_line = 'python ' \
         + template_runner_command \
@@ -141,6 +280,7 @@ def _generate_runnable_test_case(test_case):
         + template_runner_override \
         + template_runner_testvars \
         + template_runner_testcase \
+        + template_runner_expected \
 
     test_case['command_line'] = command_line
 
@@ -154,15 +294,14 @@ def _generate_test_status(test_cases):
 
     result = True
     success_tests = 0
+    statuses = state_store.statuses()
     for test_case in test_cases:
 
-        test_name = test_case['template_name'] + '_' + test_case['cloud'] + '_' + test_case['test_case']
-        fp = open(test_case['test_case_file'])
-        test_case_result = json.load(fp)
-        fp.close()
+        test_name = test_case_name(test_case)
+        status = statuses.get(test_name)
 
-        logger.info('%s : %s' % (test_name, test_case_result['status']))
-        if not test_case_result['status'] == CASE_SUCCESS:
+        logger.info('%s : %s' % (test_name, status))
+        if not status == CASE_SUCCESS:
             result = False
         else:
             success_tests = success_tests + 1
@@ -193,18 +332,17 @@ def _run_test_queue(runnable_test_cases, test_cases):
         logger.info('Currently running tests %s-%s of %s' % (str(floor), str(ceiling), str(len(runnable_test_cases))))
         time.sleep(worker_pause)
         keep_trying = False
+        statuses = state_store.statuses()
         for index in test_indices:
-            fp = open(runnable_test_cases[index]['test_case_file'])
-            test_case = json.load(fp)
-            fp.close()
-            test_name = test_case['template_name'] + '_' + test_case['cloud'] + '_' + test_case['test_case']
+            test_name = test_case_name(runnable_test_cases[index])
+            status = statuses.get(test_name)
 
             # If we're in progress, keep going. Otherwise, add the index to the list of indices to remove
-            if test_case['status'] == CASE_INPROGRESS or test_case['status'] == CASE_UNTESTED:
+            if status == CASE_INPROGRESS or status == CASE_UNTESTED:
                 keep_trying = True
             else:
                 remove_indices.append(index)
-            logger.info('Test Case Running : %s with Status of : %s' % (test_name, test_case['status']))
+            logger.info('Test Case Running : %s with Status of : %s' % (test_name, status))
 
         for remove_index in remove_indices:
             try:
@@ -263,14 +401,13 @@ def _run_test_worker_pool(runnable_test_cases, test_cases):
             logger.info('Currently Running Job %s of %s' % (str(job_index), str(len(job_matrix))))
             time.sleep(worker_pause)
             keep_trying = False
+            statuses = state_store.statuses()
             for index in range(len(job)):
-                fp = open(job[index]['test_case_file'])
-                test_case = json.load(fp)
-                fp.close()
-                test_name = test_case['template_name'] + '_' + test_case['cloud'] + '_' + test_case['test_case']
-                if test_case['status'] == CASE_INPROGRESS:
+                test_name = test_case_name(job[index])
+                status = statuses.get(test_name)
+                if status == CASE_INPROGRESS:
                     keep_trying = True
-                logger.info('Test Case Running : %s with Status of : %s' % (test_name, test_case['status']))
+                logger.info('Test Case Running : %s with Status of : %s' % (test_name, status))
 
         logger.info('No more tests in progress, waiting for all worker threads to complete')
         for worker in workers:
@@ -283,10 +420,97 @@ def _run_test_worker_pool(runnable_test_cases, test_cases):
     return _generate_test_status(test_cases)
 
 
+def _record_finished_test_case(test_case, status, duration):
+
+    '''
+    A child that died without reporting or was stopped leaves its test case in progress, record
+    the failure or timeout. Durations are recorded by the test case itself.
+    '''
+
+    if status == CASE_TIMEOUT and timed_out_test_cases is not None:
+        timed_out_test_cases.put(test_case)
+    state_store.transition(test_case_name(test_case), status, [CASE_INPROGRESS])
+
+
+def _cleanup_timed_out_test_case(test_case):
+
+    '''
+    Destroy and delete the stack left behind by a test case that ran out of time, then release
+    the template reference and the IP addresses the stopped test case held.
+    '''
+
+    stack_name = _stack_name(test_case)
+    logger.info('Cleaning up the stack of timed out test case: %s' % stack_name)
+    iaas = _get_cam_client(test_case['cam_instance'])
+    try:
+        for stack in iaas.retrieveAll().json():
+            if stack['name'] == stack_name:
+                iaas.destroy(stack)
+                iaas.waitForSuccess(stack, worker._10_MINUTES)
+                iaas.delete(stack)
+                logger.info('Successfully destroyed and deleted %s' % stack_name)
+        worker.template_imports.release_holder(iaas, stack_name)
+    except Exception:
+        logger.exception('Failed to clean up the stack of timed out test case %s' % stack_name)
+    finally:
+        # the stack may never have been created, its addresses are reserved all the same
+        ippool.release_owner(stack_name)
+
+
+def _cleanup_timed_out_test_cases(cleanup_queue):
+
+    '''
+    Clean up the test cases put on cleanup_queue as they time out, until None is put.
+    '''
+
+    while True:
+        test_case = cleanup_queue.get()
+        if test_case is None:
+            return
+        _cleanup_timed_out_test_case(test_case)
+
+def _run_test_events(runnable_test_cases, test_cases, adaptive=False, max_pool=test_pool, cloud_caps=None, timeout=None):
+
+    '''
+    Run the test cases with the event driven scheduler. A new test case is started as soon as
+    a running one completes rather than after the next status poll.
+
+    With adaptive set, the number of running test cases starts at test_pool and follows the
+    health of CAM between 1 and max_pool. cloud_caps limits running test cases per cloud.
+    A test case running longer than timeout seconds is stopped and its stack destroyed.
+    '''
+
+    limiter = None
+    if adaptive and runnable_test_cases:
+        iaas = _get_cam_client(runnable_test_cases[0]['cam_instance'])
+        limiter = AdaptiveLimit(iaas, test_pool, maximum=max_pool)
+
+    global timed_out_test_cases
+    timed_out_test_cases = ThreadQueue()
+    cleaner = Thread(target=_cleanup_timed_out_test_cases, args=(timed_out_test_cases,))
+    cleaner.daemon = True
+    cleaner.start()
+
+    scheduler = TestScheduler(runnable_test_cases, _run_scheduled_test_case, test_pool,
+                              failure_status=CASE_FAILURE, on_finish=_record_finished_test_case,
+                              limiter=limiter, cloud_caps=cloud_caps,
+                              timeout=timeout, timeout_status=CASE_TIMEOUT)
+    scheduler.run()
+    # wait for the stacks of the last timed out test cases
+    timed_out_test_cases.put(None)
+    cleaner.join()
+
+    return _generate_test_status(test_cases)
+
+
 def main():
     '''
     Generate a library of testcases based upon a test suite.
     '''
+    global state_store
+    global duration_history
+    global in_process
+
     parser = argparse.ArgumentParser(
         description='Generate a library of testcases based upon a test suite.',
         epilog='')
@@ -297,7 +521,49 @@ def main():
     parser.add_argument(
         '--use_queue', default=False, action='store_true',
         help="Use queue-based deploy rather than worker pool (default: False)")
+    parser.add_argument(
+        '--use_events', default=False, action='store_true',
+        help="Start the next test case as soon as a running one completes (default: False)")
+    parser.add_argument(
+        '--in_process', default=False, action='store_true',
+        help="Run test cases in a fork of this process sharing imports and the CAM login, "
+             "rather than a new template_runner_local.py process (default: False)")
+    parser.add_argument(
+        '--adaptive', default=False, action='store_true',
+        help="With --use_events, raise or lower the number of running test cases following "
+             "the health of CAM (default: False)")
+    parser.add_argument(
+        '--max_pool', type=int, default=None,
+        help="Upper limit of running test cases with --adaptive (default: 25)")
+    parser.add_argument(
+        '--cloud_caps', nargs='+', default=[],
+        help="With --use_events, maximum running test cases per cloud, for example vsphere=3 aws=10")
+    parser.add_argument(
+        '--test_case_timeout', type=int, required=False,
+        help="With --use_events, minutes a test case may run before it is stopped, marked "
+             "%s and its stack destroyed (default: no limit)" % CASE_TIMEOUT)
+    parser.add_argument(
+        '--order', choices=['name', 'longest_first'], default='name',
+        help="Order of the test cases, longest_first starts the test cases with the longest "
+             "recorded duration first and interleaves clouds (default: name)")
+    parser.add_argument(
+        '--reuse_ssh_key', default=False, action='store_true',
+        help="Give every test case of the run the same generated public SSH key rather than "
+             "a new key per deployment (default: False)")
+    parser.add_argument(
+        '--metrics_file', type=str, required=False,
+        help="JSON lines file every test case appends its phase timings and CAM call "
+             "statistics to (default: no metrics)")
+    parser.add_argument(
+        '--history_file', type=str, required=False,
+        help="Duration history file, default: %s next to the suite directory" % HISTORY_FILE)
     args = parser.parse_args()
+    if not args.use_events:
+        # only the event driven scheduler applies these
+        for option, given in [('--adaptive', args.adaptive), ('--max_pool', args.max_pool),
+                              ('--cloud_caps', args.cloud_caps), ('--test_case_timeout', args.test_case_timeout)]:
+            if given:
+                parser.error('%s requires --use_events' % option)
 
     # Get root directory of test
     if not os.path.isdir(args.base_dir):
@@ -309,24 +575,72 @@ def main():
     if not os.getenv('GIT_TOKEN', None):
         sys.exit('Error: GIT_TOKEN environment variable must be set')
 
-    # Create structure of tests to be performed
+    # Create structure of tests to be performed. The state store holds every test case of the
+    # suite, only test case files it has not seen yet need to be read.
+    state_store = StateStore(os.path.join(base_dir, STATE_FILE))
+    if args.history_file:
+        duration_history = DurationHistory(args.history_file)
+    else:
+        duration_history = DurationHistory(os.path.join(os.path.dirname(os.path.abspath(base_dir)), HISTORY_FILE))
 
-    test_cases = []
+    # Only test case files the store has not seen, or that were edited since, need to be read.
+    # An edited file wins over the store, setting its status is how a test case is run again.
+    known_test_cases = state_store.file_mtimes()
+    new_test_cases = []
     for test_case_file in glob.glob(base_dir + os.sep + '*.json'):
+        name = os.path.basename(test_case_file).split('.')[0]
+        if name in known_test_cases and os.path.getmtime(test_case_file) == known_test_cases[name]:
+            continue
         fp = open(test_case_file)
         test_case = json.load(fp)
-        logger.info('Found test case:  %s with status: %s' % (os.path.basename(test_case_file).split('.')[0], test_case['status']))
-        if test_case['status'] == CASE_UNTESTED or test_case['status'] == CASE_FAILURE:
-            test_cases.append(test_case)
         fp.close()
+        test_case.setdefault('test_case_file', test_case_file)
+        if name in known_test_cases:
+            logger.info('Test case file %s was edited, status: %s' % (test_case_file, test_case['status']))
+            state_store.put(test_case)
+        else:
+            new_test_cases.append(test_case)
+    state_store.add(new_test_cases)
+
+    # Test cases a crashed runner left in progress are run again
+    for test_name in state_store.reset_orphaned(CASE_INPROGRESS, CASE_FAILURE):
+        logger.warning('Test case %s was left in progress by a runner that no longer runs' % test_name)
+
+    for test_name, status in sorted(state_store.statuses().items()):
+        logger.info('Found test case:  %s with status: %s' % (test_name, status))
+    test_cases = state_store.test_cases([CASE_UNTESTED, CASE_FAILURE, CASE_TIMEOUT])
 
     # Resolve template_runner command line
     runnable_test_cases = []
+    expected_deploy = duration_history.expected_all(PHASE_DEPLOY)
     for test_case in test_cases:
-        runnable_test_case = _generate_runnable_test_case(test_case)
+        runnable_test_case = _generate_runnable_test_case(test_case, expected_deploy.get(history_key(test_case)))
         runnable_test_cases.append(runnable_test_case)
 
-    if args.use_queue:
+    if args.order == 'longest_first':
+        runnable_test_cases = longest_first(runnable_test_cases, duration_history.expected_all(PHASE_LIFECYCLE))
+
+    if args.reuse_ssh_key:
+        # inherited by every test case process through its environment
+        os.environ[keypool.SUITE_SSH_KEY] = keypool.generate_public_key()
+
+    if args.metrics_file:
+        # inherited by every test case process through its environment
+        os.environ[METRICS_FILE] = os.path.abspath(args.metrics_file)
+
+    if args.test_case_timeout:
+        # inherited by every test case process through its environment
+        os.environ[REFERENCE_TIMEOUT] = str(args.test_case_timeout * 60)
+
+    if args.in_process:
+        in_process = True
+        _prepare_in_process(runnable_test_cases)
+
+    if args.use_events:
+        _run_test_events(runnable_test_cases, test_cases, adaptive=args.adaptive, max_pool=args.max_pool or 25,
+                         cloud_caps=parse_cloud_caps(args.cloud_caps),
+                         timeout=args.test_case_timeout * 60 if args.test_case_timeout else None)
+    elif args.use_queue:
         _run_test_queue(runnable_test_cases, test_cases)
     else:
         _run_test_worker_pool(runnable_test_cases, test_cases)
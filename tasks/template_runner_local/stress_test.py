@@ -0,0 +1,158 @@
+#! /usr/bin/env python
+# =COPYRIGHT=======================================================
+# Licensed Materials - Property of IBM
+#
+# (c) Copyright IBM Corp. 2017, 2018 All Rights Reserved
+#
+# US Government Users Restricted Rights - Use, duplication or
+# disclosure restricted by GSA ADP Schedule Contract with IBM Corp.
+# =================================================================
+"""Stress test CLI -- see 'stress_test -h' for usage"""
+import os
+import sys
+import time
+
+import argparse
+
+import lib.local.env as env
+from lib.logger import TestLogger
+from lib.iaas import IaaS
+from lib.catalog import Catalog
+from lib.concurrency import parse_arrival
+from lib.watcher import shared_watcher
+import lib.metrics as metrics
+import lib.worker as worker
+from template_runner_local import env_or_cli, set_connection_env
+
+
+LOGGER = TestLogger(__name__)
+
+
+def build_parser():
+    '''
+    Returns the command line parser of the stress test
+    '''
+    parser = argparse.ArgumentParser(
+        description='Deploys and destroys the templates of the local catalog ($CATALOG_HOME) '
+                    'against CAM for a while and reports the deploy and destroy statistics.')
+    parser.add_argument(
+        '-c', '--cam_url', type=str, required=True,
+        help='CAM Local URL IP Address')
+    parser.add_argument(
+        '-p', '--cam_port', type=str, default='30000',
+        help='CAM Local Port Number (default: 30000)')
+    parser.add_argument(
+        '-w', '--workers', type=int, default=1,
+        help='Number of stress workers (default: 1)')
+    parser.add_argument(
+        '-d', '--duration', type=float, default=1.0,
+        help='Hours to run the stress test for (default: 1.0)')
+    parser.add_argument(
+        '-a', '--arrival', type=str, required=False,
+        help='Start deployments at a fixed rate per worker instead of after the previous one '
+             'finished: constant=<per hour>, poisson=<per hour> or '
+             'ramp=<start per hour>:<end per hour>:<seconds> (default: closed loop)')
+    parser.add_argument(
+        '--max_outstanding', type=int, required=False,
+        help='Stacks in flight per worker with --arrival, later arrivals are skipped '
+             '(default: STRESS_MAX_OUTSTANDING or 50)')
+    parser.add_argument(
+        '--random_delete', default=False, action='store_true',
+        help='Keep a random half of the deployments instead of destroying them (default: False)')
+    parser.add_argument(
+        '--get_templates', default=False, action='store_true',
+        help='Download the prebuilt templates of the CAM catalog to $CATALOG_HOME first '
+             '(default: False)')
+    parser.add_argument(
+        '-r', '--report', type=str, default='./stats.txt',
+        help='Statistics report, rewritten at every collection (default: ./stats.txt)')
+    parser.add_argument(
+        '--html_report', type=str, required=False,
+        help='Also write the percentiles per template and cloud to this HTML file (default: none)')
+    parser.add_argument(
+        '--results_log', type=str, default='./results.log',
+        help='Log of every deploy and destroy, unless RESULTS_LOG is set (default: ./results.log)')
+    parser.add_argument(
+        '--stat_interval', type=str, default='60',
+        help='Seconds between two statistics collections, unless STAT_COLLECTION_INTERVAL '
+             'is set (default: 60)')
+    parser.add_argument(
+        '--metrics_file', type=str, required=False,
+        help="Append the phase timings and CAM call statistics to this JSON lines file, "
+             "unless METRICS_FILE is set (default: no metrics)")
+    parser.add_argument(
+        '--metrics_port', type=int, required=False,
+        help='Serve the phase timings and CAM call statistics for Prometheus on this port '
+             '(default: not served)')
+
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument(
+        '-aws', '--aws_cloud_connection', type=str,
+        help='Cloud connection name for AWS')
+    group.add_argument(
+        '-ibmcloud', '--ibmcloud_cloud_connection', type=str,
+        help='Cloud connection name for IBM-Cloud (Softlayer)')
+    group.add_argument(
+        '-vmware', '--vmware_cloud_connection', type=str,
+        help='Cloud connection name for VMWare (VMWare)')
+
+    return parser
+
+
+def main():
+    '''
+    Runs the stress workers and their monitor until the duration elapsed
+    '''
+    parser = build_parser()
+    args = parser.parse_args()
+    if args.max_outstanding and not args.arrival:
+        parser.error('--max_outstanding requires --arrival')
+
+    if not os.getenv('CATALOG_HOME', None):
+        sys.exit('Error: CATALOG_HOME environment variable must be '
+                 'set (see help)')
+    env_or_cli('ENV', 'local')
+    env_or_cli('VM_URL', args.cam_url)
+    env_or_cli('CAM_PORT', args.cam_port)
+    env_or_cli('RESULTS_LOG', args.results_log)
+    env_or_cli('STAT_COLLECTION_INTERVAL', args.stat_interval)
+    # catalog templates are deployed with the values of their variables.json
+    env_or_cli('TEMPLATE_TRANSLATION', 'false')
+    set_connection_env('AWS_CLOUD_CONNECTION', args.aws_cloud_connection)
+    set_connection_env('IBMCLOUD_CLOUD_CONNECTION',
+                       args.ibmcloud_cloud_connection)
+    set_connection_env('VSPHERE_CLOUD_CONNECTION', args.vmware_cloud_connection)
+    set_connection_env(metrics.METRICS_FILE, args.metrics_file)
+    env.set_env(args.cam_url, args.cam_port, "local")  # set environment
+
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+
+    if args.get_templates:
+        Catalog().get_templates()
+
+    arrival = parse_arrival(args.arrival) if args.arrival else None
+    # one watcher tracks the stacks of every worker
+    watcher = shared_watcher(IaaS())
+    workers = [worker.StressWorker(number, duration=args.duration, random_delete=args.random_delete,
+                                   watcher=watcher, arrival=arrival,
+                                   max_outstanding=args.max_outstanding or worker.MAX_OUTSTANDING)
+               for number in range(args.workers)]
+    monitor = worker.MonitorWorker(workers, args.report, html_report=args.html_report)
+
+    LOGGER.info('Starting %s stress workers for %s hours' % (args.workers, args.duration))
+    for stress_worker in workers:
+        stress_worker.start()
+    monitor.start()
+    try:
+        while monitor.isAlive():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        LOGGER.info('Stopping the stress workers, the stacks in flight finish first')
+        for stress_worker in workers:
+            stress_worker.kill()
+        monitor.join()
+    watcher.kill()
+
+if __name__ == "__main__":
+    main()